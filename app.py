@@ -2,644 +2,67 @@
 
 import gradio as gr
 import pandas as pd
-import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import random
-import json
 import asyncio
-import time
-import os
+import threading
+import functools
 from datetime import datetime
-from dataclasses import dataclass, asdict
-from typing import Dict, List, Any, Tuple, Optional
+from dataclasses import asdict
 
-# LangChain imports
-try:
-    from langchain_openai import ChatOpenAI
-    from langchain_anthropic import ChatAnthropic
-    from langchain_google_genai import ChatGoogleGenerativeAI
-    from langchain_community.llms import Ollama
-    from langchain_core.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
-    from langchain_core.output_parsers import StrOutputParser
-    from langchain_core.runnables import RunnablePassthrough, RunnableParallel
-    from langchain.schema import BaseMessage, HumanMessage, SystemMessage
-    from langchain.callbacks import get_openai_callback
-    LANGCHAIN_AVAILABLE = True
-except ImportError:
-    LANGCHAIN_AVAILABLE = False
-    print("LangChainライブラリが見つかりません。pip install langchain langchain-openai langchain-anthropic langchain-google-genaiを実行してください。")
-
-@dataclass
-class HumanPersona:
-    """人間ペルソナプロファイル"""
-    id: int
-    age: int
-    gender: str
-    country: str
-    occupation: str
-    education: str
-    income_level: str
-    family_status: str
-    language: str
-    urban_rural: str
-    continent: str
-
-@dataclass
-class AnimalPersona:
-    """動物ペルソナプロファイル"""
-    id: int
-    species: str
-    habitat: str
-    size_category: str
-    diet_type: str
-    activity_pattern: str
-    social_structure: str
-    lifespan_category: str
-    conservation_status: str
-    continent: str
-
-class WorldDemographicsDB:
-    """世界人口動態データベース"""
-    
-    def __init__(self):
-        self.setup_world_demographics()
-    
-    def setup_world_demographics(self):
-        """世界人口動態データの初期化"""
-        
-        # 年齢分布（世界平均）
-        self.age_distribution = {
-            (0, 14): 25.4, (15, 24): 15.5, (25, 34): 17.2, (35, 44): 13.8,
-            (45, 54): 11.9, (55, 64): 8.7, (65, 74): 5.2, (75, 100): 2.3
-        }
-        
-        # 国別人口分布（人口上位国＋その他）
-        self.country_distribution = {
-            '中国': 17.8, 'インド': 17.7, 'アメリカ': 4.2, 'インドネシア': 3.4,
-            'パキスタン': 2.8, 'ブラジル': 2.7, 'ナイジェリア': 2.6, 'バングラデシュ': 2.1,
-            'ロシア': 1.9, 'メキシコ': 1.6, '日本': 1.6, 'フィリピン': 1.4,
-            'エチオピア': 1.4, 'ベトナム': 1.2, 'エジプト': 1.3, 'トルコ': 1.1,
-            'イラン': 1.1, 'ドイツ': 1.1, 'タイ': 0.9, 'イギリス': 0.9,
-            'その他': 32.8
-        }
-        
-        # 主要言語分布
-        self.language_distribution = {
-            '中国語（標準）': 14.1, 'ヒンディー語': 6.0, '英語': 5.1, 'スペイン語': 4.9,
-            'アラビア語': 4.2, 'ベンガル語': 3.3, 'ポルトガル語': 2.9, 'ロシア語': 2.2,
-            '日本語': 1.7, 'フランス語': 1.3, 'ドイツ語': 1.0, '韓国語': 0.9,
-            'ベトナム語': 0.9, 'トルコ語': 0.8, 'イタリア語': 0.7, 'その他': 50.0
-        }
-        
-        # 世界職業分布
-        self.occupation_distribution = {
-            '農業・畜産業': 26.2, 'サービス業': 15.8, '製造業': 12.6,
-            '商業・貿易': 11.0, '建設業': 6.9, '教育関係': 4.7,
-            '医療・介護': 4.2, '公務員': 3.8, 'IT・技術': 2.9,
-            '運輸業': 2.8, '金融業': 2.1, '学生': 4.5, '無職': 2.5
-        }
-        
-        # 教育レベル
-        self.education_distribution = {
-            '無学歴': 13.2, '初等教育': 28.4, '中等教育': 35.7,
-            '職業訓練': 8.9, '高等教育': 11.2, '大学院': 2.6
-        }
-        
-        # 年収分布（USD）
-        self.income_distribution = {
-            '1,000ドル未満': 15.3, '1,000-5,000ドル': 28.7, '5,000-15,000ドル': 26.9,
-            '15,000-30,000ドル': 14.2, '30,000-50,000ドル': 7.8, '50,000-75,000ドル': 4.1,
-            '75,000-100,000ドル': 1.8, '100,000ドル以上': 1.2
-        }
-        
-        # 家族構成
-        self.family_status_distribution = {
-            '独身': 22.8, '既婚': 45.3, '既婚・子供あり': 25.5,
-            'ひとり親': 4.2, '大家族': 2.2
-        }
-
-class TerrestrialAnimalDB:
-    """陸上動物データベース"""
-    
-    def __init__(self):
-        self.setup_animal_demographics()
-    
-    def setup_animal_demographics(self):
-        """動物データの初期化"""
-        
-        # 種別分布（主要陸上動物）
-        self.species_distribution = {
-            'アフリカゾウ': 2.1, 'ライオン': 1.8, 'トラ': 0.8, 'ヒグマ': 2.3,
-            'オオカミ': 3.2, 'アカギツネ': 4.5, 'シカ': 5.8, 'イノシシ': 3.9,
-            'チンパンジー': 1.2, 'ゴリラ': 0.6, 'オランウータン': 0.4, 'ヒョウ': 1.5,
-            'チーター': 0.3, 'キリン': 1.1, 'シマウマ': 2.7, 'サイ': 0.5,
-            'カバ': 1.3, 'カンガルー': 3.4, 'パンダ': 0.2, 'ユキヒョウ': 0.3,
-            'ジャガー': 0.7, 'ピューマ': 1.9, 'オオヤマネコ': 1.4, 'バイソン': 1.6,
-            'ヘラジカ': 2.1, 'トナカイ': 3.8, 'ヤマヤギ': 1.7, 'その他': 53.5
-        }
-        
-        # 生息環境
-        self.habitat_distribution = {
-            '熱帯雨林': 18.2, '温帯林': 15.4, '草原・サバンナ': 22.1,
-            '砂漠': 8.7, '山岳地帯': 12.3, 'ツンドラ': 6.8, '湿地': 7.2,
-            '沿岸部': 4.1, '混合環境': 5.2
-        }
-        
-        # サイズカテゴリ
-        self.size_distribution = {
-            '極小（1kg未満）': 8.2, '小型（1-10kg）': 25.4, '中型（10-50kg）': 28.7,
-            '大型（50-200kg）': 22.1, '超大型（200-1000kg）': 12.8, '巨大（1000kg以上）': 2.8
-        }
-        
-        # 食性
-        self.diet_distribution = {
-            '草食動物': 42.3, '肉食動物': 18.7, '雑食動物': 28.4, '昆虫食': 10.6
-        }
-        
-        # 活動パターン
-        self.activity_distribution = {
-            '昼行性': 45.2, '夜行性': 32.1, '薄明活動': 15.7, '無日周性': 7.0
-        }
-        
-        # 社会構造
-        self.social_distribution = {
-            '単独行動': 38.4, 'つがい': 12.6, '小グループ': 23.8, '大群': 18.2, '複雑な社会': 7.0
-        }
-        
-        # 寿命カテゴリ
-        self.lifespan_distribution = {
-            '短命（1-5年）': 15.2, '普通（5-15年）': 35.8, '長寿（15-30年）': 28.4,
-            '非常に長寿（30-50年）': 15.3, '超長寿（50年以上）': 5.3
-        }
-        
-        # 保護状況
-        self.conservation_distribution = {
-            '軽度懸念': 45.2, '準絶滅危惧': 18.7, '危急': 15.8,
-            '絶滅危惧': 12.3, '深刻な危機': 8.0
-        }
-
-class PersonaGenerator:
-    """人間・動物両対応ペルソナ生成器"""
-    
-    def __init__(self, mode: str):
-        self.mode = mode
-        if mode == "humans":
-            self.db = WorldDemographicsDB()
-        else:  # animals
-            self.db = TerrestrialAnimalDB()
-    
-    def generate_weighted_choice(self, distribution: Dict[str, float]) -> str:
-        """重み付き確率選択"""
-        choices = list(distribution.keys())
-        weights = list(distribution.values())
-        return random.choices(choices, weights=weights)[0]
-    
-    def get_continent_from_country(self, country: str) -> str:
-        """国から大陸を取得"""
-        continent_map = {
-            '中国': 'アジア', 'インド': 'アジア', 'アメリカ': '北米',
-            'インドネシア': 'アジア', 'パキスタン': 'アジア', 'ブラジル': '南米',
-            'ナイジェリア': 'アフリカ', 'バングラデシュ': 'アジア', 'ロシア': 'ヨーロッパ・アジア',
-            'メキシコ': '北米', '日本': 'アジア', 'フィリピン': 'アジア',
-            'エチオピア': 'アフリカ', 'ベトナム': 'アジア', 'エジプト': 'アフリカ',
-            'トルコ': 'ヨーロッパ・アジア', 'イラン': 'アジア', 'ドイツ': 'ヨーロッパ',
-            'タイ': 'アジア', 'イギリス': 'ヨーロッパ'
-        }
-        return continent_map.get(country, '世界各地')
-    
-    def get_continent_from_habitat(self, habitat: str) -> str:
-        """生息環境から大陸を推定"""
-        habitat_continent_map = {
-            '熱帯雨林': 'アフリカ・南米・アジア',
-            '温帯林': '北米・ヨーロッパ',
-            '草原・サバンナ': 'アフリカ・アジア',
-            '砂漠': 'アフリカ・アジア・オーストラリア',
-            '山岳地帯': '世界各地',
-            'ツンドラ': '北米・ヨーロッパ・アジア',
-            '湿地': '世界各地',
-            '沿岸部': '世界各地',
-            '混合環境': '世界各地'
-        }
-        return habitat_continent_map.get(habitat, '世界各地')
-    
-    def generate_human_persona(self, persona_id: int) -> HumanPersona:
-        """人間ペルソナ生成"""
-        # 年齢生成
-        age_ranges = list(self.db.age_distribution.keys())
-        age_weights = list(self.db.age_distribution.values())
-        selected_range = random.choices(age_ranges, weights=age_weights)[0]
-        age = random.randint(selected_range[0], selected_range[1])
-        
-        # 基本属性
-        country = self.generate_weighted_choice(self.db.country_distribution)
-        
-        persona = HumanPersona(
-            id=persona_id,
-            age=age,
-            gender=random.choice(['男性', '女性']),
-            country=country,
-            occupation=self.generate_weighted_choice(self.db.occupation_distribution),
-            education=self.generate_weighted_choice(self.db.education_distribution),
-            income_level=self.generate_weighted_choice(self.db.income_distribution),
-            family_status=self.generate_weighted_choice(self.db.family_status_distribution),
-            language=self.generate_weighted_choice(self.db.language_distribution),
-            urban_rural=random.choice(['都市部', '地方']),
-            continent=self.get_continent_from_country(country)
-        )
-        
-        return persona
-    
-    def generate_animal_persona(self, persona_id: int) -> AnimalPersona:
-        """動物ペルソナ生成"""
-        habitat = self.generate_weighted_choice(self.db.habitat_distribution)
-        
-        persona = AnimalPersona(
-            id=persona_id,
-            species=self.generate_weighted_choice(self.db.species_distribution),
-            habitat=habitat,
-            size_category=self.generate_weighted_choice(self.db.size_distribution),
-            diet_type=self.generate_weighted_choice(self.db.diet_distribution),
-            activity_pattern=self.generate_weighted_choice(self.db.activity_distribution),
-            social_structure=self.generate_weighted_choice(self.db.social_distribution),
-            lifespan_category=self.generate_weighted_choice(self.db.lifespan_distribution),
-            conservation_status=self.generate_weighted_choice(self.db.conservation_distribution),
-            continent=self.get_continent_from_habitat(habitat)
-        )
-        
-        return persona
-    
-    def generate_persona(self, persona_id: int):
-        """モードに応じたペルソナ生成"""
-        if self.mode == "humans":
-            return self.generate_human_persona(persona_id)
-        else:
-            return self.generate_animal_persona(persona_id)
-
-class LangChainCostTracker:
-    """LangChain用コスト追跡クラス"""
-    
-    def __init__(self):
-        self.total_cost = 0.0
-        self.total_tokens = 0
-        self.requests_count = 0
-        self.provider_costs = {}
-        
-    def add_openai_callback_result(self, result):
-        """OpenAIコールバック結果を追加"""
-        self.total_cost += result.total_cost
-        self.total_tokens += result.total_tokens
-        self.requests_count += 1
-        
-        if 'openai' not in self.provider_costs:
-            self.provider_costs['openai'] = {'cost': 0, 'tokens': 0, 'requests': 0}
-        
-        self.provider_costs['openai']['cost'] += result.total_cost
-        self.provider_costs['openai']['tokens'] += result.total_tokens
-        self.provider_costs['openai']['requests'] += 1
-    
-    def add_manual_cost(self, cost: float, tokens: int, provider: str):
-        """手動でコストを追加（他のプロバイダー用）"""
-        self.total_cost += cost
-        self.total_tokens += tokens
-        self.requests_count += 1
-        
-        if provider not in self.provider_costs:
-            self.provider_costs[provider] = {'cost': 0, 'tokens': 0, 'requests': 0}
-        
-        self.provider_costs[provider]['cost'] += cost
-        self.provider_costs[provider]['tokens'] += tokens
-        self.provider_costs[provider]['requests'] += 1
-    
-    def get_cost_summary(self) -> Dict:
-        """コストサマリー取得"""
-        return {
-            'total_cost_usd': self.total_cost,
-            'total_cost_jpy': self.total_cost * 150,
-            'total_tokens': self.total_tokens,
-            'requests_count': self.requests_count,
-            'cost_per_request': self.total_cost / max(self.requests_count, 1),
-            'provider_breakdown': self.provider_costs
-        }
-
-class LangChainLLMProvider:
-    """LangChain用LLMプロバイダー"""
-    
-    def __init__(self, provider_type: str, api_key: str, model_name: str = None):
-        if not LANGCHAIN_AVAILABLE:
-            raise ImportError("LangChainライブラリが必要です")
-        
-        self.provider_type = provider_type
-        self.cost_tracker = LangChainCostTracker()
-        
-        # プロバイダー別のLLM初期化
-        if provider_type == "openai":
-            self.llm = ChatOpenAI(
-                api_key=api_key,
-                model=model_name or "gpt-4o-mini",
-                temperature=0.7,
-                max_tokens=150
-            )
-        elif provider_type == "anthropic":
-            self.llm = ChatAnthropic(
-                api_key=api_key,
-                model=model_name or "claude-3-haiku-20240307",
-                temperature=0.7,
-                max_tokens=150
-            )
-        elif provider_type == "google":
-            self.llm = ChatGoogleGenerativeAI(
-                api_key=api_key,
-                model=model_name or "gemini-pro",
-                temperature=0.7
-            )
-        elif provider_type == "ollama":
-            self.llm = Ollama(
-                model=model_name or "llama2",
-                temperature=0.7
-            )
-        else:
-            raise ValueError(f"サポートされていないプロバイダー: {provider_type}")
-        
-        # プロンプトテンプレートの設定
-        self.setup_prompt_templates()
-        
-        # チェーンの作成
-        self.setup_chains()
-    
-    def setup_prompt_templates(self):
-        """プロンプトテンプレートの設定"""
-        
-        # 人間用システムプロンプト
-        self.human_system_template = SystemMessagePromptTemplate.from_template(
-            """あなたは{country}出身の{age}歳の{gender}です。
-あなたの背景情報:
-- 職業: {occupation}
-- 教育: {education}
-- 言語: {language}
-- 家族構成: {family_status}
-- 住環境: {urban_rural}
-
-あなたの文化的背景、価値観、生活経験を考慮して、質問に自然に回答してください。
-150文字以内で、この人物らしい声で答えてください。"""
-        )
-        
-        # 動物用システムプロンプト
-        self.animal_system_template = SystemMessagePromptTemplate.from_template(
-            """あなたは{habitat}に住む{species}です。
-あなたの特徴:
-- サイズ: {size_category}
-- 食性: {diet_type}
-- 活動パターン: {activity_pattern}
-- 社会構造: {social_structure}
-- 保護状況: {conservation_status}
-
-この動物の本能、生態、環境との関係を考慮して、質問に対するこの種ならではの反応を示してください。
-150文字以内で、この動物の視点から答えてください。"""
-        )
-        
-        # 人間用チャットプロンプト
-        self.human_chat_template = ChatPromptTemplate.from_messages([
-            self.human_system_template,
-            HumanMessagePromptTemplate.from_template("{question}")
-        ])
-        
-        # 動物用チャットプロンプト
-        self.animal_chat_template = ChatPromptTemplate.from_messages([
-            self.animal_system_template,
-            HumanMessagePromptTemplate.from_template("{question}")
-        ])
-    
-    def setup_chains(self):
-        """チェーンの設定"""
-        
-        # 出力パーサー
-        self.output_parser = StrOutputParser()
-        
-        # 人間用チェーン
-        self.human_chain = self.human_chat_template | self.llm | self.output_parser
-        
-        # 動物用チェーン
-        self.animal_chain = self.animal_chat_template | self.llm | self.output_parser
-    
-    async def generate_response(self, persona: Dict, question: str, mode: str) -> Dict:
-        """LangChainを使用した回答生成"""
-        
-        try:
-            # チェーンの選択
-            if mode == "humans":
-                chain = self.human_chain
-                chain_input = {
-                    "age": persona["age"],
-                    "gender": persona["gender"],
-                    "country": persona["country"],
-                    "occupation": persona["occupation"],
-                    "education": persona["education"],
-                    "language": persona["language"],
-                    "family_status": persona["family_status"],
-                    "urban_rural": persona["urban_rural"],
-                    "question": question
-                }
-            else:
-                chain = self.animal_chain
-                chain_input = {
-                    "species": persona["species"],
-                    "habitat": persona["habitat"],
-                    "size_category": persona["size_category"],
-                    "diet_type": persona["diet_type"],
-                    "activity_pattern": persona["activity_pattern"],
-                    "social_structure": persona["social_structure"],
-                    "conservation_status": persona["conservation_status"],
-                    "question": question
-                }
-            
-            # OpenAIの場合はコストトラッキング
-            if self.provider_type == "openai":
-                with get_openai_callback() as cb:
-                    response = await chain.ainvoke(chain_input)
-                    self.cost_tracker.add_openai_callback_result(cb)
-                    cost_usd = cb.total_cost
-                    tokens_used = cb.total_tokens
-            else:
-                # 他のプロバイダーの場合（概算）
-                response = await chain.ainvoke(chain_input)
-                cost_usd = 0.0  # プロバイダー別のコスト計算をここに追加
-                tokens_used = len(question) // 3 + len(response) // 3  # 概算
-                self.cost_tracker.add_manual_cost(cost_usd, tokens_used, self.provider_type)
-            
-            return {
-                'success': True,
-                'response': response,
-                'cost_usd': cost_usd,
-                'tokens_used': tokens_used,
-                'provider': self.provider_type
-            }
-            
-        except Exception as e:
-            return {
-                'success': False,
-                'response': f"エラー: {str(e)[:50]}...",
-                'cost_usd': 0.0,
-                'tokens_used': 0,
-                'provider': self.provider_type,
-                'error': str(e)
-            }
-
-class AdvancedAnalysisChain:
-    """高度な分析用LangChainチェーン"""
-    
-    def __init__(self, llm_provider: LangChainLLMProvider):
-        self.llm = llm_provider.llm
-        self.setup_analysis_chains()
-    
-    def setup_analysis_chains(self):
-        """分析用チェーンの設定"""
-        
-        # 洞察生成プロンプト
-        self.insight_prompt = ChatPromptTemplate.from_messages([
-            SystemMessagePromptTemplate.from_template(
-                """あなたは専門的な調査分析者です。
-以下の調査結果データを分析し、主要な洞察と提言を生成してください。
-データの傾向、パターン、意味のある発見を特定し、
-実用的な提言を含めた包括的な分析を提供してください。"""
-            ),
-            HumanMessagePromptTemplate.from_template(
-                """調査データ:
-{survey_data}
-
-質問: {question}
-
-上記のデータから得られる主要な洞察と提言を生成してください。"""
-            )
-        ])
-        
-        # 洞察生成チェーン
-        self.insight_chain = self.insight_prompt | self.llm | StrOutputParser()
-    
-    async def generate_insights(self, survey_data: str, question: str) -> str:
-        """LLMを使用した洞察生成"""
-        
-        try:
-            insights = await self.insight_chain.ainvoke({
-                "survey_data": survey_data,
-                "question": question
-            })
-            return insights
-            
-        except Exception as e:
-            return f"洞察生成エラー: {str(e)}"
-
-class SimulationProvider:
-    """シミュレーション用プロバイダー（LangChain未使用時）"""
-    
-    def __init__(self, mode: str):
-        self.mode = mode
-        self.cost_tracker = LangChainCostTracker()
-        
-        # 回答パターン（前回と同じ）
-        self.human_response_patterns = {
-            '25歳未満': [
-                "将来世代にとって本当に重要な問題だと思います。",
-                "SNSで見た情報だと、早急に対策が必要そうです。",
-                "今行動しないと手遅れになりそうで心配です。"
-            ],
-            '25-65歳': [
-                "経験上、バランスの取れた解決策が必要だと思います。",
-                "経済的な影響も考慮しつつ、環境対策を進めるべきです。",
-                "家族の将来を考えると、真剣に取り組むべき課題です。"
-            ],
-            '65歳以上': [
-                "長年の変化を見てきて、これは重要な問題です。",
-                "孫の世代のことを考えると、対策が必要です。",
-                "持続可能な解決策を見つけることが大切だと思います。"
-            ]
-        }
-        
-        self.animal_response_patterns = {
-            '肉食動物': [
-                "獲物の数が変わると、狩りがもっと大変になります。",
-                "生息地の分断で、狩りの範囲が狭くなっています。",
-                "気候の変化で、獲物がいる場所や時期が変わってきています。"
-            ],
-            '草食動物': [
-                "植物の生える場所や時期が変わって、食べ物探しが難しくなっています。",
-                "季節のずれで、好きな植物が食べられる時期が変わりました。",
-                "人間の活動で、食べ物のある場所が減っています。"
-            ],
-            '雑食動物': [
-                "食べ物の種類が多いので適応できるけど、だんだん厳しくなっています。",
-                "植物も動物も食べられるから何とかなるけど、環境の変化は感じます。",
-                "柔軟な食性が助かるけど、住む場所がなくなるのは困ります。"
-            ]
-        }
-    
-    async def generate_response(self, persona: Dict, question: str, mode: str) -> Dict:
-        """シミュレーション回答生成"""
-        await asyncio.sleep(0.1)
-        
-        if mode == "humans":
-            age = persona.get('age', 30)
-            if age < 25:
-                age_group = '25歳未満'
-            elif age <= 65:
-                age_group = '25-65歳'
-            else:
-                age_group = '65歳以上'
-            
-            responses = self.human_response_patterns[age_group]
-            
-        else:
-            diet_type = persona.get('diet_type', '雑食動物')
-            responses = self.animal_response_patterns.get(diet_type, self.animal_response_patterns['雑食動物'])
-        
-        response = random.choice(responses)
-        
-        return {
-            'success': True,
-            'response': response,
-            'cost_usd': 0.0,
-            'tokens_used': 0,
-            'provider': 'simulation'
-        }
-
-# エビデンスベース質問プリセット
-EVIDENCE_BASED_QUESTIONS = {
-    "気候変動の影響": "気候変動はあなたの環境や日常生活にどのような影響を与えていますか？",
-    "生物多様性の保全": "生物多様性を守るために最も重要だと思う取り組みは何ですか？",
-    "生息地の保護": "あなたの地域での生息地保護はどのくらい重要ですか？",
-    "持続可能な実践": "みんなが取り組むべき持続可能な実践は何だと思いますか？",
-    "種の絶滅への懸念": "種の絶滅についてどのくらい心配していますか？",
-    "再生可能エネルギー": "将来、再生可能エネルギーはどのような役割を果たすべきですか？",
-    "プラスチック汚染": "プラスチック汚染はあなたの環境にどのような影響を与えていますか？",
-    "水資源の保全": "最も重要な水資源保全対策は何だと思いますか？",
-    "森林破壊への対策": "森林破壊を止めるために何が必要だと思いますか？",
-    "環境教育の重要性": "環境教育はどのくらい重要だと思いますか？"
-}
-
-# LLMプロバイダー設定
-LLM_PROVIDERS = {
-    "OpenAI GPT-4o-mini": {"type": "openai", "model": "gpt-4o-mini"},
-    "OpenAI GPT-4": {"type": "openai", "model": "gpt-4"},
-    "Anthropic Claude-3-Haiku": {"type": "anthropic", "model": "claude-3-haiku-20240307"},
-    "Anthropic Claude-3-Sonnet": {"type": "anthropic", "model": "claude-3-sonnet-20240229"},
-    "Google Gemini Pro": {"type": "google", "model": "gemini-pro"},
-    "Ollama Llama2": {"type": "ollama", "model": "llama2"},
-    "シミュレーション（無料）": {"type": "simulation", "model": None}
-}
+from survey_engine import (
+    PersonaGenerator, PopulationStore, StratifiedSampler,
+    AdvancedAnalysisChain,
+    ResponseClassifier, AdaptiveSurveyController, RunningAggregates, QuestionRegistry, PooledLLMProvider,
+    SurveyStore, ProviderRegistry, ConversationMemory, LangChainCostTracker, QuestionSimilarityIndex,
+    EVIDENCE_BASED_QUESTIONS, LLM_PROVIDERS,
+    build_export_frame, parse_api_keys, population_fingerprint, run_survey_pipeline
+)
+from survey_profiler import SurveyProfiler, format_profile_summary
 
 # グローバル状態管理
 class AppState:
     def __init__(self):
         self.mode = "humans"
         self.personas = []
+        self.persona_index = {}  # ペルソナID -> ペルソナ（回答レコードはID参照）
         self.survey_responses = []
+        self.question_registry = QuestionRegistry()
+        self.conversation_memory = ConversationMemory(self.question_registry)  # フォローアップ用の会話履歴
         self.llm_provider = None
         self.analysis_chain = None
         self.selected_provider = "シミュレーション（無料）"
+        self.sample_design = None  # 大規模母集団モード時のStratifiedSampler
+        self.response_labels = None  # ResponseClassifierによる分類結果
+        self.aggregates = RunningAggregates()  # チャート用の逐次集計
+        self.population = None  # シード指定時のPersonaPopulation（メモリマップ）
+        self.population_key = None  # 回答再利用時の同一母集団判定キー
+        self.population_store = PopulationStore()
+        self.survey_store = SurveyStore()  # 全調査を自動保存するローカルストア
+        self.provider_registry = ProviderRegistry()  # 初期化済みプロバイダーの再利用
+        self.session_cost_tracker = LangChainCostTracker()  # このセッションの全調査のコスト・トークン累計
+        self.profiling = False  # オプトインのプロファイリング
+        self.last_profile = None  # 直近のSurveyProfiler（出力先ディレクトリ・サマリー）
 
 app_state = AppState()
 
+def profiled(name):
+    """プロファイリング有効時のみSurveyProfilerで計測するデコレーター"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not app_state.profiling:
+                return fn(*args, **kwargs)
+            with SurveyProfiler(name) as profiler:
+                result = fn(*args, **kwargs)
+            if profiler.run_dir:
+                app_state.last_profile = profiler
+            return result
+        return wrapper
+    return decorator
+
 # Gradioインターフェース関数群
 def get_app_title():
     """アプリタイトル取得"""
@@ -652,11 +75,18 @@ def set_mode(mode):
     """調査モード設定"""
     app_state.mode = mode
     app_state.personas = []
+    app_state.persona_index = {}
     app_state.survey_responses = []
+    app_state.sample_design = None
+    app_state.response_labels = None
+    app_state.aggregates = RunningAggregates()
+    app_state.population = None
+    app_state.population_key = None
+    app_state.conversation_memory.reset()
     return f"モード設定: {get_app_title()}"
 
-def set_llm_provider(provider_name, api_key=""):
-    """LLMプロバイダー設定"""
+def set_llm_provider(provider_name, api_key="", rpm_per_key=60, tpm_per_key=100000, prompt_layout="classic"):
+    """LLMプロバイダー設定（カンマ・改行区切りで複数キーを指定するとキープールで運用）"""
     app_state.selected_provider = provider_name
     provider_config = LLM_PROVIDERS[provider_name]
     
@@ -667,49 +97,129 @@ def set_llm_provider(provider_name, api_key=""):
         return f"❌ {provider_name}を使用するにはAPIキーが必要です"
     
     try:
-        app_state.llm_provider = LangChainLLMProvider(
-            provider_type=provider_config["type"],
-            api_key=api_key,
-            model_name=provider_config["model"]
+        # 初期化済みインスタンスがあれば再利用（コスト・レイテンシ指標も引き継ぐ）
+        rpm_per_key, tpm_per_key = int(rpm_per_key), int(tpm_per_key) if tpm_per_key else None
+        entry, created = app_state.provider_registry.get_or_create(
+            provider_config["type"], app_state.mode, api_key, provider_config["model"],
+            rpm_per_key=rpm_per_key, tpm_per_key=tpm_per_key, prompt_layout=prompt_layout
         )
+        provider = entry['provider']
+        provider.set_prompt_layout(prompt_layout)
+        if isinstance(provider, PooledLLMProvider):
+            provider.set_rate_limits(rpm_per_key, tpm_per_key)
         
-        # 高度分析チェーンの初期化
-        app_state.analysis_chain = AdvancedAnalysisChain(app_state.llm_provider)
+        # 高度分析チェーンの初期化（エントリごとに1回）
+        if 'analysis_chain' not in entry:
+            entry['analysis_chain'] = AdvancedAnalysisChain(provider)
         
-        return f"✅ {provider_name}プロバイダーの初期化が完了しました！"
+        app_state.llm_provider = provider
+        app_state.analysis_chain = entry['analysis_chain']
+        
+        status = "初期化が完了しました" if created else "初期化済みインスタンスを再利用します"
+        if isinstance(provider, PooledLLMProvider):
+            key_count = len(parse_api_keys(api_key))
+            return f"✅ {provider_name}プロバイダーの{status}！（APIキー{key_count}本のプール）"
+        return f"✅ {provider_name}プロバイダーの{status}！"
         
     except Exception as e:
         return f"❌ {provider_name}の初期化エラー: {e}"
 
-def generate_personas(num_personas=50):
-    """ペルソナ生成（前回と同じ）"""
+def validate_llm_provider():
+    """現在のプロバイダーのAPIキーを最小リクエストで検証"""
+    if not app_state.llm_provider:
+        return "❌ LLMプロバイダーが初期化されていません"
+    
     try:
-        generator = PersonaGenerator(app_state.mode)
-        personas = []
-        
-        for i in range(num_personas):
-            persona = generator.generate_persona(i + 1)
-            personas.append(asdict(persona))
+        report = asyncio.run(app_state.llm_provider.validate_keys())
+        return "\n".join(f"{'✅' if r['valid'] else '❌'} {r['key']}: {r['message']}" for r in report)
+    except Exception as e:
+        return f"❌ APIキー検証エラー: {e}"
+
+def set_profiling(enabled):
+    """プロファイリングの有効・無効を切り替え"""
+    app_state.profiling = bool(enabled)
+    return "🔬 プロファイリング有効（以降の実行を記録）" if enabled else "プロファイリング無効"
+
+def get_latest_profile():
+    """直近のプロファイル概要と出力ファイル"""
+    profiler = app_state.last_profile
+    if not profiler:
+        return "まだプロファイルがありません（有効化してから実行してください）", None
+    
+    return f"📁 {profiler.run_dir}\n{format_profile_summary(profiler.summary())}", profiler.output_files()
+
+@profiled("generate_personas")
+def generate_personas(num_personas=50, large_population=False, population_size=1000000, margin_of_error=0.05,
+                      seed=None):
+    """ペルソナ生成（大規模母集団モードでは層化抽出、シード指定時は保存済み母集団を再利用）"""
+    try:
+        seed = int(seed) if seed is not None and seed >= 0 else None
+        app_state.population = None
+        
+        if large_population:
+            sampler = StratifiedSampler(app_state.mode, int(population_size), float(margin_of_error), seed)
+            personas = sampler.generate_sample()
+            app_state.sample_design = sampler
+        elif seed is not None:
+            population = app_state.population_store.get_or_create(app_state.mode, seed, int(num_personas))
+            personas = population.to_personas()
+            app_state.population = population
+            app_state.sample_design = None
+        else:
+            generator = PersonaGenerator(app_state.mode)
+            personas = []
+            
+            for i in range(num_personas):
+                persona = generator.generate_persona(i + 1)
+                personas.append(asdict(persona))
+            
+            app_state.sample_design = None
         
         app_state.personas = personas
-        
-        # サマリー作成
-        df = pd.DataFrame(personas)
+        app_state.persona_index = {p['id']: p for p in personas}
+        app_state.population_key = app_state.population.key if app_state.population else population_fingerprint(personas)
+        app_state.conversation_memory.reset()
+        # 回答はペルソナIDを参照するため、母集団の入れ替え時に破棄
+        app_state.survey_responses = []
+        app_state.response_labels = None
+        app_state.aggregates.reset_personas()
+        app_state.aggregates.reset_responses()
+        app_state.aggregates.add_personas(personas)
+        
+        # サマリー作成（逐次集計から）
+        agg = app_state.aggregates
         if app_state.mode == "humans":
             summary = f"""
 ✅ {len(personas)}人の人間ペルソナを生成しました:
-- 平均年齢: {df['age'].mean():.1f}歳
-- 性別分布: {df['gender'].value_counts().to_dict()}
-- 上位国家: {df['country'].value_counts().head(3).to_dict()}
-- 言語数: {len(df['language'].unique())}種類の言語
+- 平均年齢: {agg.mean_age:.1f}歳
+- 性別分布: {agg.top_values('gender')}
+- 上位国家: {agg.top_values('country', 3)}
+- 言語数: {len(agg.persona_value_counts['language'])}種類の言語
 """
         else:
             summary = f"""
 ✅ {len(personas)}体の動物ペルソナを生成しました:
-- 種数: {len(df['species'].unique())}種類の動物
-- 生息環境分布: {df['habitat'].value_counts().head(3).to_dict()}
-- 食性分布: {df['diet_type'].value_counts().to_dict()}
-- 保護状況: {df['conservation_status'].value_counts().to_dict()}
+- 種数: {len(agg.persona_value_counts['species'])}種類の動物
+- 生息環境分布: {agg.top_values('habitat', 3)}
+- 食性分布: {agg.top_values('diet_type')}
+- 保護状況: {agg.top_values('conservation_status')}
+"""
+        
+        if app_state.population is not None:
+            meta = app_state.population.meta
+            summary += f"""
+🔑 シード付き母集団: seed={meta['seed']}, key={meta['key']}
+- 保存先: {app_state.population_store.path_for(meta['key'])}（メモリマップで共有）
+"""
+        
+        if app_state.sample_design:
+            design = app_state.sample_design.get_design_summary()
+            summary += f"""
+🌐 大規模母集団モード（層化抽出）:
+- 仮想母集団: {design['population_size']:,}
+- 目標誤差幅: ±{design['margin_of_error'] * 100:.1f}%（95%信頼区間）
+- 必要標本数: {design['required_sample_size']} / 配分標本数: {design['allocated_sample_size']}
+- 層数: {design['strata_count']}
 """
         
         return summary, create_persona_chart()
@@ -718,25 +228,87 @@ def generate_personas(num_personas=50):
         return f"❌ ペルソナ生成エラー: {e}", None
 
 def create_persona_chart():
-    """ペルソナ分布チャート作成（前回と同じ）"""
-    if not app_state.personas:
+    """ペルソナ分布チャート作成（事前ビン集計から描画）"""
+    agg = app_state.aggregates
+    if not agg.persona_count:
         return None
     
-    df = pd.DataFrame(app_state.personas)
-    
     if app_state.mode == "humans":
-        fig = px.histogram(df, x='age', title='年齢分布', nbins=20,
-                          labels={'x': '年齢', 'y': '人数'})
+        bin_labels, counts = agg.age_histogram()
+        fig = px.bar(x=bin_labels, y=counts, title='年齢分布',
+                    labels={'x': '年齢', 'y': '人数'})
     else:
-        species_counts = df['species'].value_counts().head(10)
-        fig = px.bar(x=species_counts.values, y=species_counts.index, 
+        species_counts = agg.top_values('species', 10)
+        fig = px.bar(x=list(species_counts.values()), y=list(species_counts.keys()), 
                     orientation='h', title='上位10種の分布',
                     labels={'x': '個体数', 'y': '種名'})
     
     return fig
 
-def run_survey(question, custom_question=""):
-    """LangChainを使用した調査実行"""
+def plan_answer_reuse(question, provider_config, enabled=False, threshold=QuestionSimilarityIndex.REUSE_THRESHOLD,
+                      resurvey_fraction=0.0, adaptive=False, follow_up=False):
+    """類似質問の既存回答の再利用計画（再利用する回答と新規に調査するペルソナ）"""
+    match = app_state.survey_store.find_similar_survey(question, app_state.mode, app_state.population_key,
+                                                       provider_config["type"], provider_config["model"])
+    plan = {'match': match, 'threshold': threshold, 'reused': [], 'personas': app_state.personas}
+    
+    if not match:
+        plan['decision'] = "調査履歴なし → 全件新規調査"
+    elif match['similarity'] < threshold:
+        plan['decision'] = "類似度が閾値未満 → 全件新規調査"
+    elif not enabled:
+        plan['decision'] = "再利用可能（「類似質問の回答を再利用」を有効にすると適用）→ 全件新規調査"
+    elif adaptive:
+        plan['decision'] = "適応的調査では再利用しない → 全件新規調査"
+    elif follow_up:
+        plan['decision'] = "フォローアップでは再利用しない（回答が会話履歴に依存）→ 全件新規調査"
+    else:
+        question_id = app_state.question_registry.intern(question)
+        previous = {r.persona_id: r for r in app_state.survey_store.load_responses(match['survey_id'], question_id)}
+        resurvey_ids = set(random.sample(sorted(previous), round(len(previous) * resurvey_fraction)))
+        plan['reused'] = [previous[p['id']] for p in app_state.personas
+                          if p['id'] in previous and p['id'] not in resurvey_ids]
+        reused_ids = {r.persona_id for r in plan['reused']}
+        plan['personas'] = [p for p in app_state.personas if p['id'] not in reused_ids]
+        plan['decision'] = (f"再利用 {len(plan['reused'])}件 / 新規調査 {len(plan['personas'])}件"
+                            f"（再調査率 {resurvey_fraction * 100:.0f}%）")
+    
+    return plan
+
+def format_follow_up_summary(memory):
+    """フォローアップ調査の会話履歴の状況"""
+    stats = memory.get_stats()
+    return f"""
+🔁 フォローアップ（会話履歴）:
+- 履歴を持つペルソナ: {stats['personas']}人（平均{stats['mean_turns']:.1f}ターン、約{stats['mean_history_tokens']:.0f}トークン）
+- 古いターンを要約済み: {stats['summarized_personas']}人（履歴予算 {memory.max_history_tokens}トークン）
+"""
+
+def reset_conversation_memory():
+    """フォローアップ用の会話履歴をリセット"""
+    app_state.conversation_memory.reset()
+    return "🧹 会話履歴をリセットしました（次の調査は初回として実行）"
+
+def format_reuse_summary(plan):
+    """類似質問の判定結果と再利用の有無"""
+    match = plan['match']
+    if match:
+        match_line = (f"- 最も近い調査済み質問: 「{match['question']}」（調査ID #{match['survey_id']}、"
+                      f"類似度 {match['similarity']:.2f} / 閾値 {plan['threshold']:.2f}）")
+    else:
+        match_line = "- 同じ母集団・プロバイダー・モデルの調査履歴なし"
+    return f"""
+♻️ 類似質問の回答再利用:
+{match_line}
+- 判定: {plan['decision']}
+"""
+
+@profiled("run_survey")
+def run_survey(question, custom_question="", adaptive=False, tolerance=0.05, wave_size=20,
+               stream=False, on_token=None, reuse=False, reuse_threshold=QuestionSimilarityIndex.REUSE_THRESHOLD,
+               resurvey_fraction=0.0, follow_up=False, history_tokens=600):
+    """LangChainを使用した調査実行（適応モードではウェーブ単位で早期停止、類似質問の回答は再利用可、
+    フォローアップでは各ペルソナのこれまでの回答を会話履歴として送信）"""
     if not app_state.personas:
         return "❌ まずペルソナを生成してください", None, ""
     
@@ -749,7 +321,7 @@ def run_survey(question, custom_question=""):
         provider_config = LLM_PROVIDERS[app_state.selected_provider]
         
         if provider_config["type"] == "simulation":
-            provider = SimulationProvider(app_state.mode)
+            provider = app_state.provider_registry.get_or_create("simulation", app_state.mode)[0]['provider']
         else:
             if not app_state.llm_provider:
                 return "❌ LLMプロバイダーが初期化されていません", None, ""
@@ -758,33 +330,82 @@ def run_survey(question, custom_question=""):
         # 調査実行
         responses = []
         total_cost = 0
+        survey_cost_tracker = LangChainCostTracker()  # この調査分のみ（プロバイダーのトラッカーは累計）
+        controller = AdaptiveSurveyController(tolerance, wave_size) if adaptive else None
+        stop_reason = ""
+        waves_run = 0
+        
+        app_state.aggregates.reset_responses()
+        
+        # 類似質問の回答再利用（同一母集団・プロバイダー・モデルの調査履歴から）
+        reuse_plan = plan_answer_reuse(final_question, provider_config, reuse, reuse_threshold,
+                                       resurvey_fraction, adaptive, follow_up)
+        
+        # フォローアップ時は会話履歴（トークン予算内）を付けて質問
+        memory = app_state.conversation_memory if follow_up else None
+        if memory:
+            memory.max_history_tokens = int(history_tokens)
+        app_state.aggregates.add_responses(reuse_plan['reused'])
+        
+        def on_result(record):
+            app_state.aggregates.add_responses([record])
+        
+        # 同時実行数はプロバイダーの推奨値（キープールはキー数×キーあたり上限）を超えない
+        max_concurrency = getattr(provider, 'recommended_concurrency', 1)
         
         async def run_async_survey():
             nonlocal responses, total_cost
-            for persona in app_state.personas:
-                result = await provider.generate_response(persona, final_question, app_state.mode)
+            personas = reuse_plan['personas']
+            outcome = await run_survey_pipeline(provider, personas, final_question, app_state.mode,
+                                                concurrency=max(1, min(len(personas), max_concurrency)),
+                                                stream=stream, on_token=on_token, on_result=on_result,
+                                                questions=app_state.question_registry, memory=memory)
+            responses = reuse_plan['reused'] + outcome['responses']
+            total_cost = outcome['total_cost']
+            survey_cost_tracker.merge(outcome['cost_tracker'])
+        
+        async def run_adaptive_survey():
+            nonlocal total_cost, stop_reason, waves_run
+            for wave in controller.make_waves(app_state.personas):
+                outcome = await run_survey_pipeline(provider, wave, final_question, app_state.mode,
+                                                    concurrency=max(1, min(len(wave), max_concurrency)),
+                                                    stream=stream, on_token=on_token, on_result=on_result,
+                                                    questions=app_state.question_registry, memory=memory)
+                responses.extend(outcome['responses'])
+                total_cost += outcome['total_cost']
+                survey_cost_tracker.merge(outcome['cost_tracker'])
+                waves_run += 1
                 
-                response = {
-                    'persona_id': persona['id'],
-                    'persona': persona,
-                    'question': final_question,
-                    'response': result['response'],
-                    'success': result.get('success', True),
-                    'cost_usd': result.get('cost_usd', 0.0),
-                    'provider': result.get('provider', 'unknown'),
-                    'timestamp': datetime.now().isoformat()
-                }
-                
-                responses.append(response)
-                total_cost += result.get('cost_usd', 0.0)
+                converged, reason, _ = controller.check_convergence(responses)
+                if converged:
+                    stop_reason = reason
+                    return
+            stop_reason = "全ペルソナを調査済み（許容誤差に未到達）"
         
         # 非同期調査実行
-        asyncio.run(run_async_survey())
+        asyncio.run(run_adaptive_survey() if adaptive else run_async_survey())
+        app_state.session_cost_tracker.merge(survey_cost_tracker)
         
         app_state.survey_responses = responses
+        if memory:
+            memory.record_responses(responses)  # フォローアップ時のみ（再利用分はreusedで除外される）
+        app_state.response_labels = ResponseClassifier().classify_responses(responses, app_state.persona_index)
+        if not app_state.response_labels.empty:
+            app_state.aggregates.add_stance_labels(app_state.response_labels['stance'])
+        
+        # 保存に失敗しても調査結果（課金済みの回答）は画面に返す
+        try:
+            survey_id = app_state.survey_store.save_survey(
+                app_state.mode, final_question, responses, app_state.persona_index, app_state.response_labels,
+                provider=provider_config["type"], model=provider_config["model"], total_cost=total_cost,
+                population_key=app_state.population_key
+            )
+            saved_to = f"調査ID #{survey_id}（{app_state.survey_store.path}）"
+        except Exception as e:
+            saved_to = f"⚠️ 保存に失敗しました（{app_state.survey_store.path}: {e}）"
         
         # サマリー作成
-        successful_responses = len([r for r in responses if r['success']])
+        successful_responses = len([r for r in responses if r.success])
         summary = f"""
 ✅ 調査完了！
 - 質問: {final_question}
@@ -792,25 +413,246 @@ def run_survey(question, custom_question=""):
 - 成功回答数: {successful_responses}
 - 総コスト: ${total_cost:.6f} (約{total_cost * 150:.2f}円)
 - プロバイダー: {app_state.selected_provider}
+- 保存先: {saved_to}
 """
         
+        summary += format_cost_summary(survey_cost_tracker, app_state.session_cost_tracker)
+        
+        if stream:
+            summary += format_latency_summary(survey_cost_tracker)
+        
+        if isinstance(provider, PooledLLMProvider):
+            summary += format_key_usage(provider)
+        
+        if survey_cost_tracker.cache_usage:
+            summary += format_cache_summary(survey_cost_tracker)
+        
+        if hasattr(provider, 'get_prompt_cache_status'):
+            summary += format_prompt_cache_status(provider.get_prompt_cache_status())
+        
+        summary += format_reuse_summary(reuse_plan)
+        
+        if follow_up:
+            summary += format_follow_up_summary(app_state.conversation_memory)
+        
+        if controller:
+            summary += format_adaptive_summary(controller, stop_reason, waves_run, len(app_state.personas))
+        
+        if app_state.sample_design:
+            summary += format_weighted_estimates(responses)
+        
         return summary, create_results_chart(), get_sample_responses()
         
     except Exception as e:
         return f"❌ 調査実行エラー: {e}", None, ""
 
+def format_cost_summary(survey_tracker, session_tracker):
+    """この調査とセッション累計のコスト・トークン（プロバイダー別）"""
+    survey = survey_tracker.get_cost_summary()
+    session = session_tracker.get_cost_summary()
+    lines = ""
+    for provider, c in session['provider_breakdown'].items():
+        lines += f"- {provider}: {c['requests']}件、{c['tokens']:,}トークン、${c['cost']:.6f}\n"
+    return f"""
+💰 コスト・トークン:
+- この調査: {survey['requests_count']}件、{survey['total_tokens']:,}トークン、${survey['total_cost_usd']:.6f}（1件あたり${survey['cost_per_request']:.6f}）
+- セッション累計: {session['requests_count']}件、{session['total_tokens']:,}トークン、${session['total_cost_usd']:.6f}（約{session['total_cost_jpy']:.2f}円）
+{lines}"""
+
+def format_latency_summary(cost_tracker):
+    """ストリーミング時のプロバイダー別応答性指標"""
+    lines = ""
+    for provider, m in cost_tracker.get_latency_summary().items():
+        lines += (f"- {provider}: TTFT 平均{m['ttft_mean_sec']:.2f}秒 (p50 {m['ttft_p50_sec']:.2f} / "
+                  f"p95 {m['ttft_p95_sec']:.2f})、出力速度 {m['tokens_per_sec_mean']:.1f} tokens/秒、"
+                  f"応答時間 平均{m['latency_mean_sec']:.2f}秒（{m['samples']}件）\n")
+    return f"""
+⚡ ストリーミング応答性:
+{lines}"""
+
+def format_cache_summary(cost_tracker):
+    """プロンプトキャッシュの利用状況（キャッシュ済み／未キャッシュ入力トークン）"""
+    lines = ""
+    for provider, c in cost_tracker.get_cache_summary().items():
+        lines += (f"- {provider}: 入力{c['input_tokens']:,}トークン中 キャッシュ{c['cached_input_tokens']:,} / "
+                  f"未キャッシュ{c['uncached_input_tokens']:,}（キャッシュ率{c['cached_ratio'] * 100:.1f}%、"
+                  f"ヒット{c['hit_requests']}/{c['requests']}件）")
+        if c['hit_latency_mean_sec'] is not None and c['miss_latency_mean_sec'] is not None:
+            lines += f"、平均応答時間 ヒット{c['hit_latency_mean_sec']:.2f}秒 / ミス{c['miss_latency_mean_sec']:.2f}秒"
+        lines += "\n"
+    return f"""
+🧊 プロンプトキャッシュ:
+{lines}"""
+
+def format_prompt_cache_status(status):
+    """キャッシュ最適化構成で共通プレフィックスが最小キャッシュ長に届かない場合の注意"""
+    if status['prompt_layout'] != "cache_friendly" or status['cacheable']:
+        return ""
+    if status['min_cacheable_tokens'] is None:
+        return "\n⚠️ このプロバイダーはプロンプトキャッシュに対応していないため、キャッシュ最適化構成の効果はありません\n"
+    return (f"\n⚠️ 共通の固定指示（約{status['static_prefix_tokens']}トークン）が最小キャッシュ長"
+            f"（{status['min_cacheable_tokens']}トークン）未満のため、プロンプトキャッシュは適用されません\n")
+
+def format_key_usage(provider):
+    """APIキープールのキー別利用状況"""
+    lines = ""
+    for usage in provider.get_key_usage():
+        lines += (f"- {usage['key']}: {usage['status']}、リクエスト{usage['requests']}件"
+                  f"（成功{usage['successes']} / 429 {usage['rate_limited']} / 認証エラー{usage['auth_errors']}）、"
+                  f"{usage['tokens']:,}トークン、${usage['cost_usd']:.4f}\n")
+    return f"""
+🔑 APIキー別利用状況:
+{lines}"""
+
+def get_key_usage_table():
+    """キー別利用状況の表（キープール使用時のみ）"""
+    if not isinstance(app_state.llm_provider, PooledLLMProvider):
+        return pd.DataFrame()
+    return pd.DataFrame(app_state.llm_provider.get_key_usage())
+
+def run_survey_streaming(question, custom_question="", adaptive=False, tolerance=0.05, wave_size=20,
+                         stream=False, reuse=False, reuse_threshold=QuestionSimilarityIndex.REUSE_THRESHOLD,
+                         resurvey_fraction=0.0, follow_up=False, history_tokens=600):
+    """調査実行（ストリーミング時は回答途中のテキストを逐次UIへ送出）"""
+    options = dict(reuse=reuse, reuse_threshold=reuse_threshold, resurvey_fraction=resurvey_fraction,
+                   follow_up=follow_up, history_tokens=history_tokens)
+    if not stream:
+        yield run_survey(question, custom_question, adaptive, tolerance, wave_size, **options)
+        return
+    
+    partials = {}
+    lock = threading.Lock()
+    outcome = {}
+    
+    def on_token(persona_id, chunk):
+        with lock:
+            partials[persona_id] = partials.get(persona_id, "") + chunk
+    
+    def worker():
+        outcome['result'] = run_survey(question, custom_question, adaptive, tolerance, wave_size,
+                                       stream=True, on_token=on_token, **options)
+    
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    
+    while thread.is_alive():
+        thread.join(timeout=0.3)
+        with lock:
+            recent = list(partials.items())[-5:]
+            received = len(partials)
+        preview = "\n".join(f"#{pid}: {text}" for pid, text in recent)
+        yield f"⏳ 調査中...（受信開始 {received}/{len(app_state.personas)}件）", None, preview
+    
+    yield outcome.get('result', ("❌ 調査実行エラー", None, ""))
+
+def format_adaptive_summary(controller, stop_reason, waves_run, total_personas):
+    """適応的調査の停止理由と収束統計"""
+    stats = controller.history[-1] if controller.history else controller.compute_statistics([])
+    top_categories = sorted(stats['categories'].items(), key=lambda item: -item[1]['share'])[:3]
+    category_text = ", ".join(
+        f"{label}: {c['share'] * 100:.1f}%±{c['half_width'] * 100:.1f}" for label, c in top_categories
+    )
+    top_segments = sorted(stats['segment_shares'].items(), key=lambda item: -item[1])[:3]
+    segment_text = ", ".join(f"{seg}: {share * 100:.1f}%" for seg, share in top_segments)
+    
+    return f"""
+🎯 適応的調査（早期停止）:
+- 停止理由: {stop_reason}
+- 調査済み: {stats['n']}/{total_personas} （{waves_run}ウェーブ × 最大{controller.wave_size}件）
+- 許容誤差: ±{controller.tolerance * 100:.1f}%
+- 回答カテゴリ: {category_text}
+- 平均回答長: {stats['length_mean']:.1f}±{stats['length_half_width']:.1f}文字
+- セグメント構成: {segment_text}
+"""
+
+def format_weighted_estimates(responses):
+    """層化抽出時の母集団推定値（調査ウェイト・95%信頼区間）"""
+    sampler = app_state.sample_design
+    
+    success_rate = sampler.estimate_from_responses(responses, lambda r: 1.0 if r.success else 0.0)
+    mean_length = sampler.estimate_from_responses(responses, lambda r: len(r.response))
+    
+    # 立場ラベル別の母集団構成比
+    stance_by_persona = {}
+    if app_state.response_labels is not None and not app_state.response_labels.empty:
+        stance_by_persona = dict(zip(app_state.response_labels['persona_id'], app_state.response_labels['stance']))
+    stance_lines = ""
+    for stance in sorted(set(stance_by_persona.values())):
+        share = sampler.estimate_from_responses(
+            responses, lambda r: 1.0 if stance_by_persona.get(r.persona_id) == stance else 0.0
+        )
+        stance_lines += f"- 推定構成比［{stance}］: {share['estimate'] * 100:.1f}% (95%CI {share['ci_low'] * 100:.1f}–{share['ci_high'] * 100:.1f}%)\n"
+    
+    return f"""
+📐 母集団推定（{sampler.population_size:,}体/人に重み付け）:
+- 推定成功率: {success_rate['estimate'] * 100:.1f}% (95%CI {success_rate['ci_low'] * 100:.1f}–{success_rate['ci_high'] * 100:.1f}%)
+- 推定平均回答長: {mean_length['estimate']:.1f}文字 (95%CI {mean_length['ci_low']:.1f}–{mean_length['ci_high']:.1f})
+{stance_lines}- 標本数: {mean_length['n']} / 層数: {len(sampler.strata)}
+"""
+
 def create_results_chart():
-    """結果可視化作成（前回と同じ）"""
-    if not app_state.survey_responses:
+    """結果可視化作成（回答長分布＋立場分布、事前ビン集計から描画）"""
+    agg = app_state.aggregates
+    if not agg.response_count:
         return None
     
-    response_lengths = [len(r['response']) for r in app_state.survey_responses]
+    bin_labels, counts = agg.length_histogram()
+    
+    fig = make_subplots(rows=1, cols=2, subplot_titles=('回答長分布', '立場分布'))
+    fig.add_trace(go.Bar(x=bin_labels, y=counts, name='回答長'), row=1, col=1)
+    
+    if agg.stance_counts:
+        stance_counts = dict(agg.stance_counts.most_common())
+        fig.add_trace(go.Bar(x=list(stance_counts.keys()), y=list(stance_counts.values()), name='立場'), row=1, col=2)
     
-    fig = px.histogram(x=response_lengths, title='回答長分布', 
-                      labels={'x': '回答長（文字数）', 'y': '回答数'})
+    fig.update_xaxes(title_text='回答長（文字数）', row=1, col=1)
+    fig.update_yaxes(title_text='回答数', row=1, col=1)
+    fig.update_layout(showlegend=False)
     
     return fig
 
+def create_crosstab(attribute, target="stance"):
+    """ペルソナ属性×分類ラベルのクロス集計"""
+    labeled = app_state.response_labels
+    if labeled is None or labeled.empty:
+        return pd.DataFrame(), None
+    
+    table = ResponseClassifier.crosstab(labeled, attribute, target)
+    if table.empty:
+        return table, None
+    
+    value_columns = [c for c in table.columns if c not in (attribute, '回答数')]
+    fig = px.bar(table, x=attribute, y=value_columns, title=f'{attribute} × {target}',
+                labels={'value': '構成比（%）', 'variable': target})
+    
+    return table, fig
+
+def history_filters(mode="すべて", question_keyword="", provider="すべて"):
+    """履歴タブの入力 → SurveyStoreのフィルタ条件"""
+    return {
+        'mode': None if mode == "すべて" else mode,
+        'question_contains': question_keyword.strip(),
+        'provider': None if provider == "すべて" else provider
+    }
+
+def list_survey_history(mode="すべて", question_keyword="", provider="すべて"):
+    """保存済み調査の一覧"""
+    return app_state.survey_store.list_surveys(history_filters(mode, question_keyword, provider))
+
+def aggregate_survey_history(mode="すべて", question_keyword="", provider="すべて", group_by="survey_id",
+                             target="stance"):
+    """保存済み調査を横断したクロス集計（集計はSQLite側で実行）"""
+    filters = history_filters(mode, question_keyword, provider)
+    table = app_state.survey_store.aggregate(group_by, target, filters)
+    if table.empty:
+        return table, app_state.survey_store.summarize(group_by, filters), None
+    
+    value_columns = [c for c in table.columns if c not in (group_by, '回答数')]
+    fig = px.bar(table, x=table[group_by].astype(str), y=value_columns, title=f'{group_by} × {target}（調査横断）',
+                 labels={'x': group_by, 'value': '構成比（%）', 'variable': target})
+    
+    return table, app_state.survey_store.summarize(group_by, filters), fig
+
 def get_sample_responses():
     """サンプル回答取得（前回と同じ）"""
     if not app_state.survey_responses:
@@ -822,14 +664,14 @@ def get_sample_responses():
     output = "📝 回答サンプル:\n\n"
     
     for i, response in enumerate(sample_responses, 1):
-        persona = response['persona']
+        persona = app_state.persona_index[response.persona_id]
         if app_state.mode == "humans":
             profile = f"{persona['country']}の{persona['age']}歳{persona['gender']}"
         else:
             profile = f"{persona['habitat']}の{persona['species']}"
         
         output += f"{i}. **{profile}**\n"
-        output += f"💬 {response['response']}\n\n"
+        output += f"💬 {response.response}\n\n"
     
     return output
 
@@ -845,15 +687,15 @@ def generate_ai_insights():
         # 調査データの準備
         survey_data = ""
         for response in app_state.survey_responses[:10]:  # サンプル10件
-            persona = response['persona']
+            persona = app_state.persona_index[response.persona_id]
             if app_state.mode == "humans":
                 profile = f"{persona['country']}の{persona['age']}歳{persona['gender']}"
             else:
                 profile = f"{persona['habitat']}の{persona['species']}"
             
-            survey_data += f"- {profile}: {response['response']}\n"
+            survey_data += f"- {profile}: {response.response}\n"
         
-        question = app_state.survey_responses[0]['question']
+        question = app_state.question_registry.text(app_state.survey_responses[0].question_id)
         
         # 非同期で洞察生成
         async def generate_async():
@@ -865,29 +707,14 @@ def generate_ai_insights():
     except Exception as e:
         return f"❌ AI洞察生成エラー: {e}"
 
+@profiled("export_results")
 def export_results():
     """結果CSV出力（前回と同じ）"""
     if not app_state.survey_responses:
         return None
     
-    export_data = []
-    for response in app_state.survey_responses:
-        row = {
-            'persona_id': response['persona_id'],
-            'question': response['question'],
-            'response': response['response'],
-            'success': response['success'],
-            'provider': response.get('provider', 'unknown'),
-            'timestamp': response['timestamp']
-        }
-        
-        persona = response['persona']
-        for key, value in persona.items():
-            row[f'persona_{key}'] = value
-        
-        export_data.append(row)
-    
-    df = pd.DataFrame(export_data)
+    df = build_export_frame(app_state.survey_responses, app_state.personas, app_state.question_registry,
+                            app_state.response_labels)
     
     filename = f"langchain_survey_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     df.to_csv(filename, index=False, encoding='utf-8-sig')
@@ -940,11 +767,39 @@ def create_interface():
                     label="APIキー",
                     type="password",
                     placeholder="プロバイダーのAPIキーを入力...",
-                    info="シミュレーション以外を選択した場合に必要"
+                    info="シミュレーション以外を選択した場合に必要（カンマ区切りで複数キーを指定するとキープールで並列実行）"
+                )
+                
+                with gr.Accordion("🔑 APIキープール（キー別レート予算）", open=False):
+                    rpm_per_key = gr.Number(label="キーあたりRPM上限", value=60, precision=0)
+                    tpm_per_key = gr.Number(label="キーあたりTPM上限", value=100000, precision=0)
+                    key_usage_btn = gr.Button("📊 キー別利用状況を更新", size="sm")
+                    key_usage_table = gr.Dataframe(label="キー別利用状況", interactive=False)
+                
+                prompt_layout = gr.Radio(
+                    choices=[("従来構成", "classic"), ("キャッシュ最適化（共通指示を先頭に固定）", "cache_friendly")],
+                    value="classic",
+                    label="プロンプト構成",
+                    info="キャッシュ最適化では従来と同じ指示文を先頭に固定し、ペルソナ属性と質問を末尾に置いてプロバイダー側の"
+                         "プロンプトキャッシュを再利用（共通部分が最小キャッシュ長未満なら効果なし、Ollamaは対象外）"
                 )
                 
+                with gr.Row():
+                    apply_key_btn = gr.Button("✅ APIキーを適用", size="sm")
+                    validate_key_btn = gr.Button("🔍 APIキーを検証", size="sm")
+                
                 llm_status = gr.Textbox(label="LLM状況", value="シミュレーションモード（無料）")
                 
+                with gr.Accordion("🔬 プロファイリング（オプトイン）", open=False):
+                    profiling_mode = gr.Checkbox(
+                        label="プロファイリングを有効化",
+                        value=False,
+                        info="ペルソナ生成・調査実行・エクスポートのCPUサンプリングとメモリ割り当てを profiles/ に記録"
+                    )
+                    profile_refresh_btn = gr.Button("📂 最新プロファイルを表示", size="sm")
+                    profile_summary = gr.Textbox(label="プロファイル概要", lines=10)
+                    profile_files = gr.File(label="フレームグラフ・collapsed stack・割り当てレポート", file_count="multiple")
+                
                 # イベントハンドラー
                 def update_title_and_mode(mode):
                     app_state.mode = mode
@@ -964,15 +819,49 @@ def create_interface():
                 
                 provider_dropdown.change(
                     fn=set_llm_provider,
-                    inputs=[provider_dropdown, api_key_input],
+                    inputs=[provider_dropdown, api_key_input, rpm_per_key, tpm_per_key, prompt_layout],
+                    outputs=[llm_status]
+                )
+                
+                # キー入力中は初期化せず、Enter・適用ボタンで確定（キーストロークごとの再構築を避ける）
+                api_key_input.submit(
+                    fn=set_llm_provider,
+                    inputs=[provider_dropdown, api_key_input, rpm_per_key, tpm_per_key, prompt_layout],
+                    outputs=[llm_status]
+                )
+                
+                apply_key_btn.click(
+                    fn=set_llm_provider,
+                    inputs=[provider_dropdown, api_key_input, rpm_per_key, tpm_per_key, prompt_layout],
+                    outputs=[llm_status]
+                )
+                
+                validate_key_btn.click(
+                    fn=validate_llm_provider,
                     outputs=[llm_status]
                 )
                 
-                api_key_input.change(
+                profiling_mode.change(
+                    fn=set_profiling,
+                    inputs=[profiling_mode],
+                    outputs=[profile_summary]
+                )
+                
+                profile_refresh_btn.click(
+                    fn=get_latest_profile,
+                    outputs=[profile_summary, profile_files]
+                )
+                
+                prompt_layout.change(
                     fn=set_llm_provider,
-                    inputs=[provider_dropdown, api_key_input],
+                    inputs=[provider_dropdown, api_key_input, rpm_per_key, tpm_per_key, prompt_layout],
                     outputs=[llm_status]
                 )
+                
+                key_usage_btn.click(
+                    fn=get_key_usage_table,
+                    outputs=[key_usage_table]
+                )
             
             # ペルソナ生成タブ
             with gr.Tab("👥 ペルソナ"):
@@ -987,6 +876,35 @@ def create_interface():
                     info="多いほど包括的な調査（実LLM使用時はコスト増）"
                 )
                 
+                with gr.Accordion("🌐 大規模母集団モード（層化抽出）", open=False):
+                    large_population = gr.Checkbox(
+                        label="大規模母集団モードを有効化",
+                        value=False,
+                        info="仮想母集団から層化標本のみを調査し、調査ウェイトで母集団推定"
+                    )
+                    
+                    population_size = gr.Number(
+                        label="仮想母集団サイズ",
+                        value=1000000,
+                        precision=0
+                    )
+                    
+                    margin_of_error = gr.Slider(
+                        minimum=0.01,
+                        maximum=0.2,
+                        value=0.05,
+                        step=0.01,
+                        label="目標誤差幅",
+                        info="95%信頼区間の半幅（小さいほど標本数・コスト増）"
+                    )
+                
+                persona_seed = gr.Number(
+                    label="シード",
+                    value=None,
+                    precision=0,
+                    info="指定すると同じペルソナを再現（保存済み母集団を再利用）。空欄でランダム"
+                )
+                
                 generate_btn = gr.Button("🎲 ペルソナ生成", variant="primary")
                 
                 persona_status = gr.Textbox(label="生成状況")
@@ -994,7 +912,7 @@ def create_interface():
                 
                 generate_btn.click(
                     fn=generate_personas,
-                    inputs=[num_personas],
+                    inputs=[num_personas, large_population, population_size, margin_of_error, persona_seed],
                     outputs=[persona_status, persona_chart]
                 )
             
@@ -1027,6 +945,84 @@ def create_interface():
                     outputs=[custom_question]
                 )
                 
+                with gr.Accordion("🎯 適応的調査（早期停止）", open=False):
+                    adaptive_mode = gr.Checkbox(
+                        label="適応的調査を有効化",
+                        value=False,
+                        info="ランダムなウェーブ単位で調査し、信頼区間が許容誤差以下になったら停止"
+                    )
+                    
+                    tolerance = gr.Slider(
+                        minimum=0.01,
+                        maximum=0.3,
+                        value=0.05,
+                        step=0.01,
+                        label="許容誤差",
+                        info="回答カテゴリ構成比の95%CI半幅・平均回答長の相対半幅の上限"
+                    )
+                    
+                    wave_size = gr.Slider(
+                        minimum=5,
+                        maximum=100,
+                        value=20,
+                        step=5,
+                        label="ウェーブサイズ"
+                    )
+                
+                with gr.Accordion("♻️ 類似質問の回答再利用", open=False):
+                    reuse_mode = gr.Checkbox(
+                        label="類似質問の回答を再利用",
+                        value=False,
+                        info="同じ母集団・モデルで調査済みの近い質問（文字n-gram類似度）があれば既存回答を再利用"
+                    )
+                    
+                    reuse_threshold = gr.Slider(
+                        minimum=0.2,
+                        maximum=1.0,
+                        value=QuestionSimilarityIndex.REUSE_THRESHOLD,
+                        step=0.01,
+                        label="類似度の閾値"
+                    )
+                    
+                    resurvey_fraction = gr.Slider(
+                        minimum=0.0,
+                        maximum=1.0,
+                        value=0.0,
+                        step=0.05,
+                        label="再調査率",
+                        info="再利用時にも新規に調査し直すペルソナの割合"
+                    )
+                
+                with gr.Accordion("🔁 フォローアップ調査（会話履歴）", open=False):
+                    follow_up_mode = gr.Checkbox(
+                        label="フォローアップとして質問",
+                        value=False,
+                        info="各ペルソナのこれまでの質問と回答を会話履歴として送信（パネル調査向け）"
+                    )
+                    
+                    history_tokens = gr.Slider(
+                        minimum=100,
+                        maximum=2000,
+                        value=600,
+                        step=50,
+                        label="履歴のトークン予算",
+                        info="超えた分は古いターンから要約に畳み込む"
+                    )
+                    
+                    reset_memory_btn = gr.Button("🧹 会話履歴をリセット", size="sm")
+                    memory_status = gr.Textbox(label="会話履歴の状況", lines=1)
+                    
+                    reset_memory_btn.click(
+                        fn=reset_conversation_memory,
+                        outputs=[memory_status]
+                    )
+                
+                stream_mode = gr.Checkbox(
+                    label="⚡ ストリーミング表示",
+                    value=False,
+                    info="回答をトークン単位で逐次表示し、TTFT・出力速度をプロバイダー別に記録"
+                )
+                
                 run_survey_btn = gr.Button("🚀 調査実行", variant="primary")
                 
                 survey_status = gr.Textbox(label="調査状況")
@@ -1038,11 +1034,94 @@ def create_interface():
                 )
                 
                 run_survey_btn.click(
-                    fn=run_survey,
-                    inputs=[question_dropdown, custom_question],
+                    fn=run_survey_streaming,
+                    inputs=[question_dropdown, custom_question, adaptive_mode, tolerance, wave_size, stream_mode,
+                            reuse_mode, reuse_threshold, resurvey_fraction, follow_up_mode, history_tokens],
                     outputs=[survey_status, results_chart, sample_responses]
                 )
             
+            # 分類・クロス集計タブ
+            with gr.Tab("📈 分類分析"):
+                gr.Markdown("### 🏷️ ローカル分類器によるクロス集計（LLMコストなし）")
+                
+                gr.Markdown("""
+                各回答を辞書ベースの分類器で**立場・懸念度・トピック**に分類し、
+                ペルソナ属性（大陸・年齢帯・保護状況など）とクロス集計します。
+                """)
+                
+                crosstab_attribute = gr.Dropdown(
+                    choices=sorted(set(sum(ResponseClassifier.CROSSTAB_ATTRIBUTES.values(), []))),
+                    value="continent",
+                    label="ペルソナ属性"
+                )
+                
+                crosstab_target = gr.Radio(
+                    choices=[("立場", "stance"), ("懸念度", "concern_level")],
+                    value="stance",
+                    label="分類ラベル"
+                )
+                
+                crosstab_btn = gr.Button("📊 クロス集計", variant="primary")
+                
+                crosstab_table = gr.Dataframe(label="クロス集計（行方向の構成比%）")
+                crosstab_chart = gr.Plot(label="クロス集計チャート")
+                
+                crosstab_btn.click(
+                    fn=create_crosstab,
+                    inputs=[crosstab_attribute, crosstab_target],
+                    outputs=[crosstab_table, crosstab_chart]
+                )
+            
+            # 履歴タブ
+            with gr.Tab("📚 履歴"):
+                gr.Markdown("### 🗄️ 保存済み調査の横断検索・集計")
+                
+                gr.Markdown("""
+                実行した調査はすべてローカルのSQLiteストア（surveys.db）に自動保存されます。
+                質問・プロバイダー・調査対象で絞り込み、調査や属性をまたいで集計できます。
+                """)
+                
+                with gr.Row():
+                    history_mode = gr.Dropdown(choices=["すべて", "humans", "animals"], value="すべて", label="調査対象")
+                    history_question = gr.Textbox(label="質問キーワード", placeholder="例: 気候変動")
+                    history_provider = gr.Dropdown(
+                        choices=["すべて"] + sorted({config["type"] for config in LLM_PROVIDERS.values()}),
+                        value="すべて",
+                        label="プロバイダー"
+                    )
+                
+                history_list_btn = gr.Button("🔍 調査一覧", variant="secondary")
+                history_list = gr.Dataframe(label="調査一覧（新しい順）")
+                
+                with gr.Row():
+                    history_group_by = gr.Dropdown(
+                        choices=list(SurveyStore.SURVEY_COLUMNS) + [c for c in SurveyStore.PERSONA_COLUMNS if c != 'age'],
+                        value="survey_id",
+                        label="集計軸"
+                    )
+                    history_target = gr.Radio(
+                        choices=[("立場", "stance"), ("懸念度", "concern_level")],
+                        value="stance",
+                        label="分類ラベル"
+                    )
+                
+                history_aggregate_btn = gr.Button("📊 調査横断集計", variant="primary")
+                history_table = gr.Dataframe(label="クロス集計（行方向の構成比%）")
+                history_summary = gr.Dataframe(label="回答数・成功率・平均回答長・コスト")
+                history_chart = gr.Plot(label="調査横断チャート")
+                
+                history_list_btn.click(
+                    fn=list_survey_history,
+                    inputs=[history_mode, history_question, history_provider],
+                    outputs=[history_list]
+                )
+                
+                history_aggregate_btn.click(
+                    fn=aggregate_survey_history,
+                    inputs=[history_mode, history_question, history_provider, history_group_by, history_target],
+                    outputs=[history_table, history_summary, history_chart]
+                )
+            
             # AI洞察タブ
             with gr.Tab("🧠 AI洞察"):
                 gr.Markdown("### 🤖 LangChainによる高度な分析")
@@ -0,0 +1,400 @@
+# survey_cli.py - World Listening & Wild Listening ヘッドレス実行（CLI / Python API）
+#
+# gradio / plotly を使わずに、ペルソナ生成 → generate_response の調査パイプラインを
+# バッチ実行して結果をファイルに書き出す。cronやコンテナでの大規模実行向け。
+#
+# 使用例:
+#   python survey_cli.py --mode humans --personas 500 --seed 42 \
+#       --preset 気候変動の影響 --provider simulation --concurrency 16 --output results.csv
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+from collections import Counter
+from dataclasses import asdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from survey_engine import (
+    PersonaGenerator, PopulationStore, StratifiedSampler, ResponseClassifier,
+    PooledLLMProvider, QuestionRegistry, SurveyStore, RunningAggregates,
+    ConversationMemory, SimulationProvider, InteractionRecorder, ReplayProvider,
+    EVIDENCE_BASED_QUESTIONS, build_export_frame, create_provider, run_survey_pipeline
+)
+from survey_profiler import SurveyProfiler, format_profile_summary
+
+# プロバイダー別のAPIキー環境変数
+API_KEY_ENV_VARS = {
+    "openai": "OPENAI_API_KEY",
+    "anthropic": "ANTHROPIC_API_KEY",
+    "google": "GOOGLE_API_KEY"
+}
+
+def load_personas(mode: str, num_personas: int = 50, seed: Optional[int] = None,
+                  population_file: Optional[str] = None, population_size: Optional[int] = None,
+                  margin_of_error: float = 0.05) -> List[Dict]:
+    """母集団指定からペルソナを用意
+
+    優先順位: population_file（JSON/JSONL/CSV）→ population_size（層化抽出）
+    → seed（保存済み母集団を再利用）→ ランダム生成
+    """
+    if population_file:
+        if population_file.endswith(".csv"):
+            personas = pd.read_csv(population_file).to_dict(orient="records")
+        else:
+            with open(population_file, encoding="utf-8") as f:
+                if population_file.endswith(".jsonl"):
+                    personas = [json.loads(line) for line in f if line.strip()]
+                else:
+                    personas = json.load(f)
+        return assign_persona_ids(personas)
+
+    if population_size:
+        return StratifiedSampler(mode, population_size, margin_of_error, seed).generate_sample()
+
+    if seed is not None:
+        return PopulationStore().get_or_create(mode, seed, num_personas).to_personas()
+
+    generator = PersonaGenerator(mode)
+    return [asdict(generator.generate_persona(i + 1)) for i in range(num_personas)]
+
+def assign_persona_ids(personas: List[Dict]) -> List[Dict]:
+    """ファイル由来のペルソナのIDを検証し、欠けていれば未使用の連番を付与
+
+    回答はペルソナIDで属性と結合するため、重複IDは受け付けない。
+    """
+    ids = [p.get('id') for p in personas]
+    present = [int(i) for i in ids if i is not None and not pd.isna(i)]
+    duplicates = sorted(i for i, n in Counter(present).items() if n > 1)
+    if duplicates:
+        raise ValueError(f"ペルソナIDが重複しています: {duplicates[:10]}")
+
+    next_id = max(present, default=0) + 1
+    for persona, persona_id in zip(personas, ids):
+        if persona_id is None or pd.isna(persona_id):
+            persona['id'] = next_id
+            next_id += 1
+        else:
+            persona['id'] = int(persona_id)
+    return personas
+
+def write_results(df: pd.DataFrame, output_path: str):
+    """拡張子に応じてCSV / JSONL / Parquetで書き出し"""
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    if output_path.endswith(".jsonl"):
+        df.to_json(output_path, orient="records", lines=True, force_ascii=False)
+    elif output_path.endswith(".parquet"):
+        df.to_parquet(output_path, index=False)
+    else:
+        df.to_csv(output_path, index=False, encoding="utf-8-sig")
+
+async def run_batch_survey_async(personas: List[Dict], questions: List[str], mode: str = "humans",
+                                 provider_type: str = "simulation", model_name: Optional[str] = None,
+                                 api_key: str = "", concurrency: int = 8,
+                                 budget_usd: Optional[float] = None, rpm_per_key: int = 60,
+                                 tpm_per_key: Optional[int] = 100000, prompt_layout: str = "classic",
+                                 follow_up: bool = False, history_tokens: int = 600,
+                                 record_path: Optional[str] = None, replay_path: Optional[str] = None,
+                                 replay_speed: float = 1.0) -> Dict:
+    """複数質問のバッチ調査（予算は全質問で共有、APIキー複数指定時はキープール）
+
+    follow_up=True では質問を順番にラウンドとして扱い、各ペルソナの前ラウンドまでの回答を会話履歴として送る。
+    record_path を指定するとリクエストごとの入出力・使用量・応答時間をカセットに記録し、
+    replay_path を指定するとLLMの代わりにカセットから記録時の応答時間どおりに再生する。
+    """
+    if replay_path:
+        # 再生結果は実プロバイダーの調査と区別する（回答再利用の検索対象を汚さない）
+        provider = ReplayProvider(replay_path, mode, replay_speed)
+        provider_type, model_name = f"replay:{provider.provider_type}", provider.model_name
+    else:
+        provider = create_provider(provider_type, mode, api_key, model_name,
+                                   rpm_per_key, tpm_per_key, prompt_layout)
+    if record_path:
+        if not hasattr(provider, 'set_recorder'):
+            raise ValueError("record_pathはLLMプロバイダーの実行時のみ指定できます（再生・シミュレーションは記録不可）")
+        provider.set_recorder(InteractionRecorder(record_path))
+    question_registry = QuestionRegistry()
+    memory = ConversationMemory(question_registry, history_tokens) if follow_up else None
+    responses = []
+    total_cost = 0.0
+    question_costs = []
+    budget_exhausted = False
+
+    for question in questions:
+        remaining = None if budget_usd is None else max(budget_usd - total_cost, 0.0)
+        outcome = await run_survey_pipeline(provider, personas, question, mode,
+                                            concurrency=concurrency, budget_usd=remaining,
+                                            questions=question_registry, memory=memory)
+        responses.extend(outcome['responses'])
+        if memory:
+            memory.record_responses(outcome['responses'])
+        total_cost += outcome['total_cost']
+        cost = outcome['cost_tracker'].get_cost_summary()
+        question_costs.append({'question': question, 'requests': cost['requests_count'],
+                               'tokens': cost['total_tokens'], 'cost_usd': cost['total_cost_usd']})
+        if outcome['budget_exhausted']:
+            budget_exhausted = True
+            break
+
+    return {
+        'responses': responses,
+        'questions': question_registry,
+        'provider': provider_type,
+        'model': model_name,
+        'total_cost': total_cost,
+        'budget_exhausted': budget_exhausted,
+        'question_costs': question_costs,
+        'cost_summary': provider.cost_tracker.get_cost_summary(),
+        'key_usage': provider.get_key_usage() if isinstance(provider, PooledLLMProvider) else [],
+        'replay': provider.get_stats() if isinstance(provider, ReplayProvider) else None,
+        'prompt_cache': (provider.get_prompt_cache_status()
+                         if hasattr(provider, 'get_prompt_cache_status') else None)
+    }
+
+def run_batch_survey(personas: List[Dict], questions: List[str], mode: str = "humans",
+                     provider_type: str = "simulation", model_name: Optional[str] = None,
+                     api_key: str = "", concurrency: int = 8, budget_usd: Optional[float] = None,
+                     output_path: Optional[str] = None, classify: bool = True,
+                     rpm_per_key: int = 60, tpm_per_key: Optional[int] = 100000,
+                     prompt_layout: str = "classic", store_path: Optional[str] = None,
+                     follow_up: bool = False, history_tokens: int = 600, record_path: Optional[str] = None,
+                     replay_path: Optional[str] = None, replay_speed: float = 1.0) -> Dict:
+    """バッチ調査のPython API（結果DataFrameとサマリーを返し、必要ならファイル出力・ストア保存）"""
+    started_at = datetime.now()
+    outcome = asyncio.run(run_batch_survey_async(
+        personas, questions, mode, provider_type, model_name, api_key, concurrency, budget_usd,
+        rpm_per_key, tpm_per_key, prompt_layout, follow_up, history_tokens,
+        record_path, replay_path, replay_speed
+    ))
+
+    responses = outcome['responses']
+    labels = ResponseClassifier().classify(pd.Series([r.response for r in responses])) if classify else None
+    df = build_export_frame(responses, personas, outcome['questions'], labels)
+
+    if output_path:
+        write_results(df, output_path)
+    
+    survey_ids = save_to_store(store_path, mode, outcome['provider'], outcome['model'],
+                               personas, outcome, labels) if store_path else []
+
+    summary = {
+        'mode': mode,
+        'provider': outcome['provider'],
+        'model': outcome['model'],
+        'personas': len(personas),
+        'questions': len(questions),
+        'responses': len(responses),
+        'successful_responses': int(sum(r.success for r in responses)),
+        'total_cost_usd': outcome['total_cost'],
+        'budget_usd': budget_usd,
+        'budget_exhausted': outcome['budget_exhausted'],
+        'elapsed_sec': (datetime.now() - started_at).total_seconds(),
+        'output_path': output_path,
+        'survey_ids': survey_ids,
+        'question_costs': outcome['question_costs'],
+        'key_usage': outcome['key_usage'],
+        'replay': outcome['replay'],
+        'prompt_cache': outcome['prompt_cache']
+    }
+
+    return {'results': df, 'summary': summary, 'cost_summary': outcome['cost_summary']}
+
+def run_bulk_simulation(mode: str, questions: List[str], num_personas: int, seed: Optional[int] = None,
+                        output_path: Optional[str] = None, classify: bool = True,
+                        store_path: Optional[str] = None) -> Dict:
+    """列指向の母集団に対する一括シミュレーション（100万件規模のパイプライン・ダッシュボード検証用）
+
+    ペルソナ辞書・ResponseRecord・非同期リクエストを作らず、質問ごとに回答パターンをNumPyで割り当てる。
+    UIのチャートと同じRunningAggregatesに集計し、その内容をサマリーに含める。
+    """
+    started_at = datetime.now()
+    population = PopulationStore().get_or_create(mode, 0 if seed is None else seed, num_personas)
+    provider = SimulationProvider(mode)
+    question_registry = QuestionRegistry()
+    store = SurveyStore(store_path) if store_path else None
+    aggregates = RunningAggregates()
+    aggregates.add_population(population)
+    frames = []
+    survey_ids = []
+
+    for position, question in enumerate(questions):
+        table = provider.simulate_bulk(population, question_registry.intern(question),
+                                       seed=None if seed is None else seed + position)
+        labels = table.classify() if classify else None
+        table.add_to(aggregates, labels)
+        frames.append(table.to_export_frame(question_registry, labels))
+        if store:
+            survey_ids.append(store.save_simulated_survey(mode, question, table, labels, population.key))
+
+    df = pd.concat(frames, ignore_index=True)
+    if output_path:
+        write_results(df, output_path)
+
+    summary = {
+        'mode': mode,
+        'provider': 'simulation',
+        'model': None,
+        'personas': len(population),
+        'questions': len(questions),
+        'responses': len(df),
+        'successful_responses': int(df['success'].sum()),
+        'total_cost_usd': 0.0,
+        'elapsed_sec': (datetime.now() - started_at).total_seconds(),
+        'output_path': output_path,
+        'survey_ids': survey_ids,
+        'population_key': population.key,
+        'aggregates': summarize_aggregates(aggregates)
+    }
+    return {'results': df, 'summary': summary}
+
+def summarize_aggregates(aggregates: RunningAggregates) -> Dict:
+    """チャート用の逐次集計（回答長・立場・主要属性の度数）をJSON化可能な形に"""
+    length_labels, length_counts = aggregates.length_histogram()
+    summary = {
+        'responses': aggregates.response_count,
+        'successful_responses': aggregates.success_count,
+        'response_length_histogram': {label: int(n) for label, n in zip(length_labels, length_counts) if n},
+        'stance_counts': dict(aggregates.stance_counts.most_common()),
+        'top_continents': aggregates.top_values('continent', 5)
+    }
+    if aggregates.age_counts.any():
+        summary['mean_age'] = round(aggregates.mean_age, 2)
+    return summary
+
+def save_to_store(store_path: str, mode: str, provider_type: str, model_name: Optional[str],
+                  personas: List[Dict], outcome: Dict, labels: Optional[pd.DataFrame]) -> List[int]:
+    """質問ごとに1調査としてSurveyStoreへ保存"""
+    store = SurveyStore(store_path)
+    personas_by_id = {p['id']: p for p in personas}
+    responses = outcome['responses']
+    survey_ids = []
+    
+    positions_by_question = {}
+    for position, record in enumerate(responses):
+        positions_by_question.setdefault(record.question_id, []).append(position)
+    
+    for question_id, positions in positions_by_question.items():
+        question_responses = [responses[i] for i in positions]
+        survey_ids.append(store.save_survey(
+            mode, outcome['questions'].text(question_id), question_responses, personas_by_id,
+            labels.iloc[positions] if labels is not None else None,
+            provider=provider_type, model=model_name, total_cost=sum(r.cost_usd for r in question_responses)
+        ))
+    return survey_ids
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="World / Wild Listening ヘッドレス調査実行")
+
+    parser.add_argument("--mode", choices=["humans", "animals"], default="humans", help="調査対象")
+
+    population = parser.add_argument_group("母集団")
+    population.add_argument("--personas", type=int, default=50, help="ペルソナ数")
+    population.add_argument("--seed", type=int, default=None, help="シード（保存済み母集団を再利用）")
+    population.add_argument("--population-file", default=None, help="ペルソナファイル（JSON/JSONL/CSV）")
+    population.add_argument("--population-size", type=int, default=None,
+                            help="仮想母集団サイズ（指定時は層化抽出）")
+    population.add_argument("--margin-of-error", type=float, default=0.05, help="層化抽出の目標誤差幅")
+
+    questions = parser.add_argument_group("質問")
+    questions.add_argument("--question", action="append", default=[], help="質問文（複数指定可）")
+    questions.add_argument("--preset", action="append", default=[], choices=list(EVIDENCE_BASED_QUESTIONS),
+                           help="プリセット質問名（複数指定可）")
+    questions.add_argument("--questions-file", default=None, help="1行1質問のテキストファイル")
+
+    provider = parser.add_argument_group("プロバイダー")
+    provider.add_argument("--provider", choices=["simulation", "openai", "anthropic", "google", "ollama"],
+                          default="simulation")
+    provider.add_argument("--model", default=None, help="モデル名（省略時はプロバイダー既定）")
+    provider.add_argument("--api-key", default=None,
+                          help="APIキー（カンマ区切りで複数指定するとキープール、省略時はOPENAI_API_KEYなどの環境変数）")
+    provider.add_argument("--rpm-per-key", type=int, default=60, help="キープール時のキーあたりRPM上限")
+    provider.add_argument("--prompt-layout", choices=["classic", "cache_friendly"], default="classic",
+                          help="プロンプト構成（cache_friendlyは従来と同じ指示文を先頭に固定してプロンプトキャッシュを再利用。"
+                               "共通部分が最小キャッシュ長未満の場合はサマリーのprompt_cacheに表示）")
+    provider.add_argument("--tpm-per-key", type=int, default=100000, help="キープール時のキーあたりTPM上限（0で無制限）")
+
+    run = parser.add_argument_group("実行")
+    run.add_argument("--follow-up", action="store_true",
+                     help="質問を順番にラウンドとして扱い、前ラウンドまでの回答を会話履歴として送る")
+    run.add_argument("--history-tokens", type=int, default=600, help="フォローアップ時の履歴トークン予算")
+    run.add_argument("--bulk-simulation", action="store_true",
+                     help="シミュレーションを列指向で一括実行（--seed の母集団、--personas 件。100万件規模の検証用）")
+    run.add_argument("--record", default=None,
+                     help="リクエストごとの入出力・使用量・応答時間をカセット（JSONL）に記録")
+    run.add_argument("--replay", default=None,
+                     help="LLMの代わりにカセットから記録時の応答時間どおりに再生（ネットワーク不要）")
+    run.add_argument("--replay-speed", type=float, default=1.0, help="再生時の待ち時間の短縮倍率（2.0で半分）")
+    run.add_argument("--concurrency", type=int, default=8, help="同時リクエスト数")
+    run.add_argument("--budget-usd", type=float, default=None, help="コスト上限（USD）")
+    run.add_argument("--output", default=None,
+                     help="出力ファイル（.csv / .jsonl / .parquet、省略時は日時付きCSV）")
+    run.add_argument("--no-classify", action="store_true", help="ローカル分類ラベルを付与しない")
+    run.add_argument("--store", default="surveys.db", help="結果を保存するSQLiteストア")
+    run.add_argument("--no-store", action="store_true", help="SQLiteストアに保存しない")
+    run.add_argument("--profile", action="store_true",
+                     help="CPUサンプリング・メモリ割り当てを記録して profiles/ に書き出す")
+
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    questions = list(args.question) + [EVIDENCE_BASED_QUESTIONS[name] for name in args.preset]
+    if args.questions_file:
+        with open(args.questions_file, encoding="utf-8") as f:
+            questions += [line.strip() for line in f if line.strip()]
+    if not questions:
+        print("❌ --question / --preset / --questions-file のいずれかで質問を指定してください", file=sys.stderr)
+        return 2
+
+    if args.record and (args.replay or args.provider == "simulation" or args.bulk_simulation):
+        print("❌ --recordはLLMプロバイダーの実行時のみ指定できます", file=sys.stderr)
+        return 2
+
+    api_key = args.api_key or os.environ.get(API_KEY_ENV_VARS.get(args.provider, ""), "")
+    if args.provider in API_KEY_ENV_VARS and not api_key and not args.replay:
+        print(f"❌ {args.provider}には--api-keyまたは{API_KEY_ENV_VARS[args.provider]}が必要です", file=sys.stderr)
+        return 2
+
+    if args.bulk_simulation and (args.provider != "simulation" or args.population_file or args.population_size
+                                 or args.follow_up or args.replay):
+        print("❌ --bulk-simulationはsimulationプロバイダー・シード母集団のみ対応です"
+              "（--population-file / --population-size / --follow-up / --replay とは併用不可）", file=sys.stderr)
+        return 2
+
+    output_path = args.output or f"survey_batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+
+    profiler = SurveyProfiler("batch_survey") if args.profile else contextlib.nullcontext()
+    with profiler:
+        if args.bulk_simulation:
+            result = run_bulk_simulation(args.mode, questions, args.personas, args.seed, output_path,
+                                         classify=not args.no_classify,
+                                         store_path=None if args.no_store else args.store)
+        else:
+            personas = load_personas(args.mode, args.personas, args.seed, args.population_file,
+                                     args.population_size, args.margin_of_error)
+            result = run_batch_survey(personas, questions, args.mode, args.provider, args.model, api_key,
+                                      args.concurrency, args.budget_usd, output_path, classify=not args.no_classify,
+                                      rpm_per_key=args.rpm_per_key, tpm_per_key=args.tpm_per_key or None,
+                                      prompt_layout=args.prompt_layout,
+                                      store_path=None if args.no_store else args.store,
+                                      follow_up=args.follow_up, history_tokens=args.history_tokens,
+                                      record_path=args.record, replay_path=args.replay,
+                                      replay_speed=args.replay_speed)
+
+    print(json.dumps(result['summary'], ensure_ascii=False, indent=2))
+    if args.profile:
+        print(format_profile_summary(profiler.summary()), file=sys.stderr)
+        print(f"📁 {profiler.run_dir}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3051 @@
+# survey_engine.py - World Listening & Wild Listening 調査エンジン（UI非依存）
+#
+# ペルソナ生成・LLMプロバイダー・分類・集計などの調査パイプライン本体。
+# gradio / plotly をimportしないため、ヘッドレス実行（survey_cli.py）からも利用できる。
+
+import pandas as pd
+import numpy as np
+import random
+import json
+import re
+import asyncio
+import time
+import os
+import hashlib
+import math
+import shutil
+import sqlite3
+import sys
+import threading
+import unicodedata
+from datetime import datetime
+from collections import Counter, OrderedDict, deque
+from contextlib import closing
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Any, Tuple, Optional
+
+# LangChain imports
+try:
+    from langchain_openai import ChatOpenAI
+    from langchain_anthropic import ChatAnthropic
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    from langchain_community.llms import Ollama
+    from langchain_core.prompts import (ChatPromptTemplate, SystemMessagePromptTemplate,
+                                        HumanMessagePromptTemplate, MessagesPlaceholder)
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.runnables import RunnablePassthrough, RunnableParallel
+    from langchain.schema import BaseMessage, HumanMessage, SystemMessage
+    from langchain_core.callbacks import BaseCallbackHandler
+    LANGCHAIN_AVAILABLE = True
+except ImportError:
+    LANGCHAIN_AVAILABLE = False
+    BaseCallbackHandler = object
+    print("LangChainライブラリが見つかりません。pip install langchain langchain-openai langchain-anthropic langchain-google-genaiを実行してください。")
+
+@dataclass
+class HumanPersona:
+    """人間ペルソナプロファイル"""
+    id: int
+    age: int
+    gender: str
+    country: str
+    occupation: str
+    education: str
+    income_level: str
+    family_status: str
+    language: str
+    urban_rural: str
+    continent: str
+
+@dataclass
+class AnimalPersona:
+    """動物ペルソナプロファイル"""
+    id: int
+    species: str
+    habitat: str
+    size_category: str
+    diet_type: str
+    activity_pattern: str
+    social_structure: str
+    lifespan_category: str
+    conservation_status: str
+    continent: str
+
+# 国→大陸対応表
+COUNTRY_CONTINENT_MAP = {
+    '中国': 'アジア', 'インド': 'アジア', 'アメリカ': '北米',
+    'インドネシア': 'アジア', 'パキスタン': 'アジア', 'ブラジル': '南米',
+    'ナイジェリア': 'アフリカ', 'バングラデシュ': 'アジア', 'ロシア': 'ヨーロッパ・アジア',
+    'メキシコ': '北米', '日本': 'アジア', 'フィリピン': 'アジア',
+    'エチオピア': 'アフリカ', 'ベトナム': 'アジア', 'エジプト': 'アフリカ',
+    'トルコ': 'ヨーロッパ・アジア', 'イラン': 'アジア', 'ドイツ': 'ヨーロッパ',
+    'タイ': 'アジア', 'イギリス': 'ヨーロッパ'
+}
+
+# 生息環境→大陸対応表
+HABITAT_CONTINENT_MAP = {
+    '熱帯雨林': 'アフリカ・南米・アジア',
+    '温帯林': '北米・ヨーロッパ',
+    '草原・サバンナ': 'アフリカ・アジア',
+    '砂漠': 'アフリカ・アジア・オーストラリア',
+    '山岳地帯': '世界各地',
+    'ツンドラ': '北米・ヨーロッパ・アジア',
+    '湿地': '世界各地',
+    '沿岸部': '世界各地',
+    '混合環境': '世界各地'
+}
+
+class AliasTable:
+    """Walkerのエイリアス法による離散分布サンプラー（1回の抽選がO(1)）"""
+    
+    def __init__(self, values: List[Any], weights: List[float]):
+        self.values = list(values)
+        self.n = len(self.values)
+        
+        scaled = np.asarray(weights, dtype=float)
+        scaled = scaled * self.n / scaled.sum()
+        prob = np.ones(self.n)
+        alias = np.arange(self.n)
+        
+        small = [i for i in range(self.n) if scaled[i] < 1.0]
+        large = [i for i in range(self.n) if scaled[i] >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        
+        self.prob = prob
+        self.alias = alias
+        # スカラー抽選用（NumPyスカラーの生成コストを避ける）
+        self.prob_list = prob.tolist()
+        self.alias_list = alias.tolist()
+    
+    @classmethod
+    def from_distribution(cls, distribution: Dict[Any, float], vocab: Optional[List[Any]] = None) -> 'AliasTable':
+        """分布辞書から作成（vocab指定時はその順序のコードで抽選）"""
+        if vocab is None:
+            return cls(list(distribution.keys()), list(distribution.values()))
+        unknown = set(distribution) - set(vocab)
+        if unknown:
+            raise ValueError(f"語彙にない値があります: {sorted(map(str, unknown))}")
+        return cls(vocab, [distribution.get(value, 0.0) for value in vocab])
+    
+    def sample_index(self, rng: random.Random) -> int:
+        i = int(rng.random() * self.n)
+        return i if rng.random() < self.prob_list[i] else self.alias_list[i]
+    
+    def sample(self, rng: random.Random) -> Any:
+        """1件抽選"""
+        return self.values[self.sample_index(rng)]
+    
+    def sample_codes(self, rng: np.random.Generator, size: int) -> np.ndarray:
+        """size件をまとめて抽選（値のインデックスを返すベクトル版）"""
+        i = rng.integers(0, self.n, size=size)
+        return np.where(rng.random(size) < self.prob[i], i, self.alias[i])
+
+class AliasTableMixin:
+    """分布データベース用のエイリアステーブル構築・キャッシュ"""
+    
+    # 条件付き分布: 属性名 -> (親属性, 周辺分布名)
+    conditional_parents: Dict[str, Tuple[Tuple[str, ...], str]] = {}
+    # 条件付き分布の格納先: 属性名 -> 「親属性値 -> 分布」の辞書を持つ属性名（計算で求める属性は上書きで対応）
+    conditional_sources: Dict[str, str] = {}
+    
+    def build_alias_tables(self):
+        """周辺分布・条件付き分布のエイリアステーブルを一括構築（インスタンスごとに1回）"""
+        self.alias_tables = {
+            name: AliasTable.from_distribution(value)
+            for name, value in vars(self).items()
+            if name.endswith('_distribution') and isinstance(value, dict)
+            and all(isinstance(w, (int, float)) for w in value.values())
+        }
+        self.conditional_alias_tables = {}
+        for attr, (_, marginal_name) in self.conditional_parents.items():
+            vocab = list(getattr(self, marginal_name).keys())
+            self.conditional_alias_tables[attr] = {
+                parent: AliasTable.from_distribution(distribution, vocab)
+                for parent, distribution in self.get_conditional_distributions(attr).items()
+            }
+        self.adhoc_alias_tables = {}
+    
+    def get_conditional_distributions(self, attr: str) -> Dict[Any, Dict[str, float]]:
+        """親属性値 -> 条件付き分布（conditional_sourcesから取得、条件付き属性でなければKeyError）"""
+        source = self.conditional_sources.get(attr) if attr in self.conditional_parents else None
+        if source is None:
+            raise KeyError(attr)
+        return getattr(self, source)
+    
+    def alias(self, distribution: Dict[Any, float]) -> AliasTable:
+        """任意の分布（層内に限定した分布など）のエイリアステーブル（内容でキャッシュ）"""
+        key = tuple(distribution.items())
+        table = self.adhoc_alias_tables.get(key)
+        if table is None:
+            table = AliasTable.from_distribution(distribution)
+            self.adhoc_alias_tables[key] = table
+        return table
+    
+    def conditional_alias(self, attr: str, parent: Any) -> AliasTable:
+        return self.conditional_alias_tables[attr][parent]
+
+class WorldDemographicsDB(AliasTableMixin):
+    """世界人口動態データベース"""
+    
+    conditional_parents = {
+        'language': (('country',), 'language_distribution'),
+        'income_level': (('country', 'education'), 'income_distribution')
+    }
+    conditional_sources = {'language': 'country_language_distribution'}
+    
+    def __init__(self):
+        self.setup_world_demographics()
+        self.build_alias_tables()
+    
+    def setup_world_demographics(self):
+        """世界人口動態データの初期化"""
+        
+        # 年齢分布（世界平均）
+        self.age_distribution = {
+            (0, 14): 25.4, (15, 24): 15.5, (25, 34): 17.2, (35, 44): 13.8,
+            (45, 54): 11.9, (55, 64): 8.7, (65, 74): 5.2, (75, 100): 2.3
+        }
+        
+        # 国別人口分布（人口上位国＋その他）
+        self.country_distribution = {
+            '中国': 17.8, 'インド': 17.7, 'アメリカ': 4.2, 'インドネシア': 3.4,
+            'パキスタン': 2.8, 'ブラジル': 2.7, 'ナイジェリア': 2.6, 'バングラデシュ': 2.1,
+            'ロシア': 1.9, 'メキシコ': 1.6, '日本': 1.6, 'フィリピン': 1.4,
+            'エチオピア': 1.4, 'ベトナム': 1.2, 'エジプト': 1.3, 'トルコ': 1.1,
+            'イラン': 1.1, 'ドイツ': 1.1, 'タイ': 0.9, 'イギリス': 0.9,
+            'その他': 32.8
+        }
+        
+        # 主要言語分布
+        self.language_distribution = {
+            '中国語（標準）': 14.1, 'ヒンディー語': 6.0, '英語': 5.1, 'スペイン語': 4.9,
+            'アラビア語': 4.2, 'ベンガル語': 3.3, 'ポルトガル語': 2.9, 'ロシア語': 2.2,
+            '日本語': 1.7, 'フランス語': 1.3, 'ドイツ語': 1.0, '韓国語': 0.9,
+            'ベトナム語': 0.9, 'トルコ語': 0.8, 'イタリア語': 0.7, 'その他': 50.0
+        }
+        
+        # 世界職業分布
+        self.occupation_distribution = {
+            '農業・畜産業': 26.2, 'サービス業': 15.8, '製造業': 12.6,
+            '商業・貿易': 11.0, '建設業': 6.9, '教育関係': 4.7,
+            '医療・介護': 4.2, '公務員': 3.8, 'IT・技術': 2.9,
+            '運輸業': 2.8, '金融業': 2.1, '学生': 4.5, '無職': 2.5
+        }
+        
+        # 教育レベル
+        self.education_distribution = {
+            '無学歴': 13.2, '初等教育': 28.4, '中等教育': 35.7,
+            '職業訓練': 8.9, '高等教育': 11.2, '大学院': 2.6
+        }
+        
+        # 年収分布（USD）
+        self.income_distribution = {
+            '1,000ドル未満': 15.3, '1,000-5,000ドル': 28.7, '5,000-15,000ドル': 26.9,
+            '15,000-30,000ドル': 14.2, '30,000-50,000ドル': 7.8, '50,000-75,000ドル': 4.1,
+            '75,000-100,000ドル': 1.8, '100,000ドル以上': 1.2
+        }
+        
+        # 家族構成
+        self.family_status_distribution = {
+            '独身': 22.8, '既婚': 45.3, '既婚・子供あり': 25.5,
+            'ひとり親': 4.2, '大家族': 2.2
+        }
+        
+        # 性別・居住地域
+        self.gender_distribution = {'男性': 50.0, '女性': 50.0}
+        self.urban_rural_distribution = {'都市部': 50.0, '地方': 50.0}
+        
+        # 国別の言語分布（国と言語の矛盾した組み合わせを防ぐ）
+        self.country_language_distribution = {
+            '中国': {'中国語（標準）': 90, 'その他': 10},
+            'インド': {'ヒンディー語': 45, '英語': 10, 'ベンガル語': 8, 'その他': 37},
+            'アメリカ': {'英語': 78, 'スペイン語': 13, '中国語（標準）': 1, 'その他': 8},
+            'インドネシア': {'その他': 95, '英語': 5},
+            'パキスタン': {'その他': 90, '英語': 10},
+            'ブラジル': {'ポルトガル語': 98, 'その他': 2},
+            'ナイジェリア': {'英語': 55, 'その他': 45},
+            'バングラデシュ': {'ベンガル語': 97, 'その他': 3},
+            'ロシア': {'ロシア語': 90, 'その他': 10},
+            'メキシコ': {'スペイン語': 93, 'その他': 7},
+            '日本': {'日本語': 98, '英語': 1, 'その他': 1},
+            'フィリピン': {'英語': 40, 'その他': 60},
+            'エチオピア': {'その他': 95, '英語': 3, 'アラビア語': 2},
+            'ベトナム': {'ベトナム語': 90, 'その他': 10},
+            'エジプト': {'アラビア語': 98, '英語': 2},
+            'トルコ': {'トルコ語': 88, 'その他': 12},
+            'イラン': {'その他': 90, 'トルコ語': 8, 'アラビア語': 2},
+            'ドイツ': {'ドイツ語': 90, 'トルコ語': 3, '英語': 2, 'その他': 5},
+            'タイ': {'その他': 95, '中国語（標準）': 3, '英語': 2},
+            'イギリス': {'英語': 95, 'その他': 5},
+            'その他': {
+                'スペイン語': 10, 'アラビア語': 8, '英語': 8, 'フランス語': 6, 'ポルトガル語': 3,
+                'ロシア語': 3, '韓国語': 2, 'イタリア語': 2, 'ドイツ語': 2, '中国語（標準）': 2, 'その他': 54
+            }
+        }
+        
+        # 年収分布の傾き（国の所得水準・教育レベル、正で高所得側へ）
+        self.country_income_shift = {
+            'アメリカ': 0.6, '日本': 0.6, 'ドイツ': 0.6, 'イギリス': 0.6,
+            '中国': 0.15, 'ロシア': 0.15, 'ブラジル': 0.15, 'メキシコ': 0.15,
+            'トルコ': 0.15, 'タイ': 0.15, 'イラン': 0.15,
+            'インド': -0.2, 'インドネシア': -0.2, 'フィリピン': -0.2, 'ベトナム': -0.2,
+            'エジプト': -0.2, 'バングラデシュ': -0.2, 'パキスタン': -0.2, 'ナイジェリア': -0.2,
+            'エチオピア': -0.5, 'その他': 0.0
+        }
+        self.education_income_shift = {
+            '無学歴': -0.35, '初等教育': -0.2, '中等教育': 0.0,
+            '職業訓練': 0.05, '高等教育': 0.25, '大学院': 0.4
+        }
+    
+    def income_distribution_given(self, country: str, education: str) -> Dict[str, float]:
+        """国・教育レベルで条件付けた年収分布（基準分布を指数的に傾ける）"""
+        shift = self.country_income_shift.get(country, 0.0) + self.education_income_shift.get(education, 0.0)
+        center = (len(self.income_distribution) - 1) / 2
+        return {
+            level: weight * float(np.exp(shift * (k - center)))
+            for k, (level, weight) in enumerate(self.income_distribution.items())
+        }
+    
+    def get_conditional_distributions(self, attr: str) -> Dict[Any, Dict[str, float]]:
+        """親属性値 -> 条件付き分布（年収は国・教育の組ごとに算出）"""
+        if attr == 'income_level':
+            return {
+                (country, education): self.income_distribution_given(country, education)
+                for country in self.country_distribution
+                for education in self.education_distribution
+            }
+        return super().get_conditional_distributions(attr)
+
+class TerrestrialAnimalDB(AliasTableMixin):
+    """陸上動物データベース"""
+    
+    conditional_parents = {
+        'habitat': (('species',), 'habitat_distribution'),
+        'diet_type': (('species',), 'diet_distribution'),
+        'size_category': (('species',), 'size_distribution')
+    }
+    conditional_sources = {
+        'habitat': 'species_habitat_distribution',
+        'diet_type': 'species_diet_distribution',
+        'size_category': 'species_size_distribution'
+    }
+    
+    def __init__(self):
+        self.setup_animal_demographics()
+        self.build_alias_tables()
+    
+    def setup_animal_demographics(self):
+        """動物データの初期化"""
+        
+        # 種別分布（主要陸上動物）
+        self.species_distribution = {
+            'アフリカゾウ': 2.1, 'ライオン': 1.8, 'トラ': 0.8, 'ヒグマ': 2.3,
+            'オオカミ': 3.2, 'アカギツネ': 4.5, 'シカ': 5.8, 'イノシシ': 3.9,
+            'チンパンジー': 1.2, 'ゴリラ': 0.6, 'オランウータン': 0.4, 'ヒョウ': 1.5,
+            'チーター': 0.3, 'キリン': 1.1, 'シマウマ': 2.7, 'サイ': 0.5,
+            'カバ': 1.3, 'カンガルー': 3.4, 'パンダ': 0.2, 'ユキヒョウ': 0.3,
+            'ジャガー': 0.7, 'ピューマ': 1.9, 'オオヤマネコ': 1.4, 'バイソン': 1.6,
+            'ヘラジカ': 2.1, 'トナカイ': 3.8, 'ヤマヤギ': 1.7, 'その他': 53.5
+        }
+        
+        # 生息環境
+        self.habitat_distribution = {
+            '熱帯雨林': 18.2, '温帯林': 15.4, '草原・サバンナ': 22.1,
+            '砂漠': 8.7, '山岳地帯': 12.3, 'ツンドラ': 6.8, '湿地': 7.2,
+            '沿岸部': 4.1, '混合環境': 5.2
+        }
+        
+        # サイズカテゴリ
+        self.size_distribution = {
+            '極小（1kg未満）': 8.2, '小型（1-10kg）': 25.4, '中型（10-50kg）': 28.7,
+            '大型（50-200kg）': 22.1, '超大型（200-1000kg）': 12.8, '巨大（1000kg以上）': 2.8
+        }
+        
+        # 食性
+        self.diet_distribution = {
+            '草食動物': 42.3, '肉食動物': 18.7, '雑食動物': 28.4, '昆虫食': 10.6
+        }
+        
+        # 活動パターン
+        self.activity_distribution = {
+            '昼行性': 45.2, '夜行性': 32.1, '薄明活動': 15.7, '無日周性': 7.0
+        }
+        
+        # 社会構造
+        self.social_distribution = {
+            '単独行動': 38.4, 'つがい': 12.6, '小グループ': 23.8, '大群': 18.2, '複雑な社会': 7.0
+        }
+        
+        # 寿命カテゴリ
+        self.lifespan_distribution = {
+            '短命（1-5年）': 15.2, '普通（5-15年）': 35.8, '長寿（15-30年）': 28.4,
+            '非常に長寿（30-50年）': 15.3, '超長寿（50年以上）': 5.3
+        }
+        
+        # 保護状況
+        self.conservation_distribution = {
+            '軽度懸念': 45.2, '準絶滅危惧': 18.7, '危急': 15.8,
+            '絶滅危惧': 12.3, '深刻な危機': 8.0
+        }
+        
+        # 種別の生息環境・食性・サイズ（その他は周辺分布を使用）
+        self.species_habitat_distribution = {
+            'アフリカゾウ': {'草原・サバンナ': 60, '熱帯雨林': 25, '湿地': 10, '砂漠': 5},
+            'ライオン': {'草原・サバンナ': 85, '砂漠': 10, '混合環境': 5},
+            'トラ': {'熱帯雨林': 50, '温帯林': 30, '湿地': 20},
+            'ヒグマ': {'温帯林': 45, '山岳地帯': 30, 'ツンドラ': 15, '沿岸部': 10},
+            'オオカミ': {'温帯林': 40, 'ツンドラ': 25, '山岳地帯': 20, '草原・サバンナ': 15},
+            'アカギツネ': {'温帯林': 35, '混合環境': 30, '草原・サバンナ': 20, 'ツンドラ': 15},
+            'シカ': {'温帯林': 60, '混合環境': 25, '山岳地帯': 15},
+            'イノシシ': {'温帯林': 55, '混合環境': 25, '湿地': 20},
+            'チンパンジー': {'熱帯雨林': 85, '草原・サバンナ': 15},
+            'ゴリラ': {'熱帯雨林': 90, '山岳地帯': 10},
+            'オランウータン': {'熱帯雨林': 100},
+            'ヒョウ': {'草原・サバンナ': 40, '熱帯雨林': 35, '山岳地帯': 15, '砂漠': 10},
+            'チーター': {'草原・サバンナ': 90, '砂漠': 10},
+            'キリン': {'草原・サバンナ': 100},
+            'シマウマ': {'草原・サバンナ': 90, '山岳地帯': 10},
+            'サイ': {'草原・サバンナ': 75, '熱帯雨林': 15, '湿地': 10},
+            'カバ': {'湿地': 80, '草原・サバンナ': 20},
+            'カンガルー': {'草原・サバンナ': 50, '砂漠': 30, '混合環境': 20},
+            'パンダ': {'温帯林': 60, '山岳地帯': 40},
+            'ユキヒョウ': {'山岳地帯': 100},
+            'ジャガー': {'熱帯雨林': 70, '湿地': 30},
+            'ピューマ': {'山岳地帯': 45, '温帯林': 35, '砂漠': 10, '熱帯雨林': 10},
+            'オオヤマネコ': {'温帯林': 60, 'ツンドラ': 20, '山岳地帯': 20},
+            'バイソン': {'草原・サバンナ': 80, '温帯林': 20},
+            'ヘラジカ': {'温帯林': 50, '湿地': 30, 'ツンドラ': 20},
+            'トナカイ': {'ツンドラ': 85, '温帯林': 15},
+            'ヤマヤギ': {'山岳地帯': 100},
+            'その他': self.habitat_distribution
+        }
+        
+        carnivore = {'肉食動物': 100}
+        herbivore = {'草食動物': 100}
+        omnivore = {'雑食動物': 100}
+        self.species_diet_distribution = {
+            'アフリカゾウ': herbivore, 'ライオン': carnivore, 'トラ': carnivore, 'ヒグマ': omnivore,
+            'オオカミ': carnivore, 'アカギツネ': omnivore, 'シカ': herbivore, 'イノシシ': omnivore,
+            'チンパンジー': omnivore, 'ゴリラ': herbivore, 'オランウータン': {'草食動物': 80, '雑食動物': 20},
+            'ヒョウ': carnivore, 'チーター': carnivore, 'キリン': herbivore, 'シマウマ': herbivore,
+            'サイ': herbivore, 'カバ': herbivore, 'カンガルー': herbivore, 'パンダ': {'草食動物': 95, '雑食動物': 5},
+            'ユキヒョウ': carnivore, 'ジャガー': carnivore, 'ピューマ': carnivore, 'オオヤマネコ': carnivore,
+            'バイソン': herbivore, 'ヘラジカ': herbivore, 'トナカイ': herbivore, 'ヤマヤギ': herbivore,
+            'その他': self.diet_distribution
+        }
+        
+        self.species_size_distribution = {
+            'アフリカゾウ': {'巨大（1000kg以上）': 100},
+            'ライオン': {'大型（50-200kg）': 70, '超大型（200-1000kg）': 30},
+            'トラ': {'大型（50-200kg）': 60, '超大型（200-1000kg）': 40},
+            'ヒグマ': {'大型（50-200kg）': 30, '超大型（200-1000kg）': 70},
+            'オオカミ': {'中型（10-50kg）': 80, '大型（50-200kg）': 20},
+            'アカギツネ': {'小型（1-10kg）': 100},
+            'シカ': {'中型（10-50kg）': 40, '大型（50-200kg）': 60},
+            'イノシシ': {'中型（10-50kg）': 30, '大型（50-200kg）': 70},
+            'チンパンジー': {'中型（10-50kg）': 100},
+            'ゴリラ': {'大型（50-200kg）': 100},
+            'オランウータン': {'中型（10-50kg）': 50, '大型（50-200kg）': 50},
+            'ヒョウ': {'中型（10-50kg）': 60, '大型（50-200kg）': 40},
+            'チーター': {'中型（10-50kg）': 100},
+            'キリン': {'巨大（1000kg以上）': 70, '超大型（200-1000kg）': 30},
+            'シマウマ': {'超大型（200-1000kg）': 100},
+            'サイ': {'巨大（1000kg以上）': 100},
+            'カバ': {'巨大（1000kg以上）': 100},
+            'カンガルー': {'中型（10-50kg）': 100},
+            'パンダ': {'大型（50-200kg）': 100},
+            'ユキヒョウ': {'中型（10-50kg）': 100},
+            'ジャガー': {'大型（50-200kg）': 100},
+            'ピューマ': {'中型（10-50kg）': 50, '大型（50-200kg）': 50},
+            'オオヤマネコ': {'小型（1-10kg）': 40, '中型（10-50kg）': 60},
+            'バイソン': {'超大型（200-1000kg）': 50, '巨大（1000kg以上）': 50},
+            'ヘラジカ': {'超大型（200-1000kg）': 100},
+            'トナカイ': {'大型（50-200kg）': 100},
+            'ヤマヤギ': {'中型（10-50kg）': 50, '大型（50-200kg）': 50},
+            'その他': self.size_distribution
+        }
+    
+    def species_distribution_given(self, habitats: Optional[Any] = None, diets: Optional[Any] = None) -> Dict[str, float]:
+        """生息環境・食性を限定したときの種の分布（層化抽出用）"""
+        def mass(distribution: Dict[str, float], allowed) -> float:
+            if allowed is None:
+                return 1.0
+            return sum(w for k, w in distribution.items() if k in allowed) / sum(distribution.values())
+        
+        weights = {
+            species: weight
+            * mass(self.species_habitat_distribution[species], habitats)
+            * mass(self.species_diet_distribution[species], diets)
+            for species, weight in self.species_distribution.items()
+        }
+        return {species: w for species, w in weights.items() if w > 0}
+
+# データベースはモードごとに1インスタンスを共有（エイリアステーブルの再構築を避ける）
+_SHARED_DBS = {}
+
+def get_shared_db(mode: str):
+    """モード別の共有データベース"""
+    if mode not in _SHARED_DBS:
+        _SHARED_DBS[mode] = WorldDemographicsDB() if mode == "humans" else TerrestrialAnimalDB()
+    return _SHARED_DBS[mode]
+
+class PersonaGenerator:
+    """人間・動物両対応ペルソナ生成器"""
+    
+    def __init__(self, mode: str, seed: Optional[int] = None):
+        self.mode = mode
+        self.rng = random.Random(seed)  # シード指定時は再現可能
+        self.db = get_shared_db(mode)
+    
+    def generate_weighted_choice(self, distribution: Dict[str, float]) -> str:
+        """重み付き確率選択（エイリアス法）"""
+        return self.db.alias(distribution).sample(self.rng)
+    
+    def sample_marginal(self, name: str, override: Optional[Dict] = None) -> Any:
+        """周辺分布から抽選（overrideは層内に限定した分布）"""
+        if override:
+            return self.generate_weighted_choice(override)
+        return self.db.alias_tables[name].sample(self.rng)
+    
+    def sample_conditional(self, attr: str, parent: Any, allowed: Optional[Dict] = None) -> str:
+        """条件付き分布から抽選（allowedで値を限定可能）"""
+        if allowed:
+            distribution = self.db.get_conditional_distributions(attr)[parent]
+            return self.generate_weighted_choice({k: w for k, w in distribution.items() if k in allowed})
+        return self.db.conditional_alias(attr, parent).sample(self.rng)
+    
+    def get_continent_from_country(self, country: str) -> str:
+        """国から大陸を取得"""
+        return COUNTRY_CONTINENT_MAP.get(country, '世界各地')
+    
+    def get_continent_from_habitat(self, habitat: str) -> str:
+        """生息環境から大陸を推定"""
+        return HABITAT_CONTINENT_MAP.get(habitat, '世界各地')
+    
+    def generate_human_persona(self, persona_id: int,
+                               country_distribution: Optional[Dict[str, float]] = None,
+                               age_distribution: Optional[Dict[Tuple[int, int], float]] = None) -> HumanPersona:
+        """人間ペルソナ生成（層化抽出時は国・年齢分布を層内に限定可能）"""
+        # 年齢生成
+        selected_range = self.sample_marginal('age_distribution', age_distribution)
+        age = self.rng.randint(selected_range[0], selected_range[1])
+        
+        # 基本属性（言語は国、年収は国・教育レベルで条件付け）
+        country = self.sample_marginal('country_distribution', country_distribution)
+        education = self.sample_marginal('education_distribution')
+        
+        persona = HumanPersona(
+            id=persona_id,
+            age=age,
+            gender=self.sample_marginal('gender_distribution'),
+            country=country,
+            occupation=self.sample_marginal('occupation_distribution'),
+            education=education,
+            income_level=self.sample_conditional('income_level', (country, education)),
+            family_status=self.sample_marginal('family_status_distribution'),
+            language=self.sample_conditional('language', country),
+            urban_rural=self.sample_marginal('urban_rural_distribution'),
+            continent=self.get_continent_from_country(country)
+        )
+        
+        return persona
+    
+    def generate_animal_persona(self, persona_id: int,
+                                habitat_distribution: Optional[Dict[str, float]] = None,
+                                diet_distribution: Optional[Dict[str, float]] = None) -> AnimalPersona:
+        """動物ペルソナ生成（層化抽出時は生息環境・食性分布を層内に限定可能）"""
+        # 種を先に選び、生息環境・食性・サイズを種で条件付け
+        if habitat_distribution or diet_distribution:
+            species = self.generate_weighted_choice(
+                self.db.species_distribution_given(habitat_distribution, diet_distribution)
+            )
+        else:
+            species = self.sample_marginal('species_distribution')
+        
+        habitat = self.sample_conditional('habitat', species, habitat_distribution)
+        
+        persona = AnimalPersona(
+            id=persona_id,
+            species=species,
+            habitat=habitat,
+            size_category=self.sample_conditional('size_category', species),
+            diet_type=self.sample_conditional('diet_type', species, diet_distribution),
+            activity_pattern=self.sample_marginal('activity_distribution'),
+            social_structure=self.sample_marginal('social_distribution'),
+            lifespan_category=self.sample_marginal('lifespan_distribution'),
+            conservation_status=self.sample_marginal('conservation_distribution'),
+            continent=self.get_continent_from_habitat(habitat)
+        )
+        
+        return persona
+    
+    def generate_persona(self, persona_id: int):
+        """モードに応じたペルソナ生成"""
+        if self.mode == "humans":
+            return self.generate_human_persona(persona_id)
+        else:
+            return self.generate_animal_persona(persona_id)
+
+class PersonaPopulation:
+    """列指向のペルソナ母集団（属性ごとのコード配列＋語彙）"""
+    
+    def __init__(self, mode: str, columns: Dict[str, np.ndarray], vocab: Dict[str, List[str]], meta: Dict):
+        self.mode = mode
+        self.columns = columns  # 属性名 -> コード配列（ageのみ実数値）
+        self.vocab = vocab      # 属性名 -> コードに対応する値のリスト
+        self.meta = meta
+    
+    def __len__(self) -> int:
+        return int(self.meta['size'])
+    
+    @property
+    def key(self) -> str:
+        return self.meta['key']
+    
+    def decode(self, attr: str, codes: np.ndarray) -> np.ndarray:
+        """コード配列を値の配列に変換"""
+        if attr not in self.vocab:
+            return np.asarray(codes)
+        return np.asarray(self.vocab[attr], dtype=object)[codes]
+    
+    def persona(self, index: int) -> Dict:
+        """1件のペルソナ辞書（idは1始まり）"""
+        persona = {'id': index + 1}
+        for attr, column in self.columns.items():
+            value = column[index]
+            persona[attr] = self.vocab[attr][value] if attr in self.vocab else int(value)
+        return persona
+    
+    def to_personas(self, indices: Optional[np.ndarray] = None) -> List[Dict]:
+        """ペルソナ辞書のリストに展開（既存の調査パイプライン用）"""
+        if indices is None:
+            indices = np.arange(len(self))
+        indices = np.asarray(indices)
+        
+        decoded = {attr: self.decode(attr, column[indices]).tolist() for attr, column in self.columns.items()}
+        attrs = list(decoded.keys())
+        return [
+            {'id': int(i) + 1, **{attr: decoded[attr][row] for attr in attrs}}
+            for row, i in enumerate(indices)
+        ]
+
+class PopulationStore:
+    """シード付き母集団の生成と内容アドレス型の保存・読み込み（.npy＋語彙ファイル）"""
+    
+    FORMAT_VERSION = 2
+    
+    # モード別の属性列とDB上の分布名
+    COLUMN_DISTRIBUTIONS = {
+        "humans": {
+            'gender': 'gender_distribution', 'country': 'country_distribution',
+            'occupation': 'occupation_distribution', 'education': 'education_distribution',
+            'income_level': 'income_distribution', 'family_status': 'family_status_distribution',
+            'language': 'language_distribution', 'urban_rural': 'urban_rural_distribution'
+        },
+        "animals": {
+            'species': 'species_distribution', 'habitat': 'habitat_distribution',
+            'size_category': 'size_distribution', 'diet_type': 'diet_distribution',
+            'activity_pattern': 'activity_distribution', 'social_structure': 'social_distribution',
+            'lifespan_category': 'lifespan_distribution', 'conservation_status': 'conservation_distribution'
+        }
+    }
+    
+    def __init__(self, root: str = "populations"):
+        self.root = root
+    
+    def distribution_tables(self, generator: PersonaGenerator) -> Dict:
+        """ハッシュ対象の分布テーブル（JSON化可能な形式）"""
+        tables = {
+            name: getattr(generator.db, name)
+            for name in self.COLUMN_DISTRIBUTIONS[generator.mode].values()
+        }
+        if generator.mode == "humans":
+            tables['age_distribution'] = {f"{lo}-{hi}": w for (lo, hi), w in generator.db.age_distribution.items()}
+        for attr in generator.db.conditional_parents:
+            tables[f'{attr}_given'] = {
+                "|".join(parent) if isinstance(parent, tuple) else parent: distribution
+                for parent, distribution in generator.db.get_conditional_distributions(attr).items()
+            }
+        return tables
+    
+    def population_key(self, mode: str, seed: int, size: int) -> str:
+        """シード・サイズ・分布テーブルから内容アドレスを算出"""
+        payload = {
+            'format_version': self.FORMAT_VERSION,
+            'mode': mode,
+            'seed': int(seed),
+            'size': int(size),
+            'tables': self.distribution_tables(PersonaGenerator(mode))
+        }
+        digest = hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()[:16]
+    
+    def generate(self, mode: str, seed: int, size: int) -> PersonaPopulation:
+        """NumPy乱数とエイリアステーブルによるベクトル化母集団生成"""
+        generator = PersonaGenerator(mode)
+        db = generator.db
+        rng = np.random.default_rng(int(seed))
+        columns = {}
+        vocab = {}
+        
+        if mode == "humans":
+            # 年齢: 年齢帯を選択後、帯内で一様
+            ranges = np.array(list(db.age_distribution.keys()), dtype=np.int64)
+            band = db.alias_tables['age_distribution'].sample_codes(rng, size)
+            lows, highs = ranges[band, 0], ranges[band, 1]
+            columns['age'] = (lows + np.floor(rng.random(size) * (highs - lows + 1))).astype(np.uint8)
+        
+        # 周辺分布の属性
+        for attr, dist_name in self.COLUMN_DISTRIBUTIONS[mode].items():
+            vocab[attr] = list(getattr(db, dist_name).keys())
+            if attr not in db.conditional_parents:
+                columns[attr] = db.alias_tables[dist_name].sample_codes(rng, size).astype(np.uint8)
+        
+        # 条件付き属性（親属性値の組ごとにまとめて抽選）
+        for attr, (parents, _) in db.conditional_parents.items():
+            parent_codes = np.zeros(size, dtype=np.int64)
+            for parent in parents:
+                parent_codes = parent_codes * len(vocab[parent]) + columns[parent]
+            
+            codes = np.empty(size, dtype=np.uint8)
+            for combined in np.unique(parent_codes):
+                mask = parent_codes == combined
+                parent_values = []
+                for parent in reversed(parents):
+                    combined, code = divmod(int(combined), len(vocab[parent]))
+                    parent_values.insert(0, vocab[parent][code])
+                parent_key = tuple(parent_values) if len(parents) > 1 else parent_values[0]
+                codes[mask] = db.conditional_alias(attr, parent_key).sample_codes(rng, int(mask.sum()))
+            columns[attr] = codes
+        
+        # 列順をペルソナ定義に揃える
+        columns = {attr: columns[attr] for attr in (['age'] if mode == "humans" else []) + list(vocab)}
+        
+        # 大陸は国・生息環境から導出
+        if mode == "humans":
+            source, to_continent = 'country', generator.get_continent_from_country
+        else:
+            source, to_continent = 'habitat', generator.get_continent_from_habitat
+        continent_values = [to_continent(value) for value in vocab[source]]
+        vocab['continent'] = sorted(set(continent_values))
+        lookup = np.array([vocab['continent'].index(c) for c in continent_values], dtype=np.uint8)
+        columns['continent'] = lookup[columns[source]]
+        
+        meta = {
+            'key': self.population_key(mode, seed, size),
+            'format_version': self.FORMAT_VERSION,
+            'mode': mode,
+            'seed': int(seed),
+            'size': int(size),
+            'columns': list(columns.keys()),
+            'created_at': datetime.now().isoformat()
+        }
+        return PersonaPopulation(mode, columns, vocab, meta)
+    
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.root, key)
+    
+    def save(self, population: PersonaPopulation) -> str:
+        """列ごとの.npy・語彙・メタ情報を保存（一時ディレクトリから置換）"""
+        final_path = self.path_for(population.key)
+        if os.path.isdir(final_path):
+            return final_path
+        
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{final_path}.tmp-{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        
+        for attr, column in population.columns.items():
+            np.save(os.path.join(tmp_path, f"{attr}.npy"), column)
+        with open(os.path.join(tmp_path, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(population.vocab, f, ensure_ascii=False)
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(population.meta, f, ensure_ascii=False, indent=2)
+        
+        try:
+            os.replace(tmp_path, final_path)
+        except OSError:
+            # 他プロセスが先に保存済み
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        return final_path
+    
+    def load(self, key: str) -> PersonaPopulation:
+        """メモリマップで母集団を読み込み（複数プロセスで共有可能）"""
+        path = self.path_for(key)
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "vocab.json"), encoding="utf-8") as f:
+            vocab = json.load(f)
+        
+        columns = {
+            attr: np.load(os.path.join(path, f"{attr}.npy"), mmap_mode='r')
+            for attr in meta['columns']
+        }
+        return PersonaPopulation(meta['mode'], columns, vocab, meta)
+    
+    def get_or_create(self, mode: str, seed: int, size: int) -> PersonaPopulation:
+        """保存済みなら読み込み、なければ生成して保存"""
+        key = self.population_key(mode, seed, size)
+        if not os.path.isdir(self.path_for(key)):
+            self.save(self.generate(mode, seed, size))
+        return self.load(key)
+
+class StratifiedSampler:
+    """大規模仮想母集団からの層化抽出と重み付き推定"""
+    
+    Z_95 = 1.96
+    MIN_PER_STRATUM = 2  # 層内分散推定に必要な最小標本数
+    
+    def __init__(self, mode: str, population_size: int = 1_000_000, margin_of_error: float = 0.05,
+                 seed: Optional[int] = None):
+        self.mode = mode
+        self.population_size = int(population_size)
+        self.margin_of_error = margin_of_error
+        self.generator = PersonaGenerator(mode, seed)
+        self.db = self.generator.db
+        self.strata = self.build_strata()
+        self.allocation = self.allocate(self.required_sample_size())
+        self.stratum_by_persona = {}  # ペルソナID -> 層（回答はID参照のため）
+    
+    def build_strata(self) -> Dict[str, Dict]:
+        """層の定義（人間: 大陸×年齢帯、動物: 大陸×食性）"""
+        strata = {}
+        
+        if self.mode == "humans":
+            # 国分布を大陸ごとにまとめる
+            continent_countries = {}
+            for country, weight in self.db.country_distribution.items():
+                continent = self.generator.get_continent_from_country(country)
+                continent_countries.setdefault(continent, {})[country] = weight
+            
+            country_total = sum(self.db.country_distribution.values())
+            age_total = sum(self.db.age_distribution.values())
+            
+            for continent, countries in continent_countries.items():
+                for age_range, age_weight in self.db.age_distribution.items():
+                    key = f"{continent}|{age_range[0]}-{age_range[1]}歳"
+                    strata[key] = {
+                        'share': sum(countries.values()) / country_total * age_weight / age_total,
+                        'country_distribution': countries,
+                        'age_distribution': {age_range: age_weight}
+                    }
+        else:
+            # 生息環境分布を大陸ごとにまとめる
+            continent_habitats = {}
+            for habitat, weight in self.db.habitat_distribution.items():
+                continent = self.generator.get_continent_from_habitat(habitat)
+                continent_habitats.setdefault(continent, {})[habitat] = weight
+            
+            species_total = sum(self.db.species_distribution.values())
+            
+            # 生息環境・食性は種で条件付くため、層の構成比は種の分布から算出
+            for continent, habitats in continent_habitats.items():
+                for diet_type, diet_weight in self.db.diet_distribution.items():
+                    diets = {diet_type: diet_weight}
+                    share = sum(self.db.species_distribution_given(habitats, diets).values()) / species_total
+                    if share <= 0:
+                        continue
+                    key = f"{continent}|{diet_type}"
+                    strata[key] = {
+                        'share': share,
+                        'habitat_distribution': habitats,
+                        'diet_distribution': diets
+                    }
+        
+        if self.population_size < len(strata):
+            raise ValueError(f"母集団サイズ（{self.population_size:,}）は層の数（{len(strata)}）以上にしてください")
+        
+        # 各層に最低1人を割り当てたうえで、層の人数の合計が母集団サイズに一致するよう最大剰余法で配分
+        shares = np.array([stratum['share'] for stratum in strata.values()])
+        quotas = (self.population_size - len(strata)) * shares / shares.sum()
+        populations = np.floor(quotas).astype(int)
+        remainder = self.population_size - len(strata) - populations.sum()
+        populations[np.argsort(-(quotas - populations), kind='stable')[:remainder]] += 1
+        for stratum, population in zip(strata.values(), populations + 1):
+            stratum['population'] = int(population)
+        
+        return strata
+    
+    def required_sample_size(self) -> int:
+        """目標誤差幅から必要標本数を算出（p=0.5、有限母集団修正あり）"""
+        n0 = (self.Z_95 ** 2) * 0.25 / (self.margin_of_error ** 2)
+        n = n0 / (1 + (n0 - 1) / self.population_size)
+        return int(np.ceil(n))
+    
+    def allocate(self, sample_size: int) -> Dict[str, int]:
+        """比例配分による層別標本数（層内分散のため最低MIN_PER_STRATUM、ただし層の人数が上限）"""
+        allocation = {}
+        for key, stratum in self.strata.items():
+            n_h = max(self.MIN_PER_STRATUM, int(round(sample_size * stratum['share'])))
+            allocation[key] = min(n_h, stratum['population'])
+        return allocation
+    
+    def generate_sample(self) -> List[Dict]:
+        """層化標本ペルソナ生成（層ラベルと調査ウェイト付き）"""
+        personas = []
+        self.stratum_by_persona = {}
+        
+        for key, n_h in self.allocation.items():
+            stratum = self.strata[key]
+            weight = stratum['population'] / n_h
+            
+            for _ in range(n_h):
+                persona_id = len(personas) + 1
+                if self.mode == "humans":
+                    persona = self.generator.generate_human_persona(
+                        persona_id,
+                        country_distribution=stratum['country_distribution'],
+                        age_distribution=stratum['age_distribution']
+                    )
+                else:
+                    persona = self.generator.generate_animal_persona(
+                        persona_id,
+                        habitat_distribution=stratum['habitat_distribution'],
+                        diet_distribution=stratum['diet_distribution']
+                    )
+                
+                persona_dict = asdict(persona)
+                persona_dict['stratum'] = key
+                persona_dict['survey_weight'] = weight
+                personas.append(persona_dict)
+                self.stratum_by_persona[persona_id] = key
+        
+        return personas
+    
+    def estimate_mean(self, values_by_stratum: Dict[str, List[float]]) -> Dict:
+        """層化推定量による母平均と95%信頼区間"""
+        observed = {k: v for k, v in values_by_stratum.items() if k in self.strata and v}
+        if not observed:
+            return {'estimate': 0.0, 'se': 0.0, 'ci_low': 0.0, 'ci_high': 0.0, 'n': 0}
+        
+        # 回答のない層がある場合は観測済みの層で構成比を再正規化
+        share_total = sum(self.strata[k]['share'] for k in observed)
+        estimate = 0.0
+        variance = 0.0
+        
+        for key, values in observed.items():
+            stratum = self.strata[key]
+            w_h = stratum['share'] / share_total
+            values = np.asarray(values, dtype=float)
+            n_h = len(values)
+            
+            estimate += w_h * values.mean()
+            if n_h > 1:
+                fpc = 1 - n_h / stratum['population']
+                variance += (w_h ** 2) * max(fpc, 0.0) * values.var(ddof=1) / n_h
+        
+        se = float(np.sqrt(variance))
+        return {
+            'estimate': float(estimate),
+            'se': se,
+            'ci_low': float(estimate - self.Z_95 * se),
+            'ci_high': float(estimate + self.Z_95 * se),
+            'n': sum(len(v) for v in observed.values())
+        }
+    
+    def estimate_from_responses(self, responses: List['ResponseRecord'], value_fn) -> Dict:
+        """回答リストから層別に値を集計して推定"""
+        values_by_stratum = {}
+        for response in responses:
+            stratum = self.stratum_by_persona.get(response.persona_id)
+            if stratum is not None:
+                values_by_stratum.setdefault(stratum, []).append(value_fn(response))
+        return self.estimate_mean(values_by_stratum)
+    
+    def get_design_summary(self) -> Dict:
+        """標本設計サマリー"""
+        return {
+            'population_size': self.population_size,
+            'margin_of_error': self.margin_of_error,
+            'required_sample_size': self.required_sample_size(),
+            'allocated_sample_size': sum(self.allocation.values()),
+            'strata_count': len(self.strata)
+        }
+
+class LangChainCostTracker:
+    """LangChain用コスト追跡クラス
+    
+    各回答の結果dict（リクエスト単位で計測した使用量・コスト）を集計する。
+    プロバイダー単位・セッション単位のトラッカーは複数スレッドの調査から
+    共有されるため、集計の更新だけをロックで保護する（リクエスト自体は直列化しない）。
+    """
+    
+    def __init__(self):
+        self.total_cost = 0.0
+        self.total_tokens = 0
+        self.requests_count = 0
+        self.provider_costs = {}
+        self.latency_metrics = {}  # プロバイダー別のTTFT・出力速度（ストリーミング時）
+        self.cache_usage = {}  # プロバイダー別のキャッシュ済み／未キャッシュ入力トークン
+        self.lock = threading.Lock()
+    
+    def record_result(self, result: Dict):
+        """generate_responseの結果1件を集計に追加"""
+        provider = result.get('provider', 'unknown')
+        with self.lock:
+            self.add_manual_cost(result.get('cost_usd', 0.0), result.get('tokens_used', 0), provider)
+            if 'ttft_sec' in result:
+                self.add_latency_metrics(provider, result['ttft_sec'], result['tokens_per_sec'], result['latency_sec'])
+            if result.get('input_tokens'):
+                self.add_cache_usage(provider, result['input_tokens'], result.get('cached_input_tokens', 0),
+                                     result.get('cache_creation_tokens', 0), result.get('latency_sec', 0.0))
+    
+    def snapshot(self) -> Dict:
+        """集計のコピー（ロック下で取得するため、更新中のスレッドがあっても整合する）"""
+        with self.lock:
+            return {
+                'total_cost': self.total_cost,
+                'total_tokens': self.total_tokens,
+                'requests_count': self.requests_count,
+                'provider_costs': {p: dict(c) for p, c in self.provider_costs.items()},
+                'latency_metrics': {p: {k: list(v) for k, v in m.items()} for p, m in self.latency_metrics.items()},
+                'cache_usage': {p: {k: list(v) if isinstance(v, list) else v for k, v in u.items()}
+                                for p, u in self.cache_usage.items()}
+            }
+    
+    def merge(self, other: 'LangChainCostTracker'):
+        """別のトラッカーの集計を合算（調査単位→セッション単位など）"""
+        snapshot = other.snapshot()
+        
+        with self.lock:
+            for provider, costs in snapshot['provider_costs'].items():
+                self.total_cost += costs['cost']
+                self.total_tokens += costs['tokens']
+                self.requests_count += costs['requests']
+                target = self.provider_costs.setdefault(provider, {'cost': 0, 'tokens': 0, 'requests': 0})
+                for key in target:
+                    target[key] += costs[key]
+            for provider, metrics in snapshot['latency_metrics'].items():
+                target = self.latency_metrics.setdefault(provider, {'ttft_sec': [], 'tokens_per_sec': [], 'latency_sec': []})
+                for key in target:
+                    target[key].extend(metrics[key])
+            for provider, usage in snapshot['cache_usage'].items():
+                target = self.cache_usage.setdefault(provider, {key: [] if isinstance(value, list) else 0
+                                                                for key, value in usage.items()})
+                for key, value in usage.items():
+                    target[key] += value  # リストは連結
+    
+    def add_manual_cost(self, cost: float, tokens: int, provider: str):
+        """コストを追加（ロックは呼び出し側で取得）"""
+        self.total_cost += cost
+        self.total_tokens += tokens
+        self.requests_count += 1
+        
+        if provider not in self.provider_costs:
+            self.provider_costs[provider] = {'cost': 0, 'tokens': 0, 'requests': 0}
+        
+        self.provider_costs[provider]['cost'] += cost
+        self.provider_costs[provider]['tokens'] += tokens
+        self.provider_costs[provider]['requests'] += 1
+    
+    def add_latency_metrics(self, provider: str, ttft_sec: float, tokens_per_sec: float, latency_sec: float):
+        """ストリーミング応答のレイテンシ指標を追加"""
+        if provider not in self.latency_metrics:
+            self.latency_metrics[provider] = {'ttft_sec': [], 'tokens_per_sec': [], 'latency_sec': []}
+        
+        self.latency_metrics[provider]['ttft_sec'].append(ttft_sec)
+        self.latency_metrics[provider]['tokens_per_sec'].append(tokens_per_sec)
+        self.latency_metrics[provider]['latency_sec'].append(latency_sec)
+    
+    def add_cache_usage(self, provider: str, input_tokens: int, cache_read_tokens: int,
+                        cache_creation_tokens: int, latency_sec: float):
+        """入力トークンのプロンプトキャッシュ利用状況を追加"""
+        if provider not in self.cache_usage:
+            self.cache_usage[provider] = {'requests': 0, 'input_tokens': 0, 'cached_input_tokens': 0,
+                                          'cache_creation_tokens': 0, 'hit_latency_sec': [], 'miss_latency_sec': []}
+        
+        usage = self.cache_usage[provider]
+        usage['requests'] += 1
+        usage['input_tokens'] += input_tokens
+        usage['cached_input_tokens'] += cache_read_tokens
+        usage['cache_creation_tokens'] += cache_creation_tokens
+        usage['hit_latency_sec' if cache_read_tokens else 'miss_latency_sec'].append(latency_sec)
+    
+    def get_cache_summary(self, snapshot: Optional[Dict] = None) -> Dict:
+        """プロバイダー別キャッシュサマリー（キャッシュ率・ヒット時／ミス時の平均応答時間）"""
+        snapshot = snapshot or self.snapshot()
+        summary = {}
+        for provider, usage in snapshot['cache_usage'].items():
+            hits, misses = usage['hit_latency_sec'], usage['miss_latency_sec']
+            summary[provider] = {
+                'requests': usage['requests'],
+                'input_tokens': usage['input_tokens'],
+                'cached_input_tokens': usage['cached_input_tokens'],
+                'uncached_input_tokens': usage['input_tokens'] - usage['cached_input_tokens'],
+                'cache_creation_tokens': usage['cache_creation_tokens'],
+                'cached_ratio': usage['cached_input_tokens'] / max(usage['input_tokens'], 1),
+                'hit_requests': len(hits),
+                'hit_latency_mean_sec': float(np.mean(hits)) if hits else None,
+                'miss_latency_mean_sec': float(np.mean(misses)) if misses else None
+            }
+        return summary
+    
+    def get_latency_summary(self, snapshot: Optional[Dict] = None) -> Dict:
+        """プロバイダー別レイテンシサマリー（平均・p50・p95）"""
+        snapshot = snapshot or self.snapshot()
+        summary = {}
+        for provider, metrics in snapshot['latency_metrics'].items():
+            ttft = np.array(metrics['ttft_sec'])
+            summary[provider] = {
+                'samples': len(ttft),
+                'ttft_mean_sec': float(ttft.mean()),
+                'ttft_p50_sec': float(np.percentile(ttft, 50)),
+                'ttft_p95_sec': float(np.percentile(ttft, 95)),
+                'tokens_per_sec_mean': float(np.mean(metrics['tokens_per_sec'])),
+                'latency_mean_sec': float(np.mean(metrics['latency_sec']))
+            }
+        return summary
+    
+    def get_cost_summary(self) -> Dict:
+        """コストサマリー取得（同一時点のスナップショットから集計）"""
+        snapshot = self.snapshot()
+        return {
+            'total_cost_usd': snapshot['total_cost'],
+            'total_cost_jpy': snapshot['total_cost'] * 150,
+            'total_tokens': snapshot['total_tokens'],
+            'requests_count': snapshot['requests_count'],
+            'cost_per_request': snapshot['total_cost'] / max(snapshot['requests_count'], 1),
+            'provider_breakdown': snapshot['provider_costs'],
+            'latency_breakdown': self.get_latency_summary(snapshot),
+            'cache_breakdown': self.get_cache_summary(snapshot)
+        }
+
+class UsageMetadataCallback(BaseCallbackHandler):
+    """1リクエスト分のトークン使用量（キャッシュ読み出し・書き込み含む）を収集"""
+    
+    def __init__(self):
+        super().__init__()
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_creation_tokens = 0
+    
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+    
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+                if not usage:
+                    continue
+                details = usage.get('input_token_details') or {}
+                self.input_tokens += usage.get('input_tokens', 0)
+                self.output_tokens += usage.get('output_tokens', 0)
+                self.cache_read_tokens += details.get('cache_read', 0) or 0
+                self.cache_creation_tokens += details.get('cache_creation', 0) or 0
+                return
+        
+        # usage_metadata非対応の旧バージョン（OpenAIのllm_output）
+        token_usage = (response.llm_output or {}).get('token_usage') or {}
+        self.input_tokens += token_usage.get('prompt_tokens', 0)
+        self.output_tokens += token_usage.get('completion_tokens', 0)
+        self.cache_read_tokens += (token_usage.get('prompt_tokens_details') or {}).get('cached_tokens', 0) or 0
+
+# プロンプトに埋め込むペルソナ属性（モード別）
+PERSONA_PROMPT_FIELDS = {
+    "humans": ['age', 'gender', 'country', 'occupation', 'education', 'language', 'family_status', 'urban_rural'],
+    "animals": ['species', 'habitat', 'size_category', 'diet_type', 'activity_pattern', 'social_structure',
+                'conservation_status']
+}
+
+def normalize_interaction_input(persona: Dict, question: str, mode: str,
+                                history: Optional[List[Tuple[str, str]]] = None) -> Dict:
+    """記録・再生の照合用に正規化したリクエスト入力（プロンプト構成・モデルには依存しない）"""
+    fields = PERSONA_PROMPT_FIELDS["humans" if mode == "humans" else "animals"]
+    return {
+        'mode': mode,
+        'persona': {field: persona.get(field) for field in fields},
+        'question': " ".join(unicodedata.normalize("NFKC", question).split()),
+        'history': [[role, text] for role, text in (history or [])]
+    }
+
+def interaction_key(normalized_input: Dict) -> str:
+    """正規化入力の内容ハッシュ"""
+    payload = json.dumps(normalized_input, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:20]
+
+class InteractionRecorder:
+    """リクエストごとの正規化入力・出力・使用量・応答時間をカセット（JSONL）へ追記"""
+    
+    USAGE_FIELDS = ['cost_usd', 'tokens_used', 'input_tokens', 'output_tokens',
+                    'cached_input_tokens', 'cache_creation_tokens']
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self.lock = threading.Lock()  # キープールの複数クライアント・複数スレッドから共有
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    
+    def record(self, provider: 'LangChainLLMProvider', persona: Dict, question: str, mode: str,
+               history: Optional[List[Tuple[str, str]]], result: Dict, latency_sec: float):
+        normalized = normalize_interaction_input(persona, question, mode, history)
+        entry = {
+            'key': interaction_key(normalized),
+            'recorded_at': time.time(),
+            'provider': provider.provider_type,
+            'model': provider.model_name,
+            'prompt_layout': provider.prompt_layout,
+            'input': normalized,
+            'success': result['success'],
+            'output': result['response'],
+            'usage': {field: result.get(field, 0) for field in self.USAGE_FIELDS},
+            'latency_sec': latency_sec,
+            'ttft_sec': result.get('ttft_sec'),
+            'error': result.get('error'),
+            'error_type': result.get('error_type'),
+            'status_code': result.get('status_code')
+        }
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self.count += 1
+
+def load_cassette(path: str) -> List[Dict]:
+    """カセット（JSONL）の読み込み"""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# 回答指示（両プロンプト構成で同一の文面。構成の違いは並び順だけにして回答の比較可能性を保つ）
+HUMAN_PROFILE_TEMPLATE = """あなたは{country}出身の{age}歳の{gender}です。
+あなたの背景情報:
+- 職業: {occupation}
+- 教育: {education}
+- 言語: {language}
+- 家族構成: {family_status}
+- 住環境: {urban_rural}"""
+
+HUMAN_SURVEY_INSTRUCTIONS = """あなたの文化的背景、価値観、生活経験を考慮して、質問に自然に回答してください。
+150文字以内で、この人物らしい声で答えてください。"""
+
+ANIMAL_PROFILE_TEMPLATE = """あなたは{habitat}に住む{species}です。
+あなたの特徴:
+- サイズ: {size_category}
+- 食性: {diet_type}
+- 活動パターン: {activity_pattern}
+- 社会構造: {social_structure}
+- 保護状況: {conservation_status}"""
+
+ANIMAL_SURVEY_INSTRUCTIONS = """この動物の本能、生態、環境との関係を考慮して、質問に対するこの種ならではの反応を示してください。
+150文字以内で、この動物の視点から答えてください。"""
+
+# プレフィックスキャッシュが効く共通部分の最小長（トークン、これ未満の共通部分はキャッシュされない）
+PROMPT_CACHE_MIN_TOKENS = {"openai": 1024, "anthropic": 1024}
+ANTHROPIC_HAIKU_CACHE_MIN_TOKENS = 2048
+
+def prompt_cache_min_tokens(provider_type: str, model_name: Optional[str]) -> Optional[int]:
+    """プロバイダー・モデルの最小キャッシュ長（プロンプトキャッシュ非対応ならNone）"""
+    if provider_type == "anthropic" and model_name and "haiku" in model_name:
+        return ANTHROPIC_HAIKU_CACHE_MIN_TOKENS
+    return PROMPT_CACHE_MIN_TOKENS.get(provider_type)
+
+class LangChainLLMProvider:
+    """LangChain用LLMプロバイダー"""
+    
+    # classic: ペルソナ属性をシステムメッセージ冒頭に埋め込む従来構成
+    # cache_friendly: 共通の指示ブロックを先頭に固定し、ペルソナ属性と質問を末尾に置く
+    #   （OpenAIの自動プレフィックスキャッシュ・Anthropicのcache_controlで共通部分を再利用）
+    PROMPT_LAYOUTS = ("classic", "cache_friendly")
+    
+    def __init__(self, provider_type: str, api_key: str, model_name: str = None, prompt_layout: str = "classic"):
+        if not LANGCHAIN_AVAILABLE:
+            raise ImportError("LangChainライブラリが必要です")
+        if prompt_layout not in self.PROMPT_LAYOUTS:
+            raise ValueError(f"サポートされていないプロンプト構成: {prompt_layout}")
+        
+        self.provider_type = provider_type
+        self.model_name = model_name or DEFAULT_MODELS.get(provider_type)
+        self.prompt_layout = prompt_layout
+        self.cost_tracker = LangChainCostTracker()
+        self.recorder: Optional[InteractionRecorder] = None  # 記録モード時のカセット
+        
+        # プロバイダー別のLLM初期化
+        if provider_type == "openai":
+            self.llm = ChatOpenAI(
+                api_key=api_key,
+                model=self.model_name,
+                temperature=0.7,
+                max_tokens=150
+            )
+        elif provider_type == "anthropic":
+            self.llm = ChatAnthropic(
+                api_key=api_key,
+                model=self.model_name,
+                temperature=0.7,
+                max_tokens=150
+            )
+        elif provider_type == "google":
+            self.llm = ChatGoogleGenerativeAI(
+                api_key=api_key,
+                model=self.model_name,
+                temperature=0.7
+            )
+        elif provider_type == "ollama":
+            self.llm = Ollama(
+                model=self.model_name,
+                temperature=0.7
+            )
+        else:
+            raise ValueError(f"サポートされていないプロバイダー: {provider_type}")
+        
+        # プロンプトテンプレートの設定
+        self.setup_prompt_templates()
+        
+        # チェーンの作成
+        self.setup_chains()
+    
+    def setup_prompt_templates(self):
+        """プロンプトテンプレートの設定"""
+        if self.prompt_layout == "cache_friendly":
+            self.setup_cache_friendly_templates()
+            return
+        
+        # 人間用システムプロンプト
+        self.human_system_template = SystemMessagePromptTemplate.from_template(
+            HUMAN_PROFILE_TEMPLATE + "\n\n" + HUMAN_SURVEY_INSTRUCTIONS
+        )
+        
+        # 動物用システムプロンプト
+        self.animal_system_template = SystemMessagePromptTemplate.from_template(
+            ANIMAL_PROFILE_TEMPLATE + "\n\n" + ANIMAL_SURVEY_INSTRUCTIONS
+        )
+        
+        # 人間用チャットプロンプト
+        self.human_chat_template = ChatPromptTemplate.from_messages([
+            self.human_system_template,
+            MessagesPlaceholder("history", optional=True),  # フォローアップ時の会話履歴
+            HumanMessagePromptTemplate.from_template("{question}")
+        ])
+        
+        # 動物用チャットプロンプト
+        self.animal_chat_template = ChatPromptTemplate.from_messages([
+            self.animal_system_template,
+            MessagesPlaceholder("history", optional=True),
+            HumanMessagePromptTemplate.from_template("{question}")
+        ])
+    
+    def static_system_message(self, text: str) -> 'SystemMessage':
+        """全ペルソナ共通の固定システムメッセージ（Anthropicはキャッシュブレークポイント付き）"""
+        if self.provider_type == "anthropic":
+            return SystemMessage(content=[{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}])
+        return SystemMessage(content=text)
+    
+    def setup_cache_friendly_templates(self):
+        """プレフィックスキャッシュ向けテンプレート（固定指示→会話履歴→ペルソナ属性＋質問の順）
+        
+        文面は従来構成と同じで、ペルソナ属性を指示の後ろへ移すだけ。固定指示が最小キャッシュ長に
+        満たない場合はキャッシュされない（get_prompt_cache_statusで確認）。
+        """
+        
+        # 固定指示ブロック（全ペルソナ共通）
+        self.human_system_template = self.static_system_message(HUMAN_SURVEY_INSTRUCTIONS)
+        self.animal_system_template = self.static_system_message(ANIMAL_SURVEY_INSTRUCTIONS)
+        
+        # 人間用チャットプロンプト（可変部分は末尾）
+        self.human_chat_template = ChatPromptTemplate.from_messages([
+            self.human_system_template,
+            MessagesPlaceholder("history", optional=True),
+            HumanMessagePromptTemplate.from_template(HUMAN_PROFILE_TEMPLATE + "\n\n{question}")
+        ])
+        
+        # 動物用チャットプロンプト（可変部分は末尾）
+        self.animal_chat_template = ChatPromptTemplate.from_messages([
+            self.animal_system_template,
+            MessagesPlaceholder("history", optional=True),
+            HumanMessagePromptTemplate.from_template(ANIMAL_PROFILE_TEMPLATE + "\n\n{question}")
+        ])
+    
+    def get_prompt_cache_status(self) -> Dict:
+        """全ペルソナ共通のプレフィックス長と、プロンプトキャッシュが適用され得るか
+        
+        トークン数は1文字1トークンの多めの概算。これでも最小キャッシュ長に届かなければ確実にキャッシュされない。
+        """
+        static_tokens = 0
+        if self.prompt_layout == "cache_friendly":
+            static_tokens = max(len(HUMAN_SURVEY_INSTRUCTIONS), len(ANIMAL_SURVEY_INSTRUCTIONS))
+        min_tokens = prompt_cache_min_tokens(self.provider_type, self.model_name)
+        return {
+            'prompt_layout': self.prompt_layout,
+            'static_prefix_tokens': static_tokens,
+            'min_cacheable_tokens': min_tokens,
+            'cacheable': min_tokens is not None and static_tokens >= min_tokens
+        }
+    
+    def setup_chains(self):
+        """チェーンの設定"""
+        
+        # 出力パーサー
+        self.output_parser = StrOutputParser()
+        
+        # 人間用チェーン
+        self.human_chain = self.human_chat_template | self.llm | self.output_parser
+        
+        # 動物用チェーン
+        self.animal_chain = self.animal_chat_template | self.llm | self.output_parser
+    
+    def set_prompt_layout(self, prompt_layout: str):
+        """プロンプト構成を切り替え（クライアント・コスト追跡はそのまま）"""
+        if prompt_layout == self.prompt_layout:
+            return
+        if prompt_layout not in self.PROMPT_LAYOUTS:
+            raise ValueError(f"サポートされていないプロンプト構成: {prompt_layout}")
+        self.prompt_layout = prompt_layout
+        self.setup_prompt_templates()
+        self.setup_chains()
+    
+    def set_recorder(self, recorder: Optional[InteractionRecorder]):
+        """記録モードの切り替え（Noneで停止）"""
+        self.recorder = recorder
+    
+    async def validate_key(self, timeout_sec: float = 20.0) -> Tuple[bool, str]:
+        """最小リクエストでAPIキーを検証"""
+        try:
+            await asyncio.wait_for(self.llm.ainvoke("ping"), timeout=timeout_sec)
+            return True, "OK"
+        except Exception as e:
+            return False, str(e)[:100]
+    
+    async def validate_keys(self) -> List[Dict]:
+        ok, message = await self.validate_key()
+        return [{'key': 'APIキー', 'valid': ok, 'message': message}]
+    
+    def build_chain_input(self, persona: Dict, question: str, mode: str,
+                          history: Optional[List[Tuple[str, str]]] = None) -> Tuple[Any, Dict]:
+        """モード別のチェーンと入力を作成（historyは (role, text) の会話履歴）"""
+        chain, chain_input = self.build_persona_input(persona, question, mode)
+        chain_input["history"] = list(history or [])
+        return chain, chain_input
+    
+    def build_persona_input(self, persona: Dict, question: str, mode: str) -> Tuple[Any, Dict]:
+        chain = self.human_chain if mode == "humans" else self.animal_chain
+        fields = PERSONA_PROMPT_FIELDS["humans" if mode == "humans" else "animals"]
+        return chain, {**{field: persona[field] for field in fields}, "question": question}
+    
+    async def stream_chain(self, chain, chain_input: Dict, persona_id: int, on_token=None,
+                           config: Optional[Dict] = None) -> Tuple[str, Dict]:
+        """astreamで逐次受信し、TTFT・出力速度を計測"""
+        start = time.perf_counter()
+        first_token_at = None
+        chunks = []
+        
+        # チャットモデル・補完モデルともにStrOutputParser経由で文字列チャンクになる
+        async for chunk in chain.astream(chain_input, config=config):
+            if not chunk:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            chunks.append(chunk)
+            if on_token:
+                on_token(persona_id, chunk)
+        
+        end = time.perf_counter()
+        first_token_at = first_token_at or end
+        generation_sec = end - first_token_at
+        
+        # チャンク数を出力トークン数の近似として使用
+        metrics = {
+            'ttft_sec': first_token_at - start,
+            'latency_sec': end - start,
+            'tokens_per_sec': len(chunks) / generation_sec if generation_sec > 0 else 0.0
+        }
+        return "".join(chunks), metrics
+    
+    async def generate_response(self, persona: Dict, question: str, mode: str,
+                                stream: bool = False, on_token=None, history=None) -> Dict:
+        """LangChainを使用した回答生成（stream=Trueでトークン逐次受信、historyで会話履歴を付与）"""
+        started_at = time.perf_counter()
+        
+        try:
+            # チェーンの選択
+            chain, chain_input = self.build_chain_input(persona, question, mode, history)
+            metrics = {}
+            usage = UsageMetadataCallback()
+            config = {'callbacks': [usage]}
+            
+            # 使用量はこのリクエスト専用のコールバック（usage_metadata）から取得するため、
+            # 同時実行中の他リクエストと混ざらない
+            if stream:
+                response, metrics = await self.stream_chain(chain, chain_input, persona['id'], on_token, config)
+            else:
+                response = await chain.ainvoke(chain_input, config=config)
+                metrics = {'latency_sec': time.perf_counter() - started_at}
+            
+            tokens_used = usage.total_tokens or len(question) // 3 + len(response) // 3  # 未取得時は概算
+            result = {
+                'success': True,
+                'response': response,
+                'cost_usd': estimate_cost_usd(self.model_name, usage.input_tokens, usage.output_tokens,
+                                              usage.cache_read_tokens, usage.cache_creation_tokens),
+                'tokens_used': tokens_used,
+                'input_tokens': usage.input_tokens,
+                'output_tokens': usage.output_tokens,
+                'cached_input_tokens': usage.cache_read_tokens,
+                'cache_creation_tokens': usage.cache_creation_tokens,
+                'provider': self.provider_type,
+                'model': self.model_name,
+                **metrics
+            }
+            self.cost_tracker.record_result(result)
+            
+        except Exception as e:
+            result = {
+                'success': False,
+                'response': f"エラー: {str(e)[:50]}...",
+                'cost_usd': 0.0,
+                'tokens_used': 0,
+                'provider': self.provider_type,
+                'error': str(e),
+                'error_type': type(e).__name__,
+                'status_code': getattr(e, 'status_code', None)
+            }
+        
+        if self.recorder:
+            self.recorder.record(self, persona, question, mode, history, result, time.perf_counter() - started_at)
+        return result
+
+def parse_api_keys(api_keys) -> List[str]:
+    """カンマ・改行区切りのAPIキー文字列（またはリスト）を重複除去したリストに変換"""
+    if isinstance(api_keys, str):
+        api_keys = re.split(r"[,\s]+", api_keys)
+    return list(dict.fromkeys(key.strip() for key in api_keys if key and key.strip()))
+
+class APIKeyBudget:
+    """APIキー単位のレート予算（直近60秒のRPM/TPMスライディングウィンドウ）"""
+    
+    WINDOW_SEC = 60.0
+    
+    def __init__(self, label: str, provider: 'LangChainLLMProvider', rpm: int, tpm: Optional[int]):
+        self.label = label
+        self.provider = provider  # キーごとに独立したクライアント
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = deque()  # [送信時刻, トークン数]
+        self.cooldown_until = 0.0
+        self.consecutive_errors = 0
+        self.usage = {'requests': 0, 'successes': 0, 'rate_limited': 0, 'auth_errors': 0,
+                      'other_errors': 0, 'tokens': 0, 'cost_usd': 0.0}
+    
+    def prune(self, now: float):
+        while self.window and now - self.window[0][0] >= self.WINDOW_SEC:
+            self.window.popleft()
+    
+    def wait_time(self, now: float, tokens: int) -> float:
+        """予算内で送信できるまでの待ち時間（0なら即時送信可）"""
+        self.prune(now)
+        wait = max(self.cooldown_until - now, 0.0)
+        if len(self.window) >= self.rpm:
+            wait = max(wait, self.window[0][0] + self.WINDOW_SEC - now)
+        if self.tpm:
+            used = sum(entry[1] for entry in self.window)
+            for sent_at, entry_tokens in self.window:
+                if used + tokens <= self.tpm:
+                    break
+                used -= entry_tokens
+                wait = max(wait, sent_at + self.WINDOW_SEC - now)
+        return wait
+    
+    def headroom(self, now: float) -> float:
+        """残り予算の比率（キー選択用）"""
+        ratio = 1.0 - len(self.window) / self.rpm
+        if self.tpm:
+            ratio = min(ratio, 1.0 - sum(entry[1] for entry in self.window) / self.tpm)
+        return ratio
+    
+    def reserve(self, now: float, tokens: int) -> List:
+        entry = [now, tokens]
+        self.window.append(entry)
+        self.usage['requests'] += 1
+        return entry
+
+class PooledLLMProvider:
+    """複数APIキーのプールで1プロバイダーを運用（キーごとのRPM/TPM予算で振り分け）
+    
+    429（レート制限）や認証エラーになったキーは一時的にローテーションから外す。
+    """
+    
+    RATE_LIMIT_COOLDOWN_SEC = 20.0
+    AUTH_COOLDOWN_SEC = 600.0
+    MAX_WAIT_SEC = 120.0  # 全キーがこれ以上使えない場合は待たずに失敗扱い
+    PER_KEY_CONCURRENCY = 4
+    OUTPUT_TOKEN_ESTIMATE = 150  # max_tokens相当
+    
+    def __init__(self, provider_type: str, api_keys, model_name: str = None,
+                 rpm_per_key: int = 60, tpm_per_key: Optional[int] = 100000, prompt_layout: str = "classic"):
+        keys = parse_api_keys(api_keys)
+        if not keys:
+            raise ValueError("APIキーが指定されていません")
+        
+        self.provider_type = provider_type
+        self.cost_tracker = LangChainCostTracker()
+        self.lock = threading.Lock()
+        self.budgets = []
+        for key in keys:
+            provider = LangChainLLMProvider(provider_type, key, model_name, prompt_layout)
+            provider.cost_tracker = self.cost_tracker  # コストはプール全体で集計
+            self.budgets.append(APIKeyBudget(self.mask_key(key), provider, max(1, int(rpm_per_key)),
+                                             int(tpm_per_key) if tpm_per_key else None))
+        self.llm = self.budgets[0].provider.llm  # AdvancedAnalysisChain用
+    
+    @property
+    def recommended_concurrency(self) -> int:
+        return len(self.budgets) * self.PER_KEY_CONCURRENCY
+    
+    def set_rate_limits(self, rpm_per_key: int, tpm_per_key: Optional[int]):
+        """キーあたりのRPM/TPM上限を変更（利用実績は保持）"""
+        with self.lock:
+            for budget in self.budgets:
+                budget.rpm = max(1, int(rpm_per_key))
+                budget.tpm = int(tpm_per_key) if tpm_per_key else None
+    
+    def set_prompt_layout(self, prompt_layout: str):
+        for budget in self.budgets:
+            budget.provider.set_prompt_layout(prompt_layout)
+    
+    def get_prompt_cache_status(self) -> Dict:
+        return self.budgets[0].provider.get_prompt_cache_status()
+    
+    def set_recorder(self, recorder: Optional[InteractionRecorder]):
+        """全キーのリクエストを同じカセットに記録"""
+        for budget in self.budgets:
+            budget.provider.recorder = recorder
+    
+    async def validate_keys(self) -> List[Dict]:
+        """全キーを最小リクエストで検証し、無効なキーはローテーションから外す"""
+        results = await asyncio.gather(*(budget.provider.validate_key() for budget in self.budgets))
+        report = []
+        for budget, (ok, message) in zip(self.budgets, results):
+            if not ok and self.classify_error({'error': message}) == 'auth':
+                with self.lock:
+                    budget.usage['auth_errors'] += 1
+                    budget.cooldown_until = time.monotonic() + self.AUTH_COOLDOWN_SEC
+            report.append({'key': budget.label, 'valid': ok, 'message': message})
+        return report
+    
+    @staticmethod
+    def mask_key(key: str) -> str:
+        return f"{key[:4]}…{key[-4:]}" if len(key) > 12 else "…" + key[-2:]
+    
+    @staticmethod
+    def classify_error(result: Dict) -> str:
+        """失敗結果を rate_limit / auth / other に分類"""
+        status = result.get('status_code')
+        error_type = result.get('error_type') or ''
+        message = (result.get('error') or '').lower()
+        if status == 429 or 'RateLimit' in error_type or '429' in message or 'rate limit' in message:
+            return 'rate_limit'
+        if status in (401, 403) or 'Authentication' in error_type or 'PermissionDenied' in error_type \
+                or 'api key' in message or 'api_key' in message:
+            return 'auth'
+        return 'other'
+    
+    def estimate_tokens(self, persona: Dict, question: str) -> int:
+        return (len(question) + 300) // 3 + self.OUTPUT_TOKEN_ESTIMATE
+    
+    async def acquire(self, tokens: int, exclude=()) -> Tuple[Optional[APIKeyBudget], Optional[List]]:
+        """予算に余裕のあるキーを選んで枠を確保（なければ空くまで待機）"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                candidates = [b for b in self.budgets if b not in exclude] or self.budgets
+                waits = [(b.wait_time(now, tokens), b) for b in candidates]
+                ready = [b for wait, b in waits if wait <= 0]
+                if ready:
+                    budget = max(ready, key=lambda b: b.headroom(now))
+                    return budget, budget.reserve(now, tokens)
+                wait = min(wait for wait, _ in waits)
+            if wait > self.MAX_WAIT_SEC:
+                return None, None
+            await asyncio.sleep(min(wait, 1.0))
+    
+    def release(self, budget: APIKeyBudget, entry: List, result: Dict):
+        """実績トークンを反映し、エラー時はキーをクールダウン"""
+        with self.lock:
+            entry[1] = result.get('tokens_used', entry[1]) or entry[1]
+            if result['success']:
+                budget.consecutive_errors = 0
+                budget.usage['successes'] += 1
+                budget.usage['tokens'] += result.get('tokens_used', 0)
+                budget.usage['cost_usd'] += result.get('cost_usd', 0.0)
+                return 'ok'
+            
+            kind = self.classify_error(result)
+            if kind == 'rate_limit':
+                budget.consecutive_errors += 1
+                budget.usage['rate_limited'] += 1
+                budget.cooldown_until = time.monotonic() + self.RATE_LIMIT_COOLDOWN_SEC * 2 ** min(budget.consecutive_errors - 1, 4)
+            elif kind == 'auth':
+                budget.usage['auth_errors'] += 1
+                budget.cooldown_until = time.monotonic() + self.AUTH_COOLDOWN_SEC
+            else:
+                budget.usage['other_errors'] += 1
+            return kind
+    
+    async def generate_response(self, persona: Dict, question: str, mode: str,
+                                stream: bool = False, on_token=None, history=None) -> Dict:
+        """空いているキーで回答生成（レート制限・認証エラー時は別キーで再試行）"""
+        tokens = self.estimate_tokens(persona, question) + sum(len(text) for _, text in history or []) // 3
+        tried = []
+        result = None
+        
+        for _ in range(len(self.budgets)):
+            budget, entry = await self.acquire(tokens, exclude=tried)
+            if budget is None:
+                break
+            tried.append(budget)
+            result = await budget.provider.generate_response(persona, question, mode, stream, on_token, history)
+            result['api_key'] = budget.label
+            if self.release(budget, entry, result) not in ('rate_limit', 'auth'):
+                return result
+        
+        return result or {
+            'success': False,
+            'response': "エラー: 利用可能なAPIキーがありません",
+            'cost_usd': 0.0,
+            'tokens_used': 0,
+            'provider': self.provider_type,
+            'error': "all api keys are cooling down"
+        }
+    
+    def get_key_usage(self) -> List[Dict]:
+        """キー別の利用状況"""
+        now = time.monotonic()
+        usage = []
+        with self.lock:
+            for budget in self.budgets:
+                cooldown = max(budget.cooldown_until - now, 0.0)
+                budget.prune(now)
+                usage.append({
+                    'key': budget.label,
+                    'status': f"停止中（残り{cooldown:.0f}秒）" if cooldown > 0 else "稼働中",
+                    'rpm_limit': budget.rpm,
+                    'tpm_limit': budget.tpm,
+                    'requests_last_min': len(budget.window),
+                    **budget.usage
+                })
+        return usage
+
+class AdvancedAnalysisChain:
+    """高度な分析用LangChainチェーン"""
+    
+    def __init__(self, llm_provider: LangChainLLMProvider):
+        self.llm = llm_provider.llm
+        self.setup_analysis_chains()
+    
+    def setup_analysis_chains(self):
+        """分析用チェーンの設定"""
+        
+        # 洞察生成プロンプト
+        self.insight_prompt = ChatPromptTemplate.from_messages([
+            SystemMessagePromptTemplate.from_template(
+                """あなたは専門的な調査分析者です。
+以下の調査結果データを分析し、主要な洞察と提言を生成してください。
+データの傾向、パターン、意味のある発見を特定し、
+実用的な提言を含めた包括的な分析を提供してください。"""
+            ),
+            HumanMessagePromptTemplate.from_template(
+                """調査データ:
+{survey_data}
+
+質問: {question}
+
+上記のデータから得られる主要な洞察と提言を生成してください。"""
+            )
+        ])
+        
+        # 洞察生成チェーン
+        self.insight_chain = self.insight_prompt | self.llm | StrOutputParser()
+    
+    async def generate_insights(self, survey_data: str, question: str) -> str:
+        """LLMを使用した洞察生成"""
+        
+        try:
+            insights = await self.insight_chain.ainvoke({
+                "survey_data": survey_data,
+                "question": question
+            })
+            return insights
+            
+        except Exception as e:
+            return f"洞察生成エラー: {str(e)}"
+
+class SimulationProvider:
+    """シミュレーション用プロバイダー（LangChain未使用時）"""
+    
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.cost_tracker = LangChainCostTracker()
+        
+        # 回答パターン（前回と同じ）
+        self.human_response_patterns = {
+            '25歳未満': [
+                "将来世代にとって本当に重要な問題だと思います。",
+                "SNSで見た情報だと、早急に対策が必要そうです。",
+                "今行動しないと手遅れになりそうで心配です。"
+            ],
+            '25-65歳': [
+                "経験上、バランスの取れた解決策が必要だと思います。",
+                "経済的な影響も考慮しつつ、環境対策を進めるべきです。",
+                "家族の将来を考えると、真剣に取り組むべき課題です。"
+            ],
+            '65歳以上': [
+                "長年の変化を見てきて、これは重要な問題です。",
+                "孫の世代のことを考えると、対策が必要です。",
+                "持続可能な解決策を見つけることが大切だと思います。"
+            ]
+        }
+        
+        self.animal_response_patterns = {
+            '肉食動物': [
+                "獲物の数が変わると、狩りがもっと大変になります。",
+                "生息地の分断で、狩りの範囲が狭くなっています。",
+                "気候の変化で、獲物がいる場所や時期が変わってきています。"
+            ],
+            '草食動物': [
+                "植物の生える場所や時期が変わって、食べ物探しが難しくなっています。",
+                "季節のずれで、好きな植物が食べられる時期が変わりました。",
+                "人間の活動で、食べ物のある場所が減っています。"
+            ],
+            '雑食動物': [
+                "食べ物の種類が多いので適応できるけど、だんだん厳しくなっています。",
+                "植物も動物も食べられるから何とかなるけど、環境の変化は感じます。",
+                "柔軟な食性が助かるけど、住む場所がなくなるのは困ります。"
+            ]
+        }
+    
+    async def generate_response(self, persona: Dict, question: str, mode: str,
+                                stream: bool = False, on_token=None, history=None) -> Dict:
+        """シミュレーション回答生成（stream=Trueで数文字ずつ逐次送出）"""
+        start = time.perf_counter()
+        await asyncio.sleep(0.05 if stream else 0.1)
+        
+        if mode == "humans":
+            age = persona.get('age', 30)
+            if age < 25:
+                age_group = '25歳未満'
+            elif age <= 65:
+                age_group = '25-65歳'
+            else:
+                age_group = '65歳以上'
+            
+            responses = self.human_response_patterns[age_group]
+            
+        else:
+            diet_type = persona.get('diet_type', '雑食動物')
+            responses = self.animal_response_patterns.get(diet_type, self.animal_response_patterns['雑食動物'])
+        
+        response = random.choice(responses)
+        if history:
+            response = "前回もお話ししましたが、" + response
+        metrics = {}
+        
+        if stream:
+            first_token_at = time.perf_counter()
+            chunks = [response[i:i + 4] for i in range(0, len(response), 4)]
+            for chunk in chunks:
+                if on_token:
+                    on_token(persona.get('id'), chunk)
+                await asyncio.sleep(0.05 / len(chunks))
+            end = time.perf_counter()
+            metrics = {
+                'ttft_sec': first_token_at - start,
+                'latency_sec': end - start,
+                'tokens_per_sec': len(chunks) / max(end - first_token_at, 1e-9)
+            }
+        
+        result = {
+            'success': True,
+            'response': response,
+            'cost_usd': 0.0,
+            'tokens_used': 0,
+            'provider': 'simulation',
+            **metrics
+        }
+        self.cost_tracker.record_result(result)
+        return result
+    
+    def simulate_bulk(self, population: PersonaPopulation, question_id: int,
+                      indices: Optional[np.ndarray] = None, seed: Optional[int] = None) -> 'SimulatedResponseTable':
+        """列指向の母集団に対し、年齢帯・食性コードから回答パターンをNumPyで一括割り当て（待ち時間なし）"""
+        indices = np.arange(len(population)) if indices is None else np.asarray(indices)
+        rng = np.random.default_rng(seed)
+        
+        if population.mode == "humans":
+            groups = list(self.human_response_patterns.values())
+            # generate_responseと同じ区分: 25歳未満 / 25-65歳 / 66歳以上
+            group = np.digitize(population.columns['age'][indices], [25, 66])
+        else:
+            names = list(self.animal_response_patterns.keys())
+            groups = list(self.animal_response_patterns.values())
+            fallback = names.index('雑食動物')
+            group_by_code = np.array([names.index(d) if d in names else fallback
+                                      for d in population.vocab['diet_type']], dtype=np.int64)
+            group = group_by_code[population.columns['diet_type'][indices]]
+        
+        # 全パターンを1つの語彙に並べ、グループ内の位置を一様に抽選
+        patterns = [pattern for patterns in groups for pattern in patterns]
+        sizes = np.array([len(patterns) for patterns in groups], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        codes = offsets[group] + (rng.random(len(indices)) * sizes[group]).astype(np.int64)
+        
+        return SimulatedResponseTable(population, indices, question_id, codes.astype(np.uint16), patterns)
+
+class ReplayProvider:
+    """カセットに記録した応答をオフラインで返すプロバイダー（記録時の応答時間を再現）
+    
+    正規化入力のハッシュが一致すれば記録どおりの出力・使用量・応答時間を返す。
+    一致しない入力は同じ質問（なければ全体）の成功した記録から出力を、成功した記録の応答時間分布から
+    待ち時間を、seed付き乱数で選ぶ。speedで待ち時間を縮める（2.0なら半分）。
+    """
+    
+    def __init__(self, cassette_path: str, mode: str, speed: float = 1.0, seed: int = 0):
+        interactions = load_cassette(cassette_path)
+        if not interactions:
+            raise ValueError(f"カセットに記録がありません: {cassette_path}")
+        
+        self.mode = mode
+        self.speed = speed
+        self.rng = random.Random(seed)
+        self.cost_tracker = LangChainCostTracker()
+        self.provider_type = interactions[0]['provider']
+        self.model_name = interactions[0]['model']
+        self.interactions = interactions
+        
+        # 同じ入力の記録は成功を優先（キープールの429リトライなど失敗分は成功がない場合のみ返す）
+        self.by_key: Dict[str, List[Dict]] = {}
+        for interaction in sorted(interactions, key=lambda i: not i['success']):
+            self.by_key.setdefault(interaction['key'], []).append(interaction)
+        for key, matches in self.by_key.items():
+            self.by_key[key] = [i for i in matches if i['success']] or matches
+        # 一致しない入力の代替は成功した記録からのみ選ぶ（失敗を再生しない）
+        self.successes = [i for i in interactions if i['success']]
+        if not self.successes:
+            raise ValueError(f"カセットに成功した記録がありません: {cassette_path}")
+        self.latencies = [i['latency_sec'] for i in self.successes]  # タイムアウト等の失敗の待ち時間は使わない
+        self.by_question: Dict[str, List[Dict]] = {}
+        for interaction in self.successes:
+            self.by_question.setdefault(interaction['input']['question'], []).append(interaction)
+        
+        self.cursors = Counter()  # 同じ入力が複数回あれば記録順に巡回
+        self.stats = Counter()
+    
+    def lookup(self, normalized: Dict) -> Tuple[Dict, bool]:
+        """(記録, 一致したか)"""
+        key = interaction_key(normalized)
+        matches = self.by_key.get(key)
+        if matches:
+            interaction = matches[self.cursors[key] % len(matches)]
+            self.cursors[key] += 1
+            return interaction, True
+        candidates = self.by_question.get(normalized['question']) or self.successes
+        return candidates[self.rng.randrange(len(candidates))], False
+    
+    async def generate_response(self, persona: Dict, question: str, mode: str,
+                                stream: bool = False, on_token=None, history=None) -> Dict:
+        """記録済み応答の再生（stream=Trueでは記録時のTTFT後に逐次送出）"""
+        interaction, hit = self.lookup(normalize_interaction_input(persona, question, mode, history))
+        self.stats['hits' if hit else 'misses'] += 1
+        latency = (interaction['latency_sec'] if hit else self.rng.choice(self.latencies)) / self.speed
+        ttft = min(interaction['ttft_sec'] / self.speed, latency) if interaction.get('ttft_sec') else latency
+        response = interaction['output']
+        start = time.perf_counter()
+        
+        if stream and interaction['success']:
+            await asyncio.sleep(ttft)
+            chunks = [response[i:i + 4] for i in range(0, len(response), 4)] or [""]
+            for chunk in chunks:
+                if on_token:
+                    on_token(persona.get('id'), chunk)
+                await asyncio.sleep((latency - ttft) / len(chunks))
+        else:
+            await asyncio.sleep(latency)
+        end = time.perf_counter()
+        
+        result = {
+            'success': interaction['success'],
+            'response': response,
+            'provider': self.provider_type,
+            'model': self.model_name,
+            'replay': 'hit' if hit else 'miss',
+            **interaction['usage']
+        }
+        if not interaction['success']:
+            result.update(error=interaction['error'], error_type=interaction['error_type'],
+                          status_code=interaction['status_code'])
+            return result
+        
+        result['latency_sec'] = end - start
+        if stream:
+            result.update(ttft_sec=ttft, tokens_per_sec=len(response) / 4 / max(latency - ttft, 1e-9))
+        self.cost_tracker.record_result(result)
+        return result
+    
+    def get_stats(self) -> Dict:
+        """再生の一致状況"""
+        total = self.stats['hits'] + self.stats['misses']
+        return {
+            'interactions': len(self.interactions),
+            'hits': self.stats['hits'],
+            'misses': self.stats['misses'],
+            'hit_ratio': self.stats['hits'] / max(total, 1)
+        }
+
+class ResponseClassifier:
+    """ローカル辞書ベースの回答分類器（立場・懸念度・トピック）"""
+    
+    # 立場ラベル（どれにも該当しない場合は中立・その他）
+    STANCE_LEXICON = {
+        '積極的対策支持': ['べき', '必要', '大切', '重要', '取り組', '対策', '行動', '守る', '進め', '優先'],
+        '慎重・両立重視': ['バランス', '経済', '両立', 'コスト', '現実的', '慎重', 'しつつ', '段階的'],
+        '懐疑的': ['必要ない', '必要はない', '必要がない', 'べきではない', '重要ではない', '大切ではない',
+                '大げさ', '関係ない', '興味がない', '分からない', 'わからない', '疑問', '誇張']
+    }
+    NEUTRAL_STANCE = '中立・その他'
+    SKEPTICAL_STANCE = '懐疑的'
+    
+    # 否定形（「必要ない」の中の「必要」などを支持語として数えないよう、他の立場の判定前に除去）
+    NEGATED_STANCE_KEYWORDS = ['必要ない', '必要はない', '必要がない', 'べきではない', '重要ではない',
+                               '大切ではない', '関係ない', '興味がない']
+    
+    # 懸念度（懸念語の出現数から安心語の出現数を引いたスコア）
+    CONCERN_KEYWORDS = ['心配', '不安', '深刻', '危機', '手遅れ', '困', '厳し', '難し', '減っ', '失', '脅威', '怖', '大変']
+    REASSURANCE_KEYWORDS = ['大丈夫', '問題ない', '安心', '何とかなる', '適応でき', '楽観']
+    
+    # トピックキーワード
+    TOPIC_LEXICON = {
+        '気候': ['気候', '温暖化', '気温', '季節', '天候', '干ばつ'],
+        '生息地': ['生息地', '住む場所', '森', '分断', '縄張り', '環境'],
+        '食料': ['食べ物', '獲物', '植物', '狩り', '食料', '農業'],
+        '経済': ['経済', 'コスト', '仕事', '収入', 'お金'],
+        '将来世代': ['将来', '孫', '子供', '世代', '家族'],
+        'エネルギー': ['エネルギー', '太陽', '風力', '電気', '化石燃料'],
+        '汚染': ['プラスチック', '汚染', 'ごみ', 'ゴミ', '排出'],
+        '水': ['水', '川', '雨', '海'],
+        '教育・情報': ['教育', '学', 'SNS', '情報', '知識'],
+        '人間活動': ['人間', '開発', '都市', '伐採']
+    }
+    
+    # クロス集計に使うペルソナ属性
+    CROSSTAB_ATTRIBUTES = {
+        "humans": ['continent', 'age_band', 'gender', 'country', 'education', 'income_level', 'urban_rural'],
+        "animals": ['continent', 'diet_type', 'conservation_status', 'habitat', 'size_category', 'social_structure']
+    }
+    
+    AGE_BINS = [0, 15, 25, 35, 45, 55, 65, 75, 101]
+    AGE_LABELS = ['0-14歳', '15-24歳', '25-34歳', '35-44歳', '45-54歳', '55-64歳', '65-74歳', '75歳以上']
+    
+    def __init__(self):
+        self.stance_patterns = {label: self.to_pattern(words) for label, words in self.STANCE_LEXICON.items()}
+        self.negation_pattern = self.to_pattern(self.NEGATED_STANCE_KEYWORDS)
+        self.concern_pattern = self.to_pattern(self.CONCERN_KEYWORDS)
+        self.reassurance_pattern = self.to_pattern(self.REASSURANCE_KEYWORDS)
+        self.topic_patterns = {topic: self.to_pattern(words) for topic, words in self.TOPIC_LEXICON.items()}
+    
+    @staticmethod
+    def to_pattern(words: List[str]) -> str:
+        """キーワード群を正規表現の選択パターンに変換"""
+        return "|".join(re.escape(word) for word in words)
+    
+    def classify(self, texts: pd.Series) -> pd.DataFrame:
+        """回答テキスト列を一括分類（pandas文字列演算によるベクトル化）"""
+        texts = texts.fillna("").astype(str).reset_index(drop=True)
+        
+        # 立場: ラベルごとの一致数が最大のもの（同数なら辞書順の先頭を優先）。
+        # 否定形は除去してから支持・慎重の語を数え、否定形を含む回答は同数なら懐疑的を優先
+        stance_labels = list(self.stance_patterns.keys())
+        negations = texts.str.count(self.negation_pattern).to_numpy()
+        without_negations = texts.str.replace(self.negation_pattern, '', regex=True)
+        stance_counts = np.column_stack([
+            (texts if label == self.SKEPTICAL_STANCE else without_negations).str.count(pattern).to_numpy()
+            for label, pattern in self.stance_patterns.items()
+        ]) if len(texts) else np.zeros((0, len(stance_labels)), dtype=int)
+        best = stance_counts.argmax(axis=1) if len(texts) else np.array([], dtype=int)
+        skeptical = stance_counts[:, stance_labels.index(self.SKEPTICAL_STANCE)]
+        best = np.where((negations > 0) & (skeptical >= stance_counts.max(axis=1, initial=0)),
+                        stance_labels.index(self.SKEPTICAL_STANCE), best)
+        stance = np.where(
+            stance_counts.max(axis=1, initial=0) > 0,
+            np.array(stance_labels, dtype=object)[best],
+            self.NEUTRAL_STANCE
+        )
+        
+        # 懸念度
+        concern_score = (texts.str.count(self.concern_pattern) - texts.str.count(self.reassurance_pattern)).to_numpy()
+        concern_level = np.select([concern_score >= 2, concern_score == 1], ['高', '中'], default='低')
+        
+        result = pd.DataFrame({
+            'stance': stance,
+            'concern_score': concern_score,
+            'concern_level': concern_level
+        })
+        
+        # トピック（トピックごとのフラグ列＋カンマ区切りの一覧）
+        topic_flags = pd.DataFrame({
+            f'topic_{topic}': texts.str.contains(pattern, regex=True).to_numpy()
+            for topic, pattern in self.topic_patterns.items()
+        })
+        topic_names = np.array(list(self.topic_patterns.keys()), dtype=object)
+        result['topics'] = [
+            ", ".join(topic_names[row]) for row in topic_flags.to_numpy()
+        ]
+        
+        return pd.concat([result, topic_flags], axis=1)
+    
+    def classify_responses(self, responses: List['ResponseRecord'], personas_by_id: Dict[int, Dict]) -> pd.DataFrame:
+        """調査回答を分類し、クロス集計用のペルソナ属性列を付与（ペルソナはIDで結合）"""
+        if not responses:
+            return pd.DataFrame()
+        
+        personas = pd.DataFrame([personas_by_id[r.persona_id] for r in responses])
+        if 'age' in personas:
+            personas['age_band'] = pd.cut(personas['age'], bins=self.AGE_BINS,
+                                          labels=self.AGE_LABELS, right=False).astype(str)
+        
+        labels = self.classify(pd.Series([r.response for r in responses]))
+        labels.insert(0, 'success', [r.success for r in responses])
+        return pd.concat([personas.add_prefix('persona_'), labels], axis=1)
+    
+    @staticmethod
+    def crosstab(labeled: pd.DataFrame, attribute: str, target: str = 'stance') -> pd.DataFrame:
+        """ペルソナ属性×分類ラベルのクロス集計（行方向の構成比%）"""
+        column = f'persona_{attribute}'
+        if labeled.empty or column not in labeled or target not in labeled:
+            return pd.DataFrame()
+        
+        table = pd.crosstab(labeled[column], labeled[target], normalize='index') * 100
+        table['回答数'] = labeled[column].value_counts()
+        return table.round(1).reset_index().rename(columns={column: attribute})
+
+class AdaptiveSurveyController:
+    """回答分布の収束に基づく適応的早期停止"""
+    
+    Z_95 = 1.96
+    
+    def __init__(self, tolerance: float = 0.05, wave_size: int = 20, min_responses: int = 30):
+        self.tolerance = tolerance
+        self.wave_size = max(1, int(wave_size))
+        self.min_responses = min_responses
+        self.classifier = ResponseClassifier()
+        self.stance_labels = []  # 回答順の立場ラベル（新規ウェーブ分のみ逐次分類）
+        self.personas_by_id = {}
+        self.history = []
+    
+    def make_waves(self, personas: List[Dict]) -> List[List[Dict]]:
+        """ペルソナをランダムな順序のウェーブに分割"""
+        self.personas_by_id = {p['id']: p for p in personas}
+        shuffled = random.sample(personas, len(personas))
+        return [shuffled[i:i + self.wave_size] for i in range(0, len(shuffled), self.wave_size)]
+    
+    def segment_of(self, response: 'ResponseRecord') -> str:
+        """セグメント（人間: 大陸、動物: 食性）"""
+        persona = self.personas_by_id.get(response.persona_id, {})
+        return persona.get('diet_type') or persona.get('continent', '不明')
+    
+    def proportion_stats(self, labels: List[str]) -> Dict[str, Dict]:
+        """カテゴリ構成比と95%信頼区間の半幅"""
+        n = len(labels)
+        stats = {}
+        for label, count in pd.Series(labels).value_counts().items():
+            share = count / n
+            stats[label] = {
+                'share': share,
+                'half_width': self.Z_95 * np.sqrt(share * (1 - share) / n)
+            }
+        return stats
+    
+    def compute_statistics(self, responses: List['ResponseRecord']) -> Dict:
+        """ウェーブ終了時点の集計統計"""
+        # 回答カテゴリ（ローカル分類器による立場ラベル、未分類の回答のみ分類）
+        new_responses = responses[len(self.stance_labels):]
+        if new_responses:
+            self.stance_labels.extend(self.classifier.classify(pd.Series([r.response for r in new_responses]))['stance'])
+        
+        successful_pairs = [(r, label) for r, label in zip(responses, self.stance_labels) if r.success]
+        successful = [r for r, _ in successful_pairs]
+        labels = [label for _, label in successful_pairs]
+        lengths = np.array([len(r.response) for r in successful], dtype=float)
+        n = len(successful)
+        
+        categories = self.proportion_stats(labels) if n else {}
+        
+        if n > 1 and lengths.mean() > 0:
+            length_half_width = self.Z_95 * lengths.std(ddof=1) / np.sqrt(n)
+            length_relative_half_width = length_half_width / lengths.mean()
+        else:
+            length_half_width = float('inf')
+            length_relative_half_width = float('inf')
+        
+        segments = {}
+        for response, label in zip(successful, labels):
+            segments.setdefault(self.segment_of(response), []).append(label)
+        
+        return {
+            'n': n,
+            'categories': categories,
+            'max_category_half_width': max((c['half_width'] for c in categories.values()), default=float('inf')),
+            'length_mean': float(lengths.mean()) if n else 0.0,
+            'length_half_width': length_half_width,
+            'length_relative_half_width': length_relative_half_width,
+            'segment_shares': {seg: len(labels) / n for seg, labels in segments.items()} if n else {},
+            'segment_categories': {seg: self.proportion_stats(labels) for seg, labels in segments.items()}
+        }
+    
+    def check_convergence(self, responses: List['ResponseRecord']) -> Tuple[bool, str, Dict]:
+        """収束判定（停止可否・停止理由・統計）"""
+        stats = self.compute_statistics(responses)
+        self.history.append(stats)
+        
+        if stats['n'] < self.min_responses:
+            return False, "", stats
+        
+        if (stats['max_category_half_width'] <= self.tolerance
+                and stats['length_relative_half_width'] <= self.tolerance):
+            reason = (f"収束: カテゴリ構成比の95%CI半幅 ±{stats['max_category_half_width'] * 100:.1f}%、"
+                      f"平均回答長の相対半幅 ±{stats['length_relative_half_width'] * 100:.1f}% "
+                      f"が許容誤差 {self.tolerance * 100:.1f}% 以下")
+            return True, reason, stats
+        
+        return False, "", stats
+
+class RunningAggregates:
+    """ペルソナ・回答の逐次集計（チャートは事前ビン集計から描画）"""
+    
+    AGE_BIN_WIDTH = 5
+    MAX_AGE = 100
+    LENGTH_BIN_WIDTH = 10
+    MAX_LENGTH = 300  # これ以上の回答長（エラー文・指示を無視した長文）は最後のビンにまとめる
+    
+    # 値の出現数を保持するペルソナ属性
+    PERSONA_COUNT_ATTRIBUTES = [
+        'gender', 'country', 'language', 'continent',
+        'species', 'habitat', 'diet_type', 'conservation_status'
+    ]
+    
+    def __init__(self):
+        self.reset_personas()
+        self.reset_responses()
+    
+    def reset_personas(self):
+        """ペルソナ集計の初期化"""
+        self.persona_count = 0
+        self.age_sum = 0
+        self.age_counts = np.zeros(self.MAX_AGE // self.AGE_BIN_WIDTH + 1, dtype=np.int64)
+        self.persona_value_counts = {attr: Counter() for attr in self.PERSONA_COUNT_ATTRIBUTES}
+    
+    def reset_responses(self):
+        """回答集計の初期化"""
+        self.response_count = 0
+        self.success_count = 0
+        self.length_counts = np.zeros(0, dtype=np.int64)
+        self.stance_counts = Counter()
+    
+    def add_personas(self, personas: List[Dict]):
+        """ペルソナを集計に追加"""
+        if not personas:
+            return
+        
+        self.persona_count += len(personas)
+        
+        if 'age' in personas[0]:
+            ages = np.fromiter((p['age'] for p in personas), dtype=np.int64, count=len(personas))
+            self.age_sum += int(ages.sum())
+            bins = np.minimum(ages, self.MAX_AGE) // self.AGE_BIN_WIDTH
+            self.age_counts += np.bincount(bins, minlength=len(self.age_counts))
+        
+        for attr, counter in self.persona_value_counts.items():
+            if attr in personas[0]:
+                counter.update(p[attr] for p in personas)
+    
+    def add_population(self, population: 'PersonaPopulation', indices: Optional[np.ndarray] = None):
+        """列指向の母集団を集計に追加（コード配列のbincountで集計）"""
+        indices = np.arange(len(population)) if indices is None else np.asarray(indices)
+        self.persona_count += len(indices)
+        
+        if 'age' in population.columns:
+            ages = population.columns['age'][indices].astype(np.int64)
+            self.age_sum += int(ages.sum())
+            bins = np.minimum(ages, self.MAX_AGE) // self.AGE_BIN_WIDTH
+            self.age_counts += np.bincount(bins, minlength=len(self.age_counts))
+        
+        for attr, counter in self.persona_value_counts.items():
+            if attr in population.columns:
+                vocab = population.vocab[attr]
+                counts = np.bincount(population.columns[attr][indices], minlength=len(vocab))
+                counter.update({vocab[code]: int(n) for code, n in enumerate(counts) if n})
+    
+    def add_response_lengths(self, lengths: np.ndarray, success: np.ndarray):
+        """回答長を集計に追加（ベクトル版）"""
+        self.response_count += len(lengths)
+        self.success_count += int(np.count_nonzero(success))
+        
+        lengths = np.minimum(np.asarray(lengths, dtype=np.int64), self.MAX_LENGTH)
+        bins = np.bincount(lengths // self.LENGTH_BIN_WIDTH)
+        if len(bins) > len(self.length_counts):
+            self.length_counts = np.pad(self.length_counts, (0, len(bins) - len(self.length_counts)))
+        self.length_counts[:len(bins)] += bins
+    
+    def add_responses(self, responses: List['ResponseRecord']):
+        """回答を集計に追加"""
+        if not responses:
+            return
+        
+        lengths = np.fromiter((len(r.response) for r in responses), dtype=np.int64, count=len(responses))
+        success = np.fromiter((r.success for r in responses), dtype=bool, count=len(responses))
+        self.add_response_lengths(lengths, success)
+    
+    def add_stance_labels(self, labels):
+        """立場ラベルを集計に追加"""
+        self.stance_counts.update(labels)
+    
+    @property
+    def mean_age(self) -> float:
+        return self.age_sum / max(self.persona_count, 1)
+    
+    def top_values(self, attr: str, n: Optional[int] = None) -> Dict[str, int]:
+        """属性値の上位n件"""
+        return dict(self.persona_value_counts[attr].most_common(n))
+    
+    def age_histogram(self) -> Tuple[List[str], np.ndarray]:
+        """年齢ヒストグラム（ビンラベル、度数）"""
+        width = self.AGE_BIN_WIDTH
+        labels = [f"{i * width}-{i * width + width - 1}" for i in range(len(self.age_counts))]
+        return labels, self.age_counts
+    
+    def length_histogram(self) -> Tuple[List[str], np.ndarray]:
+        """回答長ヒストグラム（ビンラベル、度数、最後のビンはMAX_LENGTH以上）"""
+        width = self.LENGTH_BIN_WIDTH
+        labels = [f"{i * width}-{i * width + width - 1}" if i * width < self.MAX_LENGTH else f"{self.MAX_LENGTH}以上"
+                  for i in range(len(self.length_counts))]
+        return labels, self.length_counts
+
+# エビデンスベース質問プリセット
+EVIDENCE_BASED_QUESTIONS = {
+    "気候変動の影響": "気候変動はあなたの環境や日常生活にどのような影響を与えていますか？",
+    "生物多様性の保全": "生物多様性を守るために最も重要だと思う取り組みは何ですか？",
+    "生息地の保護": "あなたの地域での生息地保護はどのくらい重要ですか？",
+    "持続可能な実践": "みんなが取り組むべき持続可能な実践は何だと思いますか？",
+    "種の絶滅への懸念": "種の絶滅についてどのくらい心配していますか？",
+    "再生可能エネルギー": "将来、再生可能エネルギーはどのような役割を果たすべきですか？",
+    "プラスチック汚染": "プラスチック汚染はあなたの環境にどのような影響を与えていますか？",
+    "水資源の保全": "最も重要な水資源保全対策は何だと思いますか？",
+    "森林破壊への対策": "森林破壊を止めるために何が必要だと思いますか？",
+    "環境教育の重要性": "環境教育はどのくらい重要だと思いますか？"
+}
+
+# LLMプロバイダー設定
+LLM_PROVIDERS = {
+    "OpenAI GPT-4o-mini": {"type": "openai", "model": "gpt-4o-mini"},
+    "OpenAI GPT-4": {"type": "openai", "model": "gpt-4"},
+    "Anthropic Claude-3-Haiku": {"type": "anthropic", "model": "claude-3-haiku-20240307"},
+    "Anthropic Claude-3-Sonnet": {"type": "anthropic", "model": "claude-3-sonnet-20240229"},
+    "Google Gemini Pro": {"type": "google", "model": "gemini-pro"},
+    "Ollama Llama2": {"type": "ollama", "model": "llama2"},
+    "シミュレーション（無料）": {"type": "simulation", "model": None}
+}
+
+# プロバイダー別の既定モデル（model_name省略時）
+DEFAULT_MODELS = {
+    "openai": "gpt-4o-mini",
+    "anthropic": "claude-3-haiku-20240307",
+    "google": "gemini-pro",
+    "ollama": "llama2"
+}
+
+# モデル別単価（USD / 100万トークン）。cached_input はキャッシュ読み出し、cache_creation はキャッシュ書き込み
+# モデル名は前方一致で引く（日付つきスナップショット名にも対応）。未登録・ローカルモデルは0円扱い
+MODEL_PRICING = {
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "gpt-4": {"input": 30.00, "cached_input": 30.00, "output": 60.00},
+    "gpt-3.5-turbo": {"input": 0.50, "cached_input": 0.50, "output": 1.50},
+    "claude-3-haiku": {"input": 0.25, "cached_input": 0.03, "cache_creation": 0.30, "output": 1.25},
+    "claude-3-sonnet": {"input": 3.00, "cached_input": 0.30, "cache_creation": 3.75, "output": 15.00},
+    "claude-3-5-sonnet": {"input": 3.00, "cached_input": 0.30, "cache_creation": 3.75, "output": 15.00},
+    "gemini-pro": {"input": 0.50, "cached_input": 0.50, "output": 1.50},
+    "gemini-1.5-flash": {"input": 0.075, "cached_input": 0.01875, "output": 0.30}
+}
+
+def estimate_cost_usd(model_name: Optional[str], input_tokens: int, output_tokens: int,
+                      cached_input_tokens: int = 0, cache_creation_tokens: int = 0) -> float:
+    """1リクエストの使用量からコストを計算（input_tokensはキャッシュ分を含む合計）"""
+    matches = [name for name in MODEL_PRICING if model_name and model_name.startswith(name)]
+    if not matches:
+        return 0.0
+    price = MODEL_PRICING[max(matches, key=len)]
+    uncached = max(input_tokens - cached_input_tokens - cache_creation_tokens, 0)
+    return (uncached * price["input"]
+            + cached_input_tokens * price["cached_input"]
+            + cache_creation_tokens * price.get("cache_creation", price["input"])
+            + output_tokens * price["output"]) / 1_000_000
+
+class QuestionRegistry:
+    """質問文⇔質問IDの対応表（回答ごとに質問文を持たない）"""
+    
+    def __init__(self):
+        self.texts: List[str] = []
+        self.ids: Dict[str, int] = {}
+    
+    def intern(self, text: str) -> int:
+        """質問文を登録してIDを返す（登録済みなら既存ID）"""
+        question_id = self.ids.get(text)
+        if question_id is None:
+            question_id = len(self.texts)
+            self.texts.append(text)
+            self.ids[text] = question_id
+        return question_id
+    
+    def text(self, question_id: int) -> str:
+        return self.texts[question_id]
+
+class ResponseRecord:
+    """コンパクトな回答レコード（ペルソナ・質問はID参照、時刻はUNIX秒、reusedは過去の調査から再利用した回答）"""
+    
+    __slots__ = ('persona_id', 'question_id', 'response', 'success', 'cost_usd', 'provider', 'timestamp', 'reused')
+    
+    def __init__(self, persona_id: int, question_id: int, response: str, success: bool = True,
+                 cost_usd: float = 0.0, provider: str = 'unknown', timestamp: Optional[float] = None,
+                 reused: bool = False):
+        self.persona_id = persona_id
+        self.question_id = question_id
+        self.response = response
+        self.success = success
+        self.cost_usd = cost_usd
+        self.provider = sys.intern(provider)  # プロバイダー名は全回答で共有
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.reused = reused
+    
+    def as_dict(self) -> Dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+class SimulatedResponseTable:
+    """列指向のシミュレーション回答表（回答はパターン語彙へのコード配列、ペルソナは母集団の行番号）
+    
+    100万件規模でも回答文字列やResponseRecordを作らずに、集計・分類・エクスポート・保存まで行う。
+    ペルソナIDは母集団の行番号+1（PersonaPopulation.to_personasと同じ）。
+    """
+    
+    provider = 'simulation'
+    
+    def __init__(self, population: PersonaPopulation, indices: np.ndarray, question_id: int,
+                 codes: np.ndarray, patterns: List[str], timestamp: Optional[float] = None):
+        self.population = population
+        self.indices = indices
+        self.question_id = question_id
+        self.codes = codes
+        self.patterns = patterns
+        self.timestamp = time.time() if timestamp is None else timestamp
+    
+    def __len__(self) -> int:
+        return len(self.codes)
+    
+    @property
+    def persona_ids(self) -> np.ndarray:
+        return self.indices + 1  # PersonaPopulation.personaと同じ1始まり
+    
+    @property
+    def success(self) -> np.ndarray:
+        return np.ones(len(self), dtype=bool)
+    
+    def responses(self) -> pd.Categorical:
+        """回答文字列列（カテゴリ型、重複パターンは1カテゴリにまとめる）"""
+        categories = list(dict.fromkeys(self.patterns))
+        remap = np.array([categories.index(p) for p in self.patterns], dtype=np.int64)
+        return pd.Categorical.from_codes(remap[self.codes], categories=categories)
+    
+    def lengths(self) -> np.ndarray:
+        return np.array([len(p) for p in self.patterns], dtype=np.int64)[self.codes]
+    
+    def persona_frame(self, attrs: Optional[List[str]] = None) -> pd.DataFrame:
+        """ペルソナ属性列（語彙つき属性はカテゴリ型で展開）"""
+        attrs = [a for a in (attrs or self.population.columns) if a in self.population.columns]
+        frame = {}
+        for attr in attrs:
+            codes = self.population.columns[attr][self.indices]
+            if attr in self.population.vocab:
+                frame[attr] = pd.Categorical.from_codes(codes.astype(np.int64), categories=self.population.vocab[attr])
+            else:
+                frame[attr] = codes.astype(np.int64)
+        return pd.DataFrame(frame)
+    
+    def classify(self, classifier: Optional['ResponseClassifier'] = None) -> pd.DataFrame:
+        """classify_responsesと同じ形式の分類結果（パターンごとに1回だけ分類して展開）"""
+        classifier = classifier or ResponseClassifier()
+        pattern_labels = classifier.classify(pd.Series(self.patterns))
+        labels = pattern_labels.iloc[self.codes].reset_index(drop=True)
+        labels.insert(0, 'success', self.success)
+        
+        personas = self.persona_frame()
+        personas.insert(0, 'id', self.persona_ids)
+        if 'age' in personas:
+            personas['age_band'] = pd.cut(personas['age'], bins=ResponseClassifier.AGE_BINS,
+                                          labels=ResponseClassifier.AGE_LABELS, right=False).astype(str)
+        return pd.concat([personas.add_prefix('persona_'), labels], axis=1)
+    
+    def add_to(self, aggregates: 'RunningAggregates', labels: Optional[pd.DataFrame] = None):
+        """チャート用の逐次集計に追加"""
+        aggregates.add_response_lengths(self.lengths(), self.success)
+        if labels is not None:
+            aggregates.add_stance_labels(labels['stance'].value_counts().to_dict())
+    
+    def to_export_frame(self, questions: QuestionRegistry, labels: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """build_export_frameと同じ列構成のエクスポート用DataFrame"""
+        df = pd.DataFrame({
+            'persona_id': self.persona_ids,
+            'question': pd.Categorical.from_codes(np.zeros(len(self), dtype=np.int64),
+                                                  categories=[questions.text(self.question_id)]),
+            'response': self.responses(),
+            'success': self.success,
+            'provider': self.provider,
+            'timestamp': datetime.fromtimestamp(self.timestamp).isoformat()
+        })
+        df = pd.concat([df, self.persona_frame().add_prefix('persona_')], axis=1)
+        
+        if labels is not None and len(labels) == len(df):
+            label_columns = ['stance', 'concern_level', 'concern_score', 'topics']
+            df = pd.concat([df, labels[label_columns].reset_index(drop=True)], axis=1)
+        
+        return df
+
+class ConversationMemory:
+    """ペルソナごとの会話履歴（フォローアップ調査用、トークン予算つき）
+    
+    履歴は (質問ID, 回答) の組で保持し、送信時に (role, text) の列へ展開する。
+    予算を超えたら古いターンの前半をまとめて抽出要約に畳み込むため、
+    システムプロンプト＋履歴のプレフィックスはラウンド間でほぼ変わらない。
+    """
+    
+    SUMMARY_HEADER = "（これまでの質問と回答の要約）"
+    
+    def __init__(self, questions: QuestionRegistry, max_history_tokens: int = 600, summary_tokens: int = 150):
+        self.questions = questions
+        self.max_history_tokens = max_history_tokens
+        self.summary_tokens = summary_tokens
+        self.turns: Dict[int, List[Tuple[int, str]]] = {}
+        self.summaries: Dict[int, str] = {}
+    
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        return len(text) // 3 + 1
+    
+    def turn_tokens(self, turn: Tuple[int, str]) -> int:
+        question_id, response = turn
+        return self.estimate_tokens(self.questions.text(question_id)) + self.estimate_tokens(response)
+    
+    def record_responses(self, responses: List[ResponseRecord]):
+        """今回実際に質問して成功した回答を各ペルソナの履歴に追加（再利用した回答は会話していないため除く）"""
+        for record in responses:
+            if record.success and not record.reused:
+                self.turns.setdefault(record.persona_id, []).append((record.question_id, record.response))
+                self.compact(record.persona_id)
+    
+    def compact(self, persona_id: int):
+        """予算に収まるまで古いターンの前半を要約へ畳み込み続ける（直近1ターンは必ず残す）"""
+        while True:
+            turns = self.turns[persona_id]
+            budget = self.max_history_tokens - self.estimate_tokens(self.summaries.get(persona_id, ""))
+            if sum(self.turn_tokens(turn) for turn in turns) <= budget or len(turns) <= 1:
+                return
+            
+            fold = max(1, len(turns) // 2)
+            lines = [line for line in self.summaries.get(persona_id, "").split("\n") if line]
+            lines += [f"・「{self.questions.text(q)[:30]}」→「{response[:40]}」" for q, response in turns[:fold]]
+            while len(lines) > 1 and self.estimate_tokens("\n".join(lines)) > self.summary_tokens:
+                lines.pop(0)  # 要約も予算内に収まるよう古いものから捨てる
+            self.summaries[persona_id] = "\n".join(lines)
+            self.turns[persona_id] = turns[fold:]
+    
+    def history(self, persona_id: int) -> List[Tuple[str, str]]:
+        """送信用の会話履歴（要約は最初のhumanターンの先頭に付与）"""
+        messages = []
+        for question_id, response in self.turns.get(persona_id, []):
+            messages.append(("human", self.questions.text(question_id)))
+            messages.append(("ai", response))
+        
+        summary = self.summaries.get(persona_id)
+        if summary and messages:
+            messages[0] = ("human", f"{self.SUMMARY_HEADER}\n{summary}\n\n{messages[0][1]}")
+        return messages
+    
+    def reset(self):
+        self.turns.clear()
+        self.summaries.clear()
+    
+    def get_stats(self) -> Dict:
+        turn_counts = [len(turns) for turns in self.turns.values()]
+        return {
+            'personas': len(self.turns),
+            'mean_turns': float(np.mean(turn_counts)) if turn_counts else 0.0,
+            'summarized_personas': len(self.summaries),
+            'mean_history_tokens': float(np.mean([
+                sum(self.turn_tokens(turn) for turn in turns) for turns in self.turns.values()
+            ])) if turn_counts else 0.0
+        }
+
+def build_response_record(persona, question_id, result):
+    """調査回答レコード作成"""
+    return ResponseRecord(
+        persona_id=persona['id'],
+        question_id=question_id,
+        response=result['response'],
+        success=result.get('success', True),
+        cost_usd=result.get('cost_usd', 0.0),
+        provider=result.get('provider', 'unknown')
+    )
+
+def build_export_frame(responses: List[ResponseRecord], personas: List[Dict], questions: QuestionRegistry,
+                       labels: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """回答にペルソナ属性（＋分類ラベル）を結合したエクスポート用DataFrame（結合は出力時のみ）"""
+    question_ids = np.fromiter((r.question_id for r in responses), dtype=np.int64, count=len(responses))
+    
+    df = pd.DataFrame({
+        'persona_id': [r.persona_id for r in responses],
+        'question': np.asarray(questions.texts, dtype=object)[question_ids] if len(responses) else [],
+        'response': [r.response for r in responses],
+        'success': [r.success for r in responses],
+        'provider': [r.provider for r in responses],
+        'timestamp': [datetime.fromtimestamp(r.timestamp).isoformat() for r in responses]
+    })
+    
+    persona_frame = pd.DataFrame(personas).add_prefix('persona_')
+    if not persona_frame.empty:
+        df = df.merge(persona_frame, on='persona_id', how='left')
+    
+    # ローカル分類器のラベル列
+    if labels is not None and len(labels) == len(df):
+        label_columns = ['stance', 'concern_level', 'concern_score', 'topics']
+        df = pd.concat([df, labels[label_columns].reset_index(drop=True)], axis=1)
+    
+    return df
+
+def population_fingerprint(personas: List[Dict]) -> str:
+    """ペルソナ集合の内容ハッシュ（同一母集団の判定用）"""
+    digest = hashlib.sha256()
+    for persona in personas:
+        digest.update(json.dumps(persona, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+class QuestionSimilarityIndex:
+    """文字n-gram TF-IDFのコサイン類似度による質問文の近傍検索（CPUのみ、日本語向け）
+    
+    ひらがなだけのn-gram（助詞・「だと思いますか」などの語尾）はどの質問にも現れ、言い換えより
+    文型の一致で類似度が決まってしまうため、内容語を含むn-gramだけを使う。
+    """
+    
+    PUNCTUATION = re.compile(r"[\s、。，．,.?？!！「」『』（）()・:：;；]+")
+    HIRAGANA_ONLY = re.compile(r"^[\u3040-\u309f]+$")
+    # 言い換え（「どのような影響」→「どんな影響」など）は0.43〜0.8、無関係な質問は0.2未満になる
+    # ことをプリセット質問の言い換えで確認した値（同じ話題で問いが異なる質問は0.5前後になり得る）
+    REUSE_THRESHOLD = 0.4
+    
+    def __init__(self, ngram_range: Tuple[int, int] = (1, 2)):
+        self.ngram_range = ngram_range
+        self.keys: List[Any] = []
+        self.texts: List[str] = []
+        self.term_counts: List[Counter] = []
+        self.vectors: Optional[List[Dict[str, float]]] = None
+        self.idf: Dict[str, float] = {}
+        self.default_idf = 1.0
+    
+    def ngrams(self, text: str) -> Counter:
+        normalized = self.PUNCTUATION.sub("", unicodedata.normalize("NFKC", text).lower())
+        low, high = self.ngram_range
+        counts = Counter()
+        for n in range(low, high + 1):
+            counts.update(normalized[i:i + n] for i in range(len(normalized) - n + 1))
+        content = Counter({term: count for term, count in counts.items() if not self.HIRAGANA_ONLY.match(term)})
+        return content or counts or Counter([normalized])
+    
+    def add(self, key: Any, text: str):
+        self.keys.append(key)
+        self.texts.append(text)
+        self.term_counts.append(self.ngrams(text))
+        self.vectors = None
+    
+    def vectorize(self, counts: Counter) -> Dict[str, float]:
+        vector = {term: count * self.idf.get(term, self.default_idf) for term, count in counts.items()}
+        norm = math.sqrt(sum(value * value for value in vector.values())) or 1.0
+        return {term: value / norm for term, value in vector.items()}
+    
+    def build(self, query_counts: Optional[Counter] = None):
+        """IDF（平滑化）と文書ベクトルを再計算（検索時はクエリも文書集合に含めて当てはめる）"""
+        documents = self.term_counts + ([query_counts] if query_counts else [])
+        document_frequency = Counter()
+        for counts in documents:
+            document_frequency.update(counts.keys())
+        size = len(documents)
+        self.idf = {term: math.log((1 + size) / (1 + df)) + 1 for term, df in document_frequency.items()}
+        self.default_idf = math.log(1 + size) + 1
+        self.vectors = [self.vectorize(counts) for counts in self.term_counts]
+    
+    def most_similar(self, text: str, top_k: int = 1) -> List[Tuple[Any, str, float]]:
+        """類似度の高い順に (キー, 質問文, 類似度) を返す"""
+        if not self.keys:
+            return []
+        
+        # 候補だけでIDFを当てはめると、クエリにしかないn-gramが未知語として最大の重みを持ち類似度を押し下げる
+        query_counts = self.ngrams(text)
+        self.build(query_counts)
+        query = self.vectorize(query_counts)
+        scores = [sum(weight * vector.get(term, 0.0) for term, weight in query.items()) for vector in self.vectors]
+        order = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
+        return [(self.keys[i], self.texts[i], min(scores[i], 1.0)) for i in order]
+
+class SurveyStore:
+    """調査結果のローカルストア（SQLite）
+    
+    調査ごとに surveys へ1行、responses へ回答＋主要ペルソナ属性＋分類ラベルを保存する。
+    調査ID・質問・プロバイダー・主要属性に索引を張り、絞り込みと集計はSQL側で行う。
+    """
+    
+    PERSONA_COLUMNS = ['continent', 'country', 'age', 'age_band', 'gender', 'education', 'income_level',
+                       'urban_rural', 'species', 'habitat', 'diet_type', 'size_category', 'conservation_status']
+    LABEL_COLUMNS = ['stance', 'concern_level', 'concern_score', 'topics']
+    INDEXED_COLUMNS = ['continent', 'country', 'age_band', 'gender', 'species', 'habitat', 'diet_type', 'stance']
+    SURVEY_COLUMNS = {'survey_id': 's.survey_id', 'mode': 's.mode', 'question': 's.question',
+                      'provider': 's.provider', 'model': 's.model'}
+    
+    def __init__(self, path: str = "surveys.db"):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.create_schema()
+    
+    def connect(self) -> sqlite3.Connection:
+        # Gradioのワーカースレッドから呼ばれるため操作ごとに接続
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+    
+    def create_schema(self):
+        persona_columns = ", ".join(f"{c} {'INTEGER' if c == 'age' else 'TEXT'}" for c in self.PERSONA_COLUMNS)
+        with closing(self.connect()) as connection, connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS surveys (
+                    survey_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at TEXT NOT NULL,
+                    mode TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    provider TEXT,
+                    model TEXT,
+                    population_key TEXT,
+                    persona_count INTEGER,
+                    response_count INTEGER,
+                    success_count INTEGER,
+                    total_cost_usd REAL
+                )""")
+            connection.execute(f"""
+                CREATE TABLE IF NOT EXISTS responses (
+                    survey_id INTEGER NOT NULL REFERENCES surveys(survey_id),
+                    persona_id INTEGER NOT NULL,
+                    response TEXT,
+                    success INTEGER,
+                    cost_usd REAL,
+                    timestamp REAL,
+                    {persona_columns},
+                    stance TEXT,
+                    concern_level TEXT,
+                    concern_score REAL,
+                    topics TEXT
+                )""")
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_surveys_question ON surveys(question)")
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_surveys_provider ON surveys(provider, model)")
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_surveys_mode_created ON surveys(mode, created_at)")
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_responses_survey ON responses(survey_id)")
+            for column in self.INDEXED_COLUMNS:
+                connection.execute(f"CREATE INDEX IF NOT EXISTS idx_responses_{column} ON responses({column})")
+    
+    def save_survey(self, mode: str, question: str, responses: List[ResponseRecord], personas_by_id: Dict[int, Dict],
+                    labels: Optional[pd.DataFrame] = None, provider: str = "", model: Optional[str] = None,
+                    total_cost: float = 0.0, population_key: Optional[str] = None) -> int:
+        """1回分の調査を保存して調査IDを返す"""
+        personas = pd.DataFrame([personas_by_id.get(r.persona_id, {}) for r in responses],
+                                columns=[c for c in self.PERSONA_COLUMNS if c != 'age_band'])
+        personas['age_band'] = pd.cut(pd.to_numeric(personas['age']), bins=ResponseClassifier.AGE_BINS,
+                                      labels=ResponseClassifier.AGE_LABELS, right=False).astype(object)
+        rows = pd.DataFrame({
+            'persona_id': [r.persona_id for r in responses],
+            'response': [r.response for r in responses],
+            'success': [int(r.success) for r in responses],
+            'cost_usd': [r.cost_usd for r in responses],
+            'timestamp': [r.timestamp for r in responses]
+        })
+        rows = pd.concat([rows, personas[self.PERSONA_COLUMNS]], axis=1)
+        if labels is not None and len(labels) == len(rows):
+            rows = pd.concat([rows, labels[self.LABEL_COLUMNS].reset_index(drop=True)], axis=1)
+        
+        return self.insert_survey(mode, question, rows, len(personas_by_id), provider, model, total_cost,
+                                  population_key)
+    
+    def save_simulated_survey(self, mode: str, question: str, table: SimulatedResponseTable,
+                              labels: Optional[pd.DataFrame] = None, population_key: Optional[str] = None) -> int:
+        """一括シミュレーションの回答表を保存（ペルソナ属性は母集団の列から展開）"""
+        personas = table.persona_frame([c for c in self.PERSONA_COLUMNS if c != 'age_band'])
+        personas = personas.reindex(columns=[c for c in self.PERSONA_COLUMNS if c != 'age_band'])
+        personas['age_band'] = pd.cut(pd.to_numeric(personas['age']), bins=ResponseClassifier.AGE_BINS,
+                                      labels=ResponseClassifier.AGE_LABELS, right=False)
+        rows = pd.DataFrame({
+            'persona_id': table.persona_ids,
+            'response': table.responses(),
+            'success': table.success.astype(int),
+            'cost_usd': 0.0,
+            'timestamp': table.timestamp
+        })
+        rows = pd.concat([rows, personas[self.PERSONA_COLUMNS]], axis=1)
+        if labels is not None and len(labels) == len(rows):
+            rows = pd.concat([rows, labels[self.LABEL_COLUMNS].reset_index(drop=True)], axis=1)
+        
+        return self.insert_survey(mode, question, rows, len(table), table.provider, None, 0.0, population_key)
+    
+    def insert_survey(self, mode: str, question: str, rows: pd.DataFrame, persona_count: int, provider: str,
+                      model: Optional[str], total_cost: float, population_key: Optional[str]) -> int:
+        """surveys・responsesへ1調査分を挿入"""
+        with closing(self.connect()) as connection, connection:
+            cursor = connection.execute(
+                """INSERT INTO surveys (created_at, mode, question, provider, model, population_key,
+                                        persona_count, response_count, success_count, total_cost_usd)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (datetime.now().isoformat(), mode, question, provider, model, population_key,
+                 persona_count, len(rows), int(rows['success'].sum()) if len(rows) else 0, total_cost)
+            )
+            survey_id = cursor.lastrowid
+            rows.insert(0, 'survey_id', survey_id)
+            rows = rows.astype(object).where(rows.notna(), None)
+            columns = list(rows.columns)
+            connection.executemany(
+                f"INSERT INTO responses ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                rows.itertuples(index=False, name=None)
+            )
+        return survey_id
+    
+    def find_similar_survey(self, question: str, mode: str, population_key: Optional[str], provider: str,
+                            model: Optional[str]) -> Optional[Dict]:
+        """同じ母集団・プロバイダー・モデルで調査済みの質問から最も近いものを探す"""
+        candidates = self.read_sql(
+            """SELECT survey_id, question FROM surveys
+               WHERE mode = ? AND population_key IS ? AND provider = ? AND model IS ? AND success_count > 0
+               ORDER BY survey_id DESC""", [mode, population_key, provider, model]
+        )
+        if candidates.empty:
+            return None
+        
+        index = QuestionSimilarityIndex()
+        for survey_id, text in candidates.drop_duplicates('question').itertuples(index=False):
+            index.add(int(survey_id), text)  # 同一質問は最新の調査のみ
+        
+        survey_id, text, score = index.most_similar(question)[0]
+        return {'survey_id': survey_id, 'question': text, 'similarity': score}
+    
+    def load_responses(self, survey_id: int, question_id: int) -> List[ResponseRecord]:
+        """保存済み調査の成功回答をResponseRecordとして読み込む（質問IDは付け替え）"""
+        with closing(self.connect()) as connection:
+            rows = connection.execute(
+                "SELECT persona_id, response, timestamp FROM responses WHERE survey_id = ? AND success = 1",
+                (survey_id,)
+            ).fetchall()
+        # 再利用分は追加コストなし
+        return [ResponseRecord(persona_id, question_id, response, True, 0.0, 'reused', timestamp, reused=True)
+                for persona_id, response, timestamp in rows]
+    
+    def column_expression(self, column: str) -> str:
+        """許可された列名をSQL式に変換（任意の列名は受け付けない）"""
+        if column in self.SURVEY_COLUMNS:
+            return self.SURVEY_COLUMNS[column]
+        if column in self.PERSONA_COLUMNS or column in self.LABEL_COLUMNS:
+            return f"r.{column}"
+        raise ValueError(f"サポートされていない列: {column}")
+    
+    def build_where(self, filters: Optional[Dict]) -> Tuple[str, List]:
+        """フィルタ条件 → WHERE句（question_containsは部分一致、since/untilは作成日時、リストはIN）"""
+        clauses, params = [], []
+        for key, value in (filters or {}).items():
+            if value is None or value == "" or value == []:
+                continue
+            if key == 'question_contains':
+                clauses.append("s.question LIKE ?")
+                params.append(f"%{value}%")
+            elif key == 'since':
+                clauses.append("s.created_at >= ?")
+                params.append(str(value))
+            elif key == 'until':
+                clauses.append("s.created_at < ?")
+                params.append(str(value))
+            elif isinstance(value, (list, tuple, set)):
+                values = list(value)
+                clauses.append(f"{self.column_expression(key)} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+            else:
+                clauses.append(f"{self.column_expression(key)} = ?")
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+    
+    def read_sql(self, sql: str, params: List) -> pd.DataFrame:
+        with closing(self.connect()) as connection:
+            return pd.read_sql_query(sql, connection, params=params)
+    
+    def list_surveys(self, filters: Optional[Dict] = None, limit: int = 100) -> pd.DataFrame:
+        """調査一覧（新しい順）"""
+        survey_filters = {k: v for k, v in (filters or {}).items()
+                          if k in self.SURVEY_COLUMNS or k in ('question_contains', 'since', 'until')}
+        where, params = self.build_where(survey_filters)
+        return self.read_sql(f"SELECT * FROM surveys s{where} ORDER BY s.survey_id DESC LIMIT ?",
+                             params + [int(limit)])
+    
+    def query_responses(self, filters: Optional[Dict] = None, columns: Optional[List[str]] = None,
+                        limit: int = 1000) -> pd.DataFrame:
+        """条件に合う回答を取得（必要な列・件数だけ読み込む）"""
+        columns = columns or ['survey_id', 'question', 'provider', 'continent', 'country', 'species', 'stance']
+        select = ", ".join(f"{self.column_expression(c)} AS {c}" for c in columns)
+        where, params = self.build_where(filters)
+        return self.read_sql(
+            f"SELECT r.persona_id, {select}, r.response FROM responses r JOIN surveys s USING (survey_id)"
+            f"{where} LIMIT ?", params + [int(limit)]
+        )
+    
+    def aggregate(self, group_by: str, target: str = 'stance', filters: Optional[Dict] = None) -> pd.DataFrame:
+        """調査横断のクロス集計（group_by × 分類ラベルの構成比%、成功回答のみ）"""
+        group, label = self.column_expression(group_by), self.column_expression(target)
+        where, params = self.build_where({**(filters or {})})
+        where = (where + " AND" if where else " WHERE") + " r.success = 1"
+        counts = self.read_sql(
+            f"SELECT {group} AS grp, {label} AS label, COUNT(*) AS n FROM responses r JOIN surveys s USING (survey_id)"
+            f"{where} GROUP BY grp, label", params
+        )
+        if counts.empty:
+            return pd.DataFrame()
+        
+        table = counts.pivot_table(index='grp', columns='label', values='n', aggfunc='sum', fill_value=0)
+        totals = table.sum(axis=1)
+        table = table.div(totals, axis=0) * 100
+        table['回答数'] = totals
+        return table.round(1).reset_index().rename(columns={'grp': group_by}).rename_axis(columns=None)
+    
+    def summarize(self, group_by: str = 'survey_id', filters: Optional[Dict] = None) -> pd.DataFrame:
+        """グループ別の回答数・成功率・平均回答長・平均懸念スコア・コスト"""
+        group = self.column_expression(group_by)
+        where, params = self.build_where(filters)
+        return self.read_sql(
+            f"""SELECT {group} AS {group_by}, COUNT(*) AS 回答数,
+                       ROUND(AVG(r.success) * 100, 1) AS 成功率,
+                       ROUND(AVG(LENGTH(r.response)), 1) AS 平均回答長,
+                       ROUND(AVG(r.concern_score), 3) AS 平均懸念スコア,
+                       SUM(r.cost_usd) AS コスト_usd
+                FROM responses r JOIN surveys s USING (survey_id){where}
+                GROUP BY {group} ORDER BY {group}""", params
+        )
+
+def create_provider(provider_type: str, mode: str, api_key: str = "", model_name: Optional[str] = None,
+                    rpm_per_key: int = 60, tpm_per_key: Optional[int] = 100000, prompt_layout: str = "classic"):
+    """プロバイダー種別から調査用プロバイダーを作成（APIキー複数指定時はキープール）"""
+    if provider_type == "simulation":
+        return SimulationProvider(mode)
+    keys = parse_api_keys(api_key)
+    if len(keys) > 1:
+        return PooledLLMProvider(provider_type, keys, model_name, rpm_per_key, tpm_per_key, prompt_layout)
+    return LangChainLLMProvider(provider_type=provider_type, api_key=keys[0] if keys else api_key,
+                                model_name=model_name, prompt_layout=prompt_layout)
+
+class ProviderRegistry:
+    """初期化済みプロバイダーのレジストリ
+    
+    (種別, モデル, APIキーのハッシュ) をキーにインスタンスを再利用し、クライアントの
+    接続プールとコスト追跡を保持する。一定時間使われないものとLRU超過分は破棄する。
+    """
+    
+    def __init__(self, max_entries: int = 8, idle_ttl_sec: float = 1800.0):
+        self.max_entries = max_entries
+        self.idle_ttl_sec = idle_ttl_sec
+        self.entries: 'OrderedDict[Tuple, Dict]' = OrderedDict()
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def registry_key(provider_type: str, mode: str, api_key: str = "", model_name: Optional[str] = None) -> Tuple:
+        if provider_type == "simulation":
+            return (provider_type, mode)  # シミュレーションは調査対象ごとに回答パターンが異なる
+        key_hash = hashlib.sha256("\n".join(parse_api_keys(api_key)).encode("utf-8")).hexdigest()[:16]
+        return (provider_type, model_name, key_hash)
+    
+    def get_or_create(self, provider_type: str, mode: str, api_key: str = "", model_name: Optional[str] = None,
+                      **options) -> Tuple[Dict, bool]:
+        """登録済みなら再利用、なければ作成して (エントリ, 新規作成か) を返す"""
+        key = self.registry_key(provider_type, mode, api_key, model_name)
+        now = time.monotonic()
+        with self.lock:
+            self.evict_idle(now)
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                entry['last_used'] = now
+                return entry, False
+        
+        # クライアント初期化はロック外で行う
+        provider = create_provider(provider_type, mode, api_key, model_name, **options)
+        with self.lock:
+            entry = self.entries.setdefault(key, {'provider': provider, 'created_at': now, 'last_used': now})
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry, entry['provider'] is provider
+    
+    def evict_idle(self, now: float):
+        for key in [k for k, entry in self.entries.items() if now - entry['last_used'] > self.idle_ttl_sec]:
+            del self.entries[key]
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+
+async def run_survey_pipeline(provider, personas: List[Dict], question: str, mode: str,
+                              concurrency: int = 1, budget_usd: Optional[float] = None,
+                              stream: bool = False, on_token=None, on_result=None,
+                              questions: Optional[QuestionRegistry] = None,
+                              memory: Optional[ConversationMemory] = None) -> Dict:
+    """ペルソナ→generate_responseの調査パイプライン（同時実行数・予算上限つき）
+    
+    concurrency個のワーカーがペルソナを順に取り出して実行する（タスク数はペルソナ数によらない）。
+    予算上限は新規リクエストの投入を止める判定に使うため、実行中の
+    リクエスト分（最大concurrency件）だけ上限を超えることがある。
+    memoryを渡すとフォローアップとして各ペルソナの会話履歴を付けて質問する
+    （履歴への追加は呼び出し側で memory.record_responses を呼ぶ）。
+    cost_trackerにはこの調査の回答分だけを集計する（プロバイダーのトラッカーは全調査の累計）。
+    """
+    questions = questions if questions is not None else QuestionRegistry()
+    question_id = questions.intern(question)
+    records: List[Optional[ResponseRecord]] = [None] * len(personas)
+    state = {'total_cost': 0.0, 'budget_exhausted': False}
+    cost_tracker = LangChainCostTracker()
+    pending = iter(enumerate(personas))  # ワーカーが順に取り出す（タスクはconcurrency個だけ）
+    
+    async def worker():
+        for index, persona in pending:
+            if budget_usd is not None and state['total_cost'] >= budget_usd:
+                state['budget_exhausted'] = True
+                return  # 予算到達後は新しいペルソナを取り出さない
+            history = memory.history(persona['id']) if memory else None
+            result = await provider.generate_response(persona, question, mode, stream=stream, on_token=on_token,
+                                                      history=history)
+            record = build_response_record(persona, question_id, result)
+            records[index] = record
+            state['total_cost'] += result.get('cost_usd', 0.0)
+            if result.get('success'):
+                cost_tracker.record_result(result)
+            if on_result:
+                on_result(record)
+    
+    await asyncio.gather(*[worker() for _ in range(min(max(1, int(concurrency)), len(personas)))])
+    
+    return {
+        'responses': [r for r in records if r is not None],
+        'question_id': question_id,
+        'questions': questions,
+        'total_cost': state['total_cost'],
+        'cost_tracker': cost_tracker,
+        'budget_exhausted': state['budget_exhausted']
+    }
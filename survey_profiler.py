@@ -0,0 +1,233 @@
+# survey_profiler.py - World Listening & Wild Listening 調査実行プロファイラー（オプトイン）
+#
+# 計測対象の処理を実行するスレッドと、その処理が起動したワーカースレッドを一定間隔で
+# サンプリングしてCPUプロファイル（collapsed stack /
+# フレームグラフSVG）を作成し、tracemallocで割り当ての多い箇所を記録する。
+# 実行ごとに profiles/<日時>_<名前>/ へ書き出す。
+#
+# 使用例:
+#   with SurveyProfiler("run_survey") as profiler:
+#       run_survey(...)
+#   print(profiler.run_dir)
+
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from html import escape
+from typing import Dict, List, Optional, Tuple
+
+# サンプルの分類（待ち時間・イベントループ・LangChain・pandas/チャート・アプリ本体）
+NETWORK_WAIT_MODULES = ('selectors.py', 'socket.py', 'ssl.py', 'select')
+CATEGORY_MARKERS = [
+    ('LangChain', ('langchain', 'langsmith', 'openai', 'anthropic', 'httpx', 'httpcore')),
+    ('pandas・チャート', ('pandas', 'plotly', 'numpy')),
+    ('イベントループ', ('asyncio',))
+]
+
+class SurveyProfiler:
+    """サンプリングCPUプロファイル＋tracemalloc割り当てレポート（with文で計測）"""
+
+    _active_lock = threading.Lock()  # tracemallocはプロセス全体で1つのため同時計測は1件まで
+
+    def __init__(self, name: str, root: str = "profiles", interval_sec: float = 0.005, top_allocators: int = 30):
+        self.name = name
+        self.root = root
+        self.interval_sec = interval_sec
+        self.top_allocators = top_allocators
+        self.run_dir: Optional[str] = None
+        self.stacks = Counter()
+        self.categories = Counter()
+        self.samples = 0
+        self.wall_sec = 0.0
+        self.peak_bytes = 0
+        self.enabled = False
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.owner_id: Optional[int] = None
+        self.preexisting_threads = set()
+
+    def __enter__(self) -> 'SurveyProfiler':
+        self.enabled = self._active_lock.acquire(blocking=False)
+        if not self.enabled:
+            return self  # 別のプロファイル計測中は計測しない
+
+        self.started_tracemalloc = not tracemalloc.is_tracing()
+        if self.started_tracemalloc:
+            tracemalloc.start(10)
+        self.start_snapshot = tracemalloc.take_snapshot()
+        # 計測開始前からあるスレッド（Gradio・uvicornの待機スレッドなど）は計測対象外
+        self.owner_id = threading.get_ident()
+        self.preexisting_threads = set(threading.enumerate())
+        self.started_at = time.perf_counter()
+        self.thread = threading.Thread(target=self.sample_loop, name="survey-profiler", daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.enabled:
+            return False
+
+        try:
+            self.stop_event.set()
+            self.thread.join()
+            self.wall_sec = time.perf_counter() - self.started_at
+            end_snapshot = tracemalloc.take_snapshot()
+            self.peak_bytes = tracemalloc.get_traced_memory()[1]
+            if self.started_tracemalloc:
+                tracemalloc.stop()
+            self.write_reports(end_snapshot)
+        finally:
+            self._active_lock.release()
+        return False
+
+    def target_threads(self) -> Dict[int, str]:
+        """計測対象スレッドのID -> 名前（with文に入ったスレッドと、計測開始後に起動したスレッド）"""
+        own_id = threading.get_ident()
+        return {t.ident: t.name for t in threading.enumerate()
+                if t.ident != own_id and (t.ident == self.owner_id or t not in self.preexisting_threads)}
+
+    def sample_loop(self):
+        """計測対象スレッドのスタックを一定間隔で記録"""
+        thread_ids = frozenset()
+        targets = {}
+        while not self.stop_event.wait(self.interval_sec):
+            frames = sys._current_frames()
+            if frames.keys() != thread_ids:
+                thread_ids = frozenset(frames)
+                targets = self.target_threads()
+            for thread_id, frame in frames.items():
+                if thread_id not in targets:
+                    continue
+                stack = self.collapse(frame)
+                self.stacks[(targets[thread_id],) + stack] += 1
+                self.categories[self.categorize(frame, stack)] += 1
+                self.samples += 1
+
+    @staticmethod
+    def collapse(frame) -> Tuple[str, ...]:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return tuple(reversed(stack))
+
+    @staticmethod
+    def categorize(frame, stack: Tuple[str, ...]) -> str:
+        """葉フレームがI/O待ちならネットワーク待ち、それ以外はスタック中のモジュールで分類"""
+        leaf = os.path.basename(frame.f_code.co_filename)
+        if leaf in NETWORK_WAIT_MODULES or frame.f_code.co_name in ('select', 'poll', 'epoll', 'recv', 'recv_into'):
+            return 'ネットワーク・I/O待ち'
+        filenames = []
+        while frame is not None:
+            filenames.append(frame.f_code.co_filename)
+            frame = frame.f_back
+        for category, markers in CATEGORY_MARKERS:
+            if any(marker in filename for filename in filenames for marker in markers):
+                return category
+        return 'アプリ本体・その他'
+
+    def write_reports(self, end_snapshot):
+        """collapsed stack・フレームグラフSVG・割り当てレポート・サマリーを書き出し"""
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')[:-3]
+        self.run_dir = os.path.join(self.root, f"{stamp}_{self.name}")
+        os.makedirs(self.run_dir, exist_ok=True)
+
+        # flamegraph.pl / speedscope 互換の collapsed stack
+        with open(os.path.join(self.run_dir, "profile.collapsed"), "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+        with open(os.path.join(self.run_dir, "flamegraph.svg"), "w", encoding="utf-8") as f:
+            f.write(render_flamegraph(self.stacks, f"{self.name} ({self.samples} samples)"))
+
+        # 割り当て: 終了時点の保持量上位と、開始時点からの増分上位（プロファイラー自身は除外）
+        own_filters = [tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)]
+        end_snapshot = end_snapshot.filter_traces(own_filters)
+        current = end_snapshot.statistics('lineno')[:self.top_allocators]
+        growth = end_snapshot.compare_to(self.start_snapshot.filter_traces(own_filters), 'lineno')[:self.top_allocators]
+        with open(os.path.join(self.run_dir, "allocations.txt"), "w", encoding="utf-8") as f:
+            f.write(f"# ピークメモリ: {self.peak_bytes / 1024 ** 2:.1f} MiB\n\n")
+            f.write(f"# 保持量上位 {self.top_allocators} 件\n")
+            f.writelines(f"{stat}\n" for stat in current)
+            f.write(f"\n# 計測中の増分上位 {self.top_allocators} 件\n")
+            f.writelines(f"{stat}\n" for stat in growth)
+
+        with open(os.path.join(self.run_dir, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+
+    def summary(self) -> Dict:
+        self_time = Counter()
+        for stack, count in self.stacks.items():
+            self_time[stack[-1]] += count
+        total = max(self.samples, 1)
+        return {
+            'name': self.name,
+            'wall_sec': self.wall_sec,
+            'interval_sec': self.interval_sec,
+            'samples': self.samples,
+            'peak_memory_mib': self.peak_bytes / 1024 ** 2,
+            'category_share': {c: n / total for c, n in self.categories.most_common()},
+            'top_self_frames': [{'frame': frame, 'share': n / total} for frame, n in self_time.most_common(15)]
+        }
+
+    def output_files(self) -> List[str]:
+        if not self.run_dir:
+            return []
+        return [os.path.join(self.run_dir, name) for name in
+                ("flamegraph.svg", "profile.collapsed", "allocations.txt", "summary.json")]
+
+def render_flamegraph(stacks: Counter, title: str, width: int = 1200, row_height: int = 16) -> str:
+    """collapsed stackから簡易フレームグラフSVGを生成（外部ツール不要）"""
+    tree = {'count': 0, 'children': {}}
+    for stack, count in stacks.items():
+        node = tree
+        node['count'] += count
+        for frame in stack:
+            node = node['children'].setdefault(frame, {'count': 0, 'children': {}})
+            node['count'] += count
+
+    total = max(tree['count'], 1)
+    rects = []
+    max_depth = 0
+
+    def layout(node, x: float, depth: int):
+        nonlocal max_depth
+        for frame, child in sorted(node['children'].items()):
+            w = child['count'] / total * width
+            if w >= 0.5:
+                max_depth = max(max_depth, depth)
+                rects.append((x, depth, w, frame, child['count']))
+                layout(child, x, depth + 1)
+            x += w
+
+    layout(tree, 0.0, 0)
+    height = (max_depth + 2) * row_height + 24
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace" font-size="11">',
+             f'<text x="4" y="14">{escape(title)}</text>']
+    for x, depth, w, frame, count in rects:
+        y = height - (depth + 1) * row_height
+        hue = 10 + (hash(frame.split(' ')[0]) % 50)
+        label = escape(frame[:int(w / 7)]) if w > 30 else ""
+        parts.append(
+            f'<g><title>{escape(frame)} ({count} samples, {count / total * 100:.1f}%)</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row_height - 1}" fill="hsl({hue},80%,60%)"/>'
+            f'<text x="{x + 2:.1f}" y="{y + row_height - 4}">{label}</text></g>'
+        )
+    parts.append('</svg>')
+    return "\n".join(parts)
+
+def format_profile_summary(summary: Dict) -> str:
+    """プロファイルサマリーのテキスト表示"""
+    categories = "\n".join(f"- {category}: {share * 100:.1f}%" for category, share in summary['category_share'].items())
+    frames = "\n".join(f"- {f['frame']}: {f['share'] * 100:.1f}%" for f in summary['top_self_frames'][:5])
+    return f"""🔬 {summary['name']}: {summary['wall_sec']:.2f}秒 / {summary['samples']}サンプル / ピーク{summary['peak_memory_mib']:.1f}MiB
+時間の内訳:
+{categories}
+自己時間の上位:
+{frames}"""
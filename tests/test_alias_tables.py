@@ -0,0 +1,55 @@
+import random
+
+import numpy as np
+import pytest
+
+from survey_engine import AliasTableMixin, TerrestrialAnimalDB, WorldDemographicsDB
+
+
+class MarginalOnlyDB(AliasTableMixin):
+    """条件付き分布を持たない分布データベース"""
+
+    def __init__(self):
+        self.color_distribution = {'赤': 0.2, '青': 0.8}
+        self.build_alias_tables()
+
+
+class DeclaredConditionalDB(AliasTableMixin):
+    """条件付き分布を格納先の宣言だけで定義する分布データベース"""
+
+    conditional_parents = {'size': (('color',), 'size_distribution')}
+    conditional_sources = {'size': 'color_size_distribution'}
+
+    def __init__(self):
+        self.color_distribution = {'赤': 0.5, '青': 0.5}
+        self.size_distribution = {'大': 0.5, '小': 0.5}
+        self.color_size_distribution = {'赤': {'大': 1.0}, '青': {'小': 1.0}}
+        self.build_alias_tables()
+
+
+def test_mixin_without_conditionals_builds_tables():
+    db = MarginalOnlyDB()
+    assert db.conditional_alias_tables == {}
+    codes = db.alias_tables['color_distribution'].sample_codes(np.random.default_rng(0), 10000)
+    assert abs(np.mean(codes == 1) - 0.8) < 0.02
+
+
+def test_default_reads_declared_conditional_sources():
+    db = DeclaredConditionalDB()
+    assert db.get_conditional_distributions('size') is db.color_size_distribution
+    assert db.conditional_alias('size', '青').sample(random.Random(0)) == '小'
+
+
+@pytest.mark.parametrize("db", [MarginalOnlyDB(), DeclaredConditionalDB(), WorldDemographicsDB(), TerrestrialAnimalDB()])
+def test_unknown_conditional_attribute_raises_key_error(db):
+    with pytest.raises(KeyError):
+        db.get_conditional_distributions('color')
+
+
+def test_conditional_tables_cover_every_parent_value():
+    world = WorldDemographicsDB()
+    assert set(world.conditional_alias_tables['language']) == set(world.country_language_distribution)
+    assert len(world.conditional_alias_tables['income_level']) == \
+        len(world.country_distribution) * len(world.education_distribution)
+    animals = TerrestrialAnimalDB()
+    assert set(animals.conditional_alias_tables['habitat']) == set(animals.species_habitat_distribution)
@@ -0,0 +1,60 @@
+import numpy as np
+
+from survey_engine import (PopulationStore, QuestionRegistry, ResponseClassifier, RunningAggregates,
+                           SimulationProvider, build_export_frame, build_response_record)
+
+
+def simulate(mode, size=50):
+    population = PopulationStore().generate(mode, seed=3, size=size)
+    questions = QuestionRegistry()
+    table = SimulationProvider(mode).simulate_bulk(population, questions.intern("気候変動について"), seed=1)
+    return population, questions, table
+
+
+def records_for(population, table):
+    responses = np.asarray(table.patterns, dtype=object)[table.codes]
+    return [build_response_record(persona, table.question_id, {'success': True, 'response': text,
+                                                               'provider': 'simulation'})
+            for persona, text in zip(population.to_personas(), responses)]
+
+
+def test_classify_matches_classify_responses_layout():
+    population, _, table = simulate("humans")
+    records = records_for(population, table)
+    personas_by_id = {p['id']: p for p in population.to_personas()}
+    expected = ResponseClassifier().classify_responses(records, personas_by_id)
+    labels = table.classify()
+    assert list(labels.columns) == list(expected.columns)
+    assert (labels['persona_id'].to_numpy() == expected['persona_id'].to_numpy()).all()
+    assert (labels['stance'].to_numpy() == expected['stance'].to_numpy()).all()
+
+
+def test_export_frame_matches_build_export_frame():
+    population, questions, table = simulate("animals")
+    labels = table.classify()
+    expected = build_export_frame(records_for(population, table), population.to_personas(), questions, labels)
+    frame = table.to_export_frame(questions, labels)
+    assert list(frame.columns) == list(expected.columns)
+    assert (frame.drop(columns='timestamp').astype(str).to_numpy()
+            == expected.drop(columns='timestamp').astype(str).to_numpy()).all()
+
+
+def test_add_to_feeds_running_aggregates():
+    population, _, table = simulate("humans", size=500)
+    aggregates = RunningAggregates()
+    aggregates.add_population(population)
+    labels = table.classify()
+    table.add_to(aggregates, labels)
+    assert aggregates.persona_count == 500
+    assert aggregates.response_count == 500
+    assert sum(aggregates.stance_counts.values()) == 500
+    assert aggregates.length_counts.sum() == 500
+
+
+def test_long_responses_fall_into_overflow_bin():
+    aggregates = RunningAggregates()
+    aggregates.add_response_lengths(np.array([5, 150, 10_000_000]), np.array([True, True, False]))
+    labels, counts = aggregates.length_histogram()
+    assert len(counts) == RunningAggregates.MAX_LENGTH // RunningAggregates.LENGTH_BIN_WIDTH + 1
+    assert labels[-1] == f"{RunningAggregates.MAX_LENGTH}以上" and counts[-1] == 1
+    assert counts.sum() == 3
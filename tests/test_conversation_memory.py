@@ -0,0 +1,43 @@
+from survey_engine import ConversationMemory, QuestionRegistry, ResponseRecord, SurveyStore
+
+
+def record_rounds(memory, questions, rounds):
+    for round_index in range(rounds):
+        question_id = questions.intern(f"質問{round_index}: 地域の環境問題についてどう思いますか？")
+        memory.record_responses([ResponseRecord(1, question_id, "かなり心配しています。" * 5)])
+
+
+def test_compact_folds_until_history_fits_after_budget_shrinks():
+    questions = QuestionRegistry()
+    memory = ConversationMemory(questions, max_history_tokens=10_000)
+    record_rounds(memory, questions, 16)
+    assert len(memory.turns[1]) == 16
+
+    memory.max_history_tokens = 120
+    record_rounds(memory, questions, 1)
+
+    turns = memory.turns[1]
+    budget = memory.max_history_tokens - memory.estimate_tokens(memory.summaries[1])
+    assert len(turns) == 1 or sum(memory.turn_tokens(turn) for turn in turns) <= budget
+    assert len(turns) < 9
+
+
+def test_failed_responses_are_not_recorded():
+    questions = QuestionRegistry()
+    memory = ConversationMemory(questions)
+    memory.record_responses([ResponseRecord(1, questions.intern("質問"), "❌ エラー", success=False)])
+    assert memory.turns == {}
+
+
+def test_reused_answers_are_not_added_to_history(tmp_path):
+    questions = QuestionRegistry()
+    question_id = questions.intern("気候変動は心配ですか？")
+    store = SurveyStore(str(tmp_path / "surveys.db"))
+    survey_id = store.save_survey("humans", "気候変動は心配ですか？", [ResponseRecord(1, 0, "前回の回答")],
+                                  {1: {'id': 1, 'age': 30}})
+    reused = store.load_responses(survey_id, question_id)
+    assert [r.reused for r in reused] == [True]
+
+    memory = ConversationMemory(questions)
+    memory.record_responses(reused + [ResponseRecord(2, question_id, "今回の回答")])
+    assert list(memory.turns) == [2]
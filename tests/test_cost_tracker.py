@@ -0,0 +1,44 @@
+import threading
+
+from survey_engine import LangChainCostTracker
+
+
+def make_result(cached=0):
+    return {'provider': 'openai', 'cost_usd': 0.001, 'tokens_used': 120, 'input_tokens': 100,
+            'cached_input_tokens': cached, 'latency_sec': 0.5, 'ttft_sec': 0.1, 'tokens_per_sec': 40.0}
+
+
+def test_merge_does_not_share_usage_with_source():
+    survey = LangChainCostTracker()
+    survey.record_result(make_result(cached=50))
+    session = LangChainCostTracker()
+    session.merge(survey)
+
+    survey.record_result(make_result())
+    assert session.cache_usage['openai']['requests'] == 1
+    assert session.cache_usage['openai']['hit_latency_sec'] == [0.5]
+
+    session.merge(survey)
+    assert survey.cache_usage['openai']['requests'] == 2
+    assert session.cache_usage['openai']['requests'] == 3
+
+
+def test_summaries_are_consistent_while_recording():
+    tracker = LangChainCostTracker()
+
+    def writer():
+        for _ in range(2000):
+            tracker.record_result(make_result())
+
+    threads = [threading.Thread(target=writer) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        summary = tracker.get_cost_summary()
+        if summary['requests_count']:
+            assert summary['provider_breakdown']['openai']['requests'] == summary['requests_count']
+            assert summary['cache_breakdown']['openai']['requests'] == summary['requests_count']
+            assert summary['latency_breakdown']['openai']['samples'] == summary['requests_count']
+    for thread in threads:
+        thread.join()
+    assert tracker.get_cost_summary()['requests_count'] == 8000
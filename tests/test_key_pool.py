@@ -0,0 +1,111 @@
+import asyncio
+import time
+import types
+
+import pytest
+
+import survey_engine
+from survey_engine import APIKeyBudget, PooledLLMProvider
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeKeyProvider:
+    """キーごとに決まった結果を返すテスト用プロバイダー（LangChainLLMProviderの代わり）"""
+
+    results = {}
+
+    def __init__(self, provider_type, api_key, model_name=None, prompt_layout="classic"):
+        self.api_key = api_key
+        self.llm = None
+        self.cost_tracker = None
+        self.calls = 0
+
+    async def generate_response(self, persona, question, mode, stream=False, on_token=None, history=None):
+        self.calls += 1
+        return dict(self.results[self.api_key])
+
+
+OK = {'success': True, 'response': "回答", 'cost_usd': 0.001, 'tokens_used': 200, 'provider': 'openai'}
+RATE_LIMITED = {'success': False, 'response': "エラー", 'cost_usd': 0.0, 'tokens_used': 0, 'provider': 'openai',
+                'error': "Error code: 429 - Rate limit reached", 'status_code': 429}
+UNAUTHORIZED = {'success': False, 'response': "エラー", 'cost_usd': 0.0, 'tokens_used': 0, 'provider': 'openai',
+                'error': "Error code: 401 - Incorrect API key provided", 'status_code': 401}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(survey_engine, "time", types.SimpleNamespace(monotonic=clock.monotonic, time=time.time))
+    monkeypatch.setattr(survey_engine, "LangChainLLMProvider", FakeKeyProvider)
+    return clock
+
+
+def make_pool(results):
+    FakeKeyProvider.results = results
+    return PooledLLMProvider("openai", ",".join(results), rpm_per_key=60, tpm_per_key=10000)
+
+
+def test_tpm_window_expires_after_sixty_seconds():
+    budget = APIKeyBudget("key", None, rpm=100, tpm=1000)
+    budget.reserve(0.0, 600)
+    budget.reserve(20.0, 300)
+    assert budget.wait_time(10.0, 100) == 0.0
+    assert budget.wait_time(30.0, 400) == pytest.approx(30.0)  # 最初の600トークンが抜けるまで
+    assert budget.wait_time(60.0, 400) == 0.0
+    assert budget.wait_time(80.0, 1000) == 0.0
+    assert not budget.window
+
+
+def test_rpm_window_waits_for_oldest_request():
+    budget = APIKeyBudget("key", None, rpm=2, tpm=None)
+    budget.reserve(0.0, 1)
+    budget.reserve(1.0, 1)
+    assert budget.wait_time(5.0, 1) == pytest.approx(55.0)
+    assert budget.wait_time(60.0, 1) == 0.0
+
+
+def test_classify_error():
+    assert PooledLLMProvider.classify_error(RATE_LIMITED) == 'rate_limit'
+    assert PooledLLMProvider.classify_error({'error_type': 'RateLimitError'}) == 'rate_limit'
+    assert PooledLLMProvider.classify_error(UNAUTHORIZED) == 'auth'
+    assert PooledLLMProvider.classify_error({'error_type': 'PermissionDeniedError'}) == 'auth'
+    assert PooledLLMProvider.classify_error({'error': "connection reset"}) == 'other'
+
+
+def test_rate_limited_key_fails_over_and_cools_down(clock):
+    pool = make_pool({'sk-aaaaaaaaaaaa1111': RATE_LIMITED, 'sk-bbbbbbbbbbbb2222': OK})
+    limited, healthy = pool.budgets
+    healthy.reserve(clock.now, 5000)  # 余裕の大きい429キーが先に選ばれるようにする
+
+    result = asyncio.run(pool.generate_response({'id': 1}, "質問", "humans"))
+    assert result['success'] and result['api_key'] == healthy.label
+    assert limited.usage['rate_limited'] == 1
+    assert limited.cooldown_until == clock.now + PooledLLMProvider.RATE_LIMIT_COOLDOWN_SEC
+
+    # クールダウン中は429キーを使わない
+    asyncio.run(pool.generate_response({'id': 2}, "質問", "humans"))
+    assert limited.provider.calls == 1 and healthy.provider.calls == 2
+
+
+def test_fails_fast_when_every_key_is_on_auth_cooldown(clock):
+    pool = make_pool({'sk-aaaaaaaaaaaa1111': UNAUTHORIZED, 'sk-bbbbbbbbbbbb2222': UNAUTHORIZED})
+    first = asyncio.run(pool.generate_response({'id': 1}, "質問", "humans"))
+    assert not first['success']
+    assert all(b.usage['auth_errors'] == 1 for b in pool.budgets)
+
+    started = time.perf_counter()
+    second = asyncio.run(pool.generate_response({'id': 2}, "質問", "humans"))
+    assert time.perf_counter() - started < 1.0  # 認証クールダウンはMAX_WAIT_SECより長いので待たない
+    assert second['error'] == "all api keys are cooling down"
+    assert all(b.provider.calls == 1 for b in pool.budgets)
+
+    clock.now += PooledLLMProvider.AUTH_COOLDOWN_SEC
+    asyncio.run(pool.generate_response({'id': 3}, "質問", "humans"))
+    assert sum(b.provider.calls for b in pool.budgets) == 4
@@ -0,0 +1,46 @@
+import numpy as np
+
+from survey_engine import PopulationStore
+
+
+def test_save_load_round_trip_preserves_columns(tmp_path):
+    store = PopulationStore(str(tmp_path))
+    generated = store.generate("humans", seed=7, size=500)
+    path = store.save(generated)
+    loaded = store.load(generated.key)
+
+    assert path == store.path_for(generated.key)
+    assert loaded.meta['columns'] == list(generated.columns)
+    assert loaded.vocab == generated.vocab
+    for attr, column in generated.columns.items():
+        assert isinstance(loaded.columns[attr], np.memmap)
+        assert loaded.columns[attr].dtype == column.dtype == np.uint8
+        assert loaded.columns[attr].shape == (500,)
+        np.testing.assert_array_equal(loaded.columns[attr], column)
+    assert loaded.to_personas([0, 499]) == generated.to_personas([0, 499])
+
+
+def test_same_seed_reuses_saved_population(tmp_path):
+    store = PopulationStore(str(tmp_path))
+    first = store.get_or_create("animals", seed=3, size=200)
+    meta_path = tmp_path / first.key / "meta.json"
+    saved_at = meta_path.stat().st_mtime_ns
+
+    again = store.get_or_create("animals", seed=3, size=200)
+    assert again.key == first.key
+    assert meta_path.stat().st_mtime_ns == saved_at  # 再生成・再保存しない
+    assert again.to_personas() == first.to_personas()
+
+
+def test_seed_and_size_change_the_key(tmp_path):
+    store = PopulationStore(str(tmp_path))
+    key = store.population_key("humans", 1, 100)
+    assert key == PopulationStore(str(tmp_path / "other")).population_key("humans", 1, 100)
+    assert key != store.population_key("humans", 2, 100)
+    assert key != store.population_key("humans", 1, 101)
+    assert key != store.population_key("animals", 1, 100)
+
+    first = store.generate("humans", 1, 100)
+    second = store.generate("humans", 2, 100)
+    assert any(not np.array_equal(first.columns[a], second.columns[a]) for a in first.columns)
+    np.testing.assert_array_equal(store.generate("humans", 1, 100).columns['country'], first.columns['country'])
@@ -0,0 +1,40 @@
+import pytest
+
+from survey_engine import (ANIMAL_PROFILE_TEMPLATE, ANIMAL_SURVEY_INSTRUCTIONS, HUMAN_PROFILE_TEMPLATE,
+                           HUMAN_SURVEY_INSTRUCTIONS, prompt_cache_min_tokens)
+
+HUMAN = {'country': '日本', 'age': 42, 'gender': '女性', 'occupation': '農家', 'education': '高校',
+         'language': '日本語', 'family_status': '既婚・子あり', 'urban_rural': '農村'}
+ANIMAL = {'species': 'アフリカゾウ', 'habitat': 'サバンナ', 'size_category': '大型', 'diet_type': '草食',
+          'activity_pattern': '昼行性', 'social_structure': '群れ', 'conservation_status': '危急'}
+
+
+def test_static_instructions_have_no_template_variables():
+    # 可変部分が混ざるとペルソナごとにプレフィックスが変わりキャッシュが効かない
+    for instructions in (HUMAN_SURVEY_INSTRUCTIONS, ANIMAL_SURVEY_INSTRUCTIONS):
+        assert "{" not in instructions and "}" not in instructions
+
+
+def test_short_static_prefix_is_reported_as_not_cacheable():
+    assert prompt_cache_min_tokens("openai", "gpt-4o-mini") == 1024
+    assert prompt_cache_min_tokens("anthropic", "claude-3-haiku-20240307") == 2048
+    assert prompt_cache_min_tokens("ollama", "llama3") is None
+    assert max(len(HUMAN_SURVEY_INSTRUCTIONS), len(ANIMAL_SURVEY_INSTRUCTIONS)) < 1024
+
+
+@pytest.mark.parametrize("mode,persona", [("humans", HUMAN), ("animals", ANIMAL)])
+def test_layouts_send_the_same_instructions_in_a_different_order(mode, persona):
+    pytest.importorskip("langchain_openai")
+    from survey_engine import LangChainLLMProvider
+
+    question = "気候変動についてどう思いますか？"
+    rendered = {}
+    for layout in LangChainLLMProvider.PROMPT_LAYOUTS:
+        provider = LangChainLLMProvider("openai", "sk-test", prompt_layout=layout)
+        template = provider.human_chat_template if mode == "humans" else provider.animal_chat_template
+        rendered[layout] = [m.content for m in template.format_messages(**persona, question=question)]
+
+    profile = (HUMAN_PROFILE_TEMPLATE if mode == "humans" else ANIMAL_PROFILE_TEMPLATE).format(**persona)
+    instructions = HUMAN_SURVEY_INSTRUCTIONS if mode == "humans" else ANIMAL_SURVEY_INSTRUCTIONS
+    assert rendered["classic"] == [f"{profile}\n\n{instructions}", question]
+    assert rendered["cache_friendly"] == [instructions, f"{profile}\n\n{question}"]
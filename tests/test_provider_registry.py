@@ -0,0 +1,77 @@
+import time
+import types
+
+import pytest
+
+import survey_engine
+from survey_engine import ProviderRegistry
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    created = []
+
+    def fake_create_provider(provider_type, mode, api_key="", model_name=None, **options):
+        created.append((provider_type, mode, api_key, model_name))
+        return object()
+
+    monkeypatch.setattr(survey_engine, "time", types.SimpleNamespace(monotonic=clock.monotonic, time=time.time))
+    monkeypatch.setattr(survey_engine, "create_provider", fake_create_provider)
+    clock.created = created
+    return clock
+
+
+def test_reuses_entries_keyed_on_provider_model_and_keys(clock):
+    registry = ProviderRegistry()
+    first, created = registry.get_or_create("openai", "humans", "sk-one", "gpt-4o-mini")
+    again, created_again = registry.get_or_create("openai", "animals", " sk-one ", "gpt-4o-mini")
+    assert created and not created_again
+    assert again is first  # モードとキー前後の空白は同じクライアント
+
+    assert registry.get_or_create("openai", "humans", "sk-two", "gpt-4o-mini")[1]
+    assert registry.get_or_create("openai", "humans", "sk-one", "gpt-4o")[1]
+    assert registry.get_or_create("anthropic", "humans", "sk-one", "gpt-4o-mini")[1]
+    assert len(registry) == 4 and len(clock.created) == 4
+
+
+def test_simulation_entries_are_per_mode(clock):
+    registry = ProviderRegistry()
+    humans = registry.get_or_create("simulation", "humans")[0]
+    animals = registry.get_or_create("simulation", "animals")[0]
+    assert humans is not animals
+    assert registry.get_or_create("simulation", "humans")[0] is humans
+
+
+def test_idle_entries_expire_after_ttl(clock):
+    registry = ProviderRegistry(idle_ttl_sec=60.0)
+    first = registry.get_or_create("openai", "humans", "sk-one")[0]
+
+    clock.now += 59.0
+    assert registry.get_or_create("openai", "humans", "sk-one")[0] is first  # 使うとTTLが延びる
+    clock.now += 59.0
+    assert registry.get_or_create("openai", "humans", "sk-one")[0] is first
+
+    clock.now += 61.0
+    replaced, created = registry.get_or_create("openai", "humans", "sk-one")
+    assert created and replaced is not first
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    registry = ProviderRegistry(max_entries=2)
+    a = registry.get_or_create("openai", "humans", "sk-a")[0]
+    registry.get_or_create("openai", "humans", "sk-b")
+    registry.get_or_create("openai", "humans", "sk-a")  # aを最近使用にする
+    registry.get_or_create("openai", "humans", "sk-c")
+
+    assert len(registry) == 2
+    assert registry.get_or_create("openai", "humans", "sk-a")[0] is a
+    assert registry.get_or_create("openai", "humans", "sk-b")[1]  # bが追い出されていた
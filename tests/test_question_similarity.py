@@ -0,0 +1,41 @@
+from survey_engine import EVIDENCE_BASED_QUESTIONS, QuestionSimilarityIndex, ResponseRecord, SurveyStore
+
+
+def make_store(tmp_path, population_key):
+    store = SurveyStore(str(tmp_path / "surveys.db"))
+    personas = {1: {'id': 1, 'country': '日本', 'age': 30, 'gender': '女性'}}
+    for question in EVIDENCE_BASED_QUESTIONS.values():
+        store.save_survey("humans", question, [ResponseRecord(1, 0, "心配です")], personas,
+                          provider="openai", model="gpt-4o-mini", population_key=population_key)
+    return store
+
+
+def test_reworded_question_clears_default_threshold(tmp_path):
+    store = make_store(tmp_path, "seed:42")
+    match = store.find_similar_survey("森林破壊を食い止めるには何が必要だと思いますか？", "humans", "seed:42",
+                                      "openai", "gpt-4o-mini")
+    assert match['question'] == EVIDENCE_BASED_QUESTIONS["森林破壊への対策"]
+    assert match['similarity'] >= QuestionSimilarityIndex.REUSE_THRESHOLD
+
+
+def test_unrelated_question_stays_below_default_threshold(tmp_path):
+    store = make_store(tmp_path, "seed:42")
+    match = store.find_similar_survey("通勤にはどのくらい時間がかかりますか？", "humans", "seed:42",
+                                      "openai", "gpt-4o-mini")
+    assert match['similarity'] < QuestionSimilarityIndex.REUSE_THRESHOLD
+
+
+def test_paraphrases_outscore_question_template_overlap():
+    index = QuestionSimilarityIndex()
+    for name, question in EVIDENCE_BASED_QUESTIONS.items():
+        index.add(name, question)
+    _, _, paraphrase = index.most_similar("種の絶滅をどの程度心配していますか？")[0]
+    _, _, template_only = index.most_similar("海洋汚染はどのくらい深刻だと思いますか？")[0]
+    assert paraphrase >= QuestionSimilarityIndex.REUSE_THRESHOLD > template_only
+
+
+def test_population_without_key_still_matches(tmp_path):
+    store = make_store(tmp_path, None)
+    match = store.find_similar_survey(EVIDENCE_BASED_QUESTIONS["環境教育の重要性"], "humans", None,
+                                      "openai", "gpt-4o-mini")
+    assert match is not None and match['similarity'] > 0.99
@@ -0,0 +1,20 @@
+import pandas as pd
+
+from survey_engine import ResponseClassifier
+
+
+def test_negated_support_keywords_are_skeptical():
+    labels = ResponseClassifier().classify(pd.Series([
+        '対策は必要ないと思います。',
+        '大げさだと思うし、対策は必要ないです。'
+    ]))
+    assert list(labels['stance']) == ['懐疑的', '懐疑的']
+
+
+def test_support_keywords_without_negation_stay_supportive():
+    labels = ResponseClassifier().classify(pd.Series(['早急に対策が必要だと思います。']))
+    assert labels['stance'].iloc[0] == '積極的対策支持'
+
+
+def test_empty_input_returns_empty_frame():
+    assert ResponseClassifier().classify(pd.Series([], dtype=object)).empty
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from survey_engine import ResponseRecord, StratifiedSampler
+
+
+def test_allocation_never_exceeds_population():
+    sampler = StratifiedSampler("humans", 100, seed=0)
+    populations = {key: stratum['population'] for key, stratum in sampler.strata.items()}
+    assert sum(populations.values()) == 100
+    assert all(sampler.allocation[key] <= populations[key] for key in populations)
+    assert len(sampler.generate_sample()) <= 100
+
+
+def test_large_population_allocation_is_proportional():
+    sampler = StratifiedSampler("humans", 1_000_000, seed=0)
+    n = sampler.required_sample_size()
+    assert n == 385
+    for key, stratum in sampler.strata.items():
+        assert sampler.allocation[key] == max(StratifiedSampler.MIN_PER_STRATUM, round(n * stratum['share']))
+
+
+def test_population_smaller_than_strata_count_is_rejected():
+    with pytest.raises(ValueError):
+        StratifiedSampler("humans", 10, seed=0)
+
+
+def two_strata(sampler):
+    """2層だけの設計に差し替え（構成比 0.25 / 0.75、層の人数 40 / 120）"""
+    sampler.strata = {'a': {'share': 0.25, 'population': 40}, 'b': {'share': 0.75, 'population': 120}}
+    return sampler
+
+
+def test_estimate_mean_weights_strata_and_applies_fpc():
+    sampler = two_strata(StratifiedSampler("humans", 100_000, seed=0))
+    a, b = [1.0, 0.0, 1.0, 1.0], [0.0, 0.0, 1.0, 0.0, 0.0, 0.0]
+    result = sampler.estimate_mean({'a': a, 'b': b})
+
+    expected = 0.25 * np.mean(a) + 0.75 * np.mean(b)
+    variance = (0.25 ** 2 * (1 - 4 / 40) * np.var(a, ddof=1) / 4
+                + 0.75 ** 2 * (1 - 6 / 120) * np.var(b, ddof=1) / 6)
+    assert result['estimate'] == pytest.approx(expected)
+    assert result['se'] == pytest.approx(np.sqrt(variance))
+    assert result['ci_low'] == pytest.approx(expected - 1.96 * np.sqrt(variance))
+    assert result['ci_high'] == pytest.approx(expected + 1.96 * np.sqrt(variance))
+    assert result['n'] == 10
+
+
+def test_census_of_a_stratum_has_no_sampling_error():
+    sampler = two_strata(StratifiedSampler("humans", 100_000, seed=0))
+    sampler.strata['a']['population'] = 4
+    result = sampler.estimate_mean({'a': [1.0, 0.0, 1.0, 1.0]})
+    assert result['estimate'] == pytest.approx(0.75)
+    assert result['se'] == 0.0
+
+
+def test_estimate_from_responses_groups_by_stratum():
+    sampler = two_strata(StratifiedSampler("humans", 100_000, seed=0))
+    sampler.stratum_by_persona = {1: 'a', 2: 'a', 3: 'b', 4: 'b'}
+    responses = [ResponseRecord(1, 0, "はい"), ResponseRecord(2, 0, "はい"),
+                 ResponseRecord(3, 0, "いいえ"), ResponseRecord(4, 0, "はい"), ResponseRecord(99, 0, "はい")]
+    result = sampler.estimate_from_responses(responses, lambda r: float(r.response == "はい"))
+    assert result['estimate'] == pytest.approx(0.25 * 1.0 + 0.75 * 0.5)
+    assert result['n'] == 4
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import time
+from dataclasses import asdict
+
+import pytest
+
+import survey_cli
+from survey_cli import run_batch_survey
+from survey_engine import LangChainCostTracker, PersonaGenerator, ReplayProvider, SurveyStore, load_cassette
+
+
+def test_record_path_requires_an_llm_provider(tmp_path):
+    personas = [{'id': 1, 'age': 30}]
+    with pytest.raises(ValueError):
+        run_batch_survey(personas, ["質問"], provider_type="simulation", record_path=str(tmp_path / "c.jsonl"))
+    assert not (tmp_path / "c.jsonl").exists()
+
+
+class RecordingFakeProvider:
+    """LangChainLLMProviderと同じ形で記録するテスト用プロバイダー（応答は入力から決まる）"""
+
+    provider_type = "openai"
+    model_name = "gpt-4o-mini"
+    prompt_layout = "classic"
+
+    def __init__(self):
+        self.cost_tracker = LangChainCostTracker()
+        self.recorder = None
+
+    def set_recorder(self, recorder):
+        self.recorder = recorder
+
+    async def generate_response(self, persona, question, mode, stream=False, on_token=None, history=None):
+        result = {'success': True, 'response': f"{persona['country']}の{persona['age']}歳として心配です",
+                  'cost_usd': 0.0002, 'tokens_used': 120, 'input_tokens': 100, 'output_tokens': 20,
+                  'provider': self.provider_type}
+        self.cost_tracker.record_result(result)
+        if self.recorder:
+            self.recorder.record(self, persona, question, mode, history, result, 0.01)
+        return result
+
+
+def human_personas(n):
+    generator = PersonaGenerator("humans", seed=0)
+    return [asdict(generator.generate_persona(i + 1)) for i in range(n)]
+
+
+@pytest.fixture
+def cassette(tmp_path, monkeypatch):
+    monkeypatch.setattr(survey_cli, "create_provider", lambda *args, **kwargs: RecordingFakeProvider())
+    path = tmp_path / "cassette.jsonl"
+    recorded = run_batch_survey(human_personas(5), ["気候変動は心配ですか？"], provider_type="openai",
+                                api_key="sk-test", record_path=str(path))
+    return path, recorded
+
+
+def test_record_then_replay_round_trip(tmp_path, cassette):
+    path, recorded = cassette
+    assert len(load_cassette(str(path))) == 5
+
+    store_path = str(tmp_path / "surveys.db")
+    replayed = run_batch_survey(human_personas(5), ["気候変動は心配ですか？"], replay_path=str(path),
+                                replay_speed=100.0, store_path=store_path)
+    assert replayed['summary']['replay']['hits'] == 5
+    assert replayed['summary']['replay']['misses'] == 0
+    assert list(replayed['results']['response']) == list(recorded['results']['response'])
+    assert replayed['summary']['provider'] == "replay:openai"
+    assert replayed['summary']['model'] == "gpt-4o-mini"
+
+    stored = SurveyStore(store_path).read_sql("SELECT provider, model FROM surveys", [])
+    assert stored.to_dict('records') == [{'provider': "replay:openai", 'model': "gpt-4o-mini"}]
+
+
+def test_replay_miss_uses_successful_recordings_only(cassette):
+    path, _ = cassette
+    failure = {**load_cassette(str(path))[0], 'key': "failed", 'success': False, 'output': "エラー: timeout",
+               'latency_sec': 30.0, 'error': "timeout", 'error_type': "TimeoutError", 'status_code': None}
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(failure, ensure_ascii=False) + "\n")
+
+    provider = ReplayProvider(str(path), "humans")
+    assert 30.0 not in provider.latencies
+    started = time.perf_counter()
+    result = asyncio.run(provider.generate_response(human_personas(1)[0], "まったく別の質問です", "humans"))
+    assert time.perf_counter() - started < 1.0
+    assert result['success'] and result['replay'] == 'miss'
+    assert provider.get_stats()['misses'] == 1
+
+
+def test_load_personas_assigns_missing_ids_from_csv(tmp_path):
+    path = tmp_path / "population.csv"
+    path.write_text("id,age\n5,30\n,41\n2.0,52\n,63\n", encoding="utf-8")
+    personas = survey_cli.load_personas("human", population_file=str(path))
+    assert [p['id'] for p in personas] == [5, 6, 2, 7]
+    assert all(type(p['id']) is int for p in personas)
+
+
+def test_load_personas_assigns_ids_when_json_has_none(tmp_path):
+    path = tmp_path / "population.json"
+    path.write_text(json.dumps([{'age': 30}, {'age': 41}]), encoding="utf-8")
+    personas = survey_cli.load_personas("human", population_file=str(path))
+    assert [p['id'] for p in personas] == [1, 2]
+
+
+@pytest.mark.parametrize("name, content", [
+    ("population.csv", "id,age\n1,30\n1,41\n"),
+    ("population.jsonl", '{"id": "3", "age": 30}\n{"id": 3, "age": 41}\n'),
+])
+def test_load_personas_rejects_duplicate_ids(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_text(content, encoding="utf-8")
+    with pytest.raises(ValueError):
+        survey_cli.load_personas("human", population_file=str(path))
@@ -0,0 +1,46 @@
+import asyncio
+
+from survey_engine import run_survey_pipeline
+
+
+class CountingProvider:
+    """同時実行数と呼び出し回数を記録するテスト用プロバイダー"""
+
+    def __init__(self, cost_usd=0.0):
+        self.cost_usd = cost_usd
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+        self.max_tasks = 0
+
+    async def generate_response(self, persona, question, mode, stream=False, on_token=None, history=None):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.max_tasks = max(self.max_tasks, len(asyncio.all_tasks()))
+        await asyncio.sleep(0.001)
+        self.in_flight -= 1
+        return {'success': True, 'response': f"回答{persona['id']}", 'cost_usd': self.cost_usd,
+                'tokens_used': 10, 'provider': 'test'}
+
+
+def personas(n):
+    return [{'id': i + 1, 'age': 30} for i in range(n)]
+
+
+def test_workers_bound_concurrency_and_tasks():
+    provider = CountingProvider()
+
+    outcome = asyncio.run(run_survey_pipeline(provider, personas(200), "質問", "humans", concurrency=4))
+    assert provider.max_in_flight <= 4
+    assert provider.max_tasks <= 4 + 1  # ワーカー＋メインタスク（ペルソナ数に比例しない）
+    assert [r.persona_id for r in outcome['responses']] == list(range(1, 201))
+
+
+def test_budget_stops_handing_out_work():
+    provider = CountingProvider(cost_usd=1.0)
+    outcome = asyncio.run(run_survey_pipeline(provider, personas(100), "質問", "humans",
+                                              concurrency=1, budget_usd=3.0))
+    assert provider.calls == 3
+    assert outcome['budget_exhausted']
+    assert outcome['total_cost'] == 3.0
@@ -0,0 +1,40 @@
+import threading
+import time
+
+from survey_profiler import SurveyProfiler
+
+
+def idle_worker(stop):
+    stop.wait()
+
+
+def busy_worker(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+
+
+def sampled_functions(profiler):
+    return {frame.split(' ')[0] for stack in profiler.stacks for frame in stack[1:]}
+
+
+def test_samples_only_the_profiled_call_and_its_workers(tmp_path):
+    stop = threading.Event()
+    idle = threading.Thread(target=idle_worker, args=(stop,), name="unrelated-idle", daemon=True)
+    idle.start()
+    try:
+        with SurveyProfiler("threads", root=str(tmp_path), interval_sec=0.002) as profiler:
+            worker = threading.Thread(target=busy_worker, args=(0.2,), name="spawned-worker")
+            worker.start()
+            busy_worker(0.2)
+            worker.join()
+    finally:
+        stop.set()
+        idle.join()
+
+    functions = sampled_functions(profiler)
+    thread_names = {stack[0] for stack in profiler.stacks}
+    assert 'busy_worker' in functions
+    assert 'idle_worker' not in functions
+    assert 'spawned-worker' in thread_names and 'unrelated-idle' not in thread_names
+    assert threading.current_thread().name in thread_names
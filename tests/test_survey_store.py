@@ -0,0 +1,82 @@
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+import pytest
+
+from survey_engine import ResponseRecord, SurveyStore
+
+PERSONAS = {
+    1: {'id': 1, 'continent': 'アジア', 'country': '日本', 'age': 22, 'gender': '女性'},
+    2: {'id': 2, 'continent': 'アジア', 'country': 'インド', 'age': 45, 'gender': '男性'},
+    3: {'id': 3, 'continent': 'ヨーロッパ', 'country': 'ドイツ', 'age': 70, 'gender': '女性'},
+}
+
+
+def labels(stances):
+    return pd.DataFrame({'stance': stances, 'concern_level': ['高'] * len(stances),
+                         'concern_score': [0.5] * len(stances), 'topics': [''] * len(stances)})
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SurveyStore(str(tmp_path / "surveys.db"))
+    store.save_survey("humans", "気候変動は心配ですか？",
+                      [ResponseRecord(1, 0, "とても心配", cost_usd=0.01), ResponseRecord(2, 0, "心配", cost_usd=0.01),
+                       ResponseRecord(3, 0, "❌ エラー", success=False)],
+                      PERSONAS, labels(['積極的対策支持', '慎重・両立重視', '中立・その他']),
+                      provider="openai", model="gpt-4o-mini")
+    store.save_survey("humans", "森林破壊を止めるには？",
+                      [ResponseRecord(1, 0, "植林"), ResponseRecord(3, 0, "分からない")],
+                      PERSONAS, labels(['積極的対策支持', '懐疑的']), provider="simulation")
+    return store
+
+
+def test_connections_use_wal(store):
+    with closing(store.connect()) as connection:
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_query_responses_filters(store):
+    rows = store.query_responses({'country': ['日本', 'ドイツ'], 'provider': 'openai'})
+    assert sorted(rows['persona_id']) == [1, 3]
+
+    rows = store.query_responses({'question_contains': '森林', 'stance': '懐疑的'}, columns=['question', 'country'])
+    assert rows[['persona_id', 'country']].to_dict('records') == [{'persona_id': 3, 'country': 'ドイツ'}]
+
+    assert len(store.query_responses(limit=2)) == 2
+
+
+def test_aggregate_shares_exclude_failures(store):
+    table = store.aggregate('continent', 'stance').set_index('continent')
+    assert table.loc['アジア', '回答数'] == 3
+    assert table.loc['ヨーロッパ', '回答数'] == 1  # 失敗回答は集計しない
+    assert table.loc['ヨーロッパ', '懐疑的'] == 100.0
+    assert table.loc['アジア', '積極的対策支持'] == pytest.approx(66.7)
+    assert store.aggregate('continent', filters={'provider': 'anthropic'}).empty
+
+
+def test_summarize_by_provider(store):
+    summary = store.summarize('provider').set_index('provider')
+    assert summary.loc['openai', '回答数'] == 3
+    assert summary.loc['openai', '成功率'] == pytest.approx(66.7)
+    assert summary.loc['openai', 'コスト_usd'] == pytest.approx(0.02)
+    assert summary.loc['simulation', '回答数'] == 2
+
+
+def test_list_surveys_filters_by_date_and_question(store):
+    assert len(store.list_surveys({'since': '2000-01-01'})) == 2
+    assert len(store.list_surveys({'until': '2000-01-01'})) == 0
+    assert store.list_surveys({'question_contains': '気候'})['provider'].tolist() == ['openai']
+
+
+@pytest.mark.parametrize("column", ["response", "persona_id; DROP TABLE responses", "s.population_key"])
+def test_group_by_and_filters_use_a_column_whitelist(store, column):
+    with pytest.raises(ValueError):
+        store.aggregate(column)
+    with pytest.raises(ValueError):
+        store.summarize(column)
+    with pytest.raises(ValueError):
+        store.query_responses({column: 'x'})
+    with closing(sqlite3.connect(store.path)) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 5